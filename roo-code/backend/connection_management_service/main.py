@@ -4,7 +4,9 @@ import requests
 import json
 import logging
 import os
-from typing import List, Dict, Any # 新增 List, Dict, Any
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple # 新增 List, Dict, Any
 from . import nmos_registry_service # 导入注册服务，以便访问 get_current_user
 
 app = FastAPI(title="NMOS Connection Management Service (IS-05)")
@@ -37,36 +39,71 @@ class BulkConnectionRequest(BaseModel):
     connections: List[ConnectionRequest]
 
 
+class RegistryResourceClient:
+    """
+    通过注册服务的 GET /resources/{type}/{id} 获取单个资源，并保存一个小型 LRU 缓存。
+    缓存条目以资源的 ETag (即 IS-04 version) 校验: 每次查询发送 If-None-Match，
+    未变化时注册服务返回 304，无需再次传输和解析资源体。
+    """
+
+    def __init__(self, base_url: str, max_entries: int = 512, timeout: float = 5.0):
+        self.base_url = base_url.rstrip('/')
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.session = requests.Session() # 复用 keep-alive 连接
+        self._cache: "OrderedDict[Tuple[str, str], Tuple[str, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, resource_type_plural: str, resource_id: str) -> Optional[Dict[str, Any]]:
+        key = (resource_type_plural, resource_id)
+        with self._lock:
+            cached = self._cache.get(key)
+        headers = {"If-None-Match": cached[0]} if cached else {}
+        response = self.session.get(f"{self.base_url}/resources/{resource_type_plural}/{resource_id}",
+                                    headers=headers, timeout=self.timeout)
+        if response.status_code == 304 and cached:
+            with self._lock:
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+            return cached[1]
+        if response.status_code == 404:
+            with self._lock:
+                self._cache.pop(key, None)
+            return None
+        response.raise_for_status()
+        resource = response.json()
+        etag = response.headers.get("ETag")
+        with self._lock:
+            if etag:
+                self._cache[key] = (etag, resource)
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+            else:
+                self._cache.pop(key, None)
+        return resource
+
+registry_resource_client = RegistryResourceClient(
+    REGISTRY_SERVICE_URL,
+    max_entries=int(os.getenv("REGISTRY_RESOURCE_CACHE_SIZE", "512"))
+) if REGISTRY_SERVICE_URL else None
+
+
 def get_nmos_resource_from_registry(resource_type_plural: str, resource_id: str) -> Dict[str, Any] | None:
     """
     辅助函数：从注册服务获取单个NMOS资源。
     resource_type_plural 应该是 "senders", "receivers", "devices" 等。
     """
-    if not REGISTRY_SERVICE_URL:
+    if not registry_resource_client:
         # 这个错误不应该直接暴露给客户端为 HTTPException，除非是请求处理的直接结果
         # 对于内部函数，最好是记录错误并返回 None 或抛出自定义内部异常
         logger.error("内部错误: 注册服务URL未配置，无法获取资源。")
         return None
 
     try:
-        registry_resources_url = f"{REGISTRY_SERVICE_URL.rstrip('/')}/resources"
-        response = requests.get(registry_resources_url, timeout=5)
-        response.raise_for_status() 
-        
-        all_resources = response.json()
-        if resource_type_plural in all_resources and isinstance(all_resources[resource_type_plural], dict):
-            # nmos_registry_service 现在返回的是字典
-            return all_resources[resource_type_plural].get(resource_id)
-        elif resource_type_plural in all_resources and isinstance(all_resources[resource_type_plural], list):
-            # Fallback if registry still returns lists (should be updated based on previous changes)
-            logger.warning(f"注册服务为 '{resource_type_plural}' 返回了列表格式，期望字典格式。将进行线性搜索。")
-            for resource in all_resources[resource_type_plural]:
-                if resource.get("id") == resource_id:
-                    return resource
-            return None
-        return None
+        return registry_resource_client.get(resource_type_plural, resource_id)
     except requests.exceptions.RequestException as e:
-        logger.error(f"请求注册服务 ({registry_resources_url}) 失败: {e}")
+        logger.error(f"请求注册服务获取 {resource_type_plural}/{resource_id} 失败: {e}")
         # 同样，这个内部错误不应直接导致 HTTPException，除非在请求处理路径中
         return None # 或者抛出内部异常
     except json.JSONDecodeError as e:
@@ -0,0 +1,100 @@
+"""
+Non-blocking authentication helpers for the NMOS Registry Service.
+
+bcrypt is slow on purpose: one ``checkpw``/``hashpw`` takes hundreds of
+milliseconds. ``PasswordHasher`` runs that work on a small dedicated thread
+pool, so a burst of logins queues there instead of stalling the event loop
+that serves ``/resources`` and the push channels. The queue is bounded:
+beyond ``max_pending`` waiting jobs ``PasswordHasherBusy`` is raised and the
+caller answers 503.
+
+``TokenCache`` remembers bearer tokens that already passed ``jwt.decode``,
+keyed by the token's SHA-256 digest (raw tokens are never held) and kept no
+longer than the token's own ``exp``. It is a small LRU used from the event
+loop only.
+"""
+
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+class PasswordHasherBusy(Exception):
+    """Too many password operations are already queued."""
+
+
+class PasswordHasher:
+    def __init__(self, max_workers: int = 2, max_pending: int = 64):
+        self.max_workers = max(1, max_workers)
+        self.max_pending = max(self.max_workers, max_pending)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="bcrypt")
+        self._pending = 0
+        self.completed = 0
+        self.rejected = 0
+
+    async def run(self, fn: Callable[..., Any], *args) -> Any:
+        """Runs a blocking password function (``security_config.verify_password`` ...) on the pool."""
+        if self._pending >= self.max_pending:
+            self.rejected += 1
+            raise PasswordHasherBusy(f"{self._pending} password operations already queued")
+        self._pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self._pending -= 1
+            self.completed += 1
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, int]:
+        return {"workers": self.max_workers, "pending": self._pending, "max_pending": self.max_pending,
+                "completed": self.completed, "rejected": self.rejected}
+
+
+class TokenCache:
+    def __init__(self, max_entries: int = 1024, clock: Callable[[], float] = time.time):
+        self.max_entries = max(1, max_entries)
+        self.clock = clock
+        self._entries: "OrderedDict[bytes, Tuple[str, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode("utf-8")).digest()
+
+    def get(self, token: str) -> Optional[str]:
+        """Returns the verified subject of ``token``, or None if it is not cached (or has expired)."""
+        key = self._key(token)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        subject, expires_at = entry
+        if expires_at <= self.clock():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return subject
+
+    def put(self, token: str, subject: str, expires_at: Optional[float]):
+        # Without an expiry there is nothing to bound the entry by, so it is not cached
+        if expires_at is None or expires_at <= self.clock():
+            return
+        key = self._key(token)
+        self._entries[key] = (subject, float(expires_at))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "max_entries": self.max_entries, "hits": self.hits, "misses": self.misses}
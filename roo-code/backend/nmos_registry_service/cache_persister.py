@@ -0,0 +1,548 @@
+"""
+Write-behind persistence of the resource cache into the PostgreSQL schema.
+
+``database/init.sql`` defines one table per IS-04 resource type, keyed by a
+serial ``id``, with the NMOS id in ``nmos_id`` and references between the
+tables as foreign keys to those serial ids. ``CachePersister`` keeps the
+tables in step with the cache without ever sitting on the ingest path:
+
+* it tails the resource change log from its own thread, as the push
+  broadcaster does, so ingest pays nothing beyond the change log append it
+  already makes;
+* pending changes are coalesced per resource id (the last change wins) and
+  flushed once ``max_batch`` resources are pending or the oldest pending
+  change is ``flush_interval`` old;
+* a flush is one transaction: bulk lookups of the referenced serial ids,
+  multi-row upserts in parent-to-child order, then bulk deletes;
+* when it cannot follow the change log - at start-up, after a wholesale
+  cache replacement, or when the log ring overtook it - it reconciles the
+  tables against a store snapshot instead. Rows missing from the cache are
+  only deleted once ``complete()`` says the cache holds the whole inventory:
+  a cache still warming up (or whose registry is unreachable) would
+  otherwise empty the tables, and the cascades would take the connections,
+  audio channels and event rules referring to them along.
+
+A failing database only delays persistence: pending changes stay coalesced
+in memory (at most one entry per cached resource) and are retried with
+backoff.
+
+``database_url`` is ``postgresql://...`` (psycopg2) or ``sqlite:///<path>``
+as a local stand-in, for which the resource tables are created on connect.
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import change_log
+import resource_index
+import resource_store
+import resync
+
+logger = logging.getLogger(__name__)
+
+# Parents before children, so that a child's references resolve within one flush
+TABLE_ORDER = ["nodes", "devices", "sources", "flows", "senders", "receivers"]
+
+# table -> foreign key column -> (referenced table, path of the referenced NMOS id in the resource)
+FOREIGN_KEYS: Dict[str, Dict[str, Tuple[str, Tuple[str, ...]]]] = {
+    "nodes": {},
+    "devices": {"node_id": ("nodes", ("node_id",))},
+    "sources": {"device_id": ("devices", ("device_id",))},
+    "flows": {"source_id": ("sources", ("source_id",)), "device_id": ("devices", ("device_id",))},
+    "senders": {"flow_id": ("flows", ("flow_id",)), "device_id": ("devices", ("device_id",))},
+    "receivers": {"device_id": ("devices", ("device_id",)),
+                  "subscription_sender_id": ("senders", ("subscription", "sender_id"))},
+}
+# References declared ON DELETE SET NULL; all others cascade
+SET_NULL_KEYS = {("receivers", "subscription_sender_id")}
+
+
+def child_references(table: str, cascading_only: bool = False) -> List[Tuple[str, str]]:
+    """``(child table, index field)`` of the references to ``table``."""
+    return [(child, ".".join(path)) for child, references in FOREIGN_KEYS.items()
+            for column, (parent, path) in references.items()
+            if parent == table and not (cascading_only and (child, column) in SET_NULL_KEYS)]
+
+
+def _short(value: Any) -> Optional[str]:
+    # init.sql declares these VARCHAR(255)
+    return value[:255] if isinstance(value, str) else None
+
+
+def _text(value: Any) -> Optional[str]:
+    return value if isinstance(value, str) else None
+
+
+def _api_version(node: Dict[str, Any]) -> Optional[str]:
+    versions = (node.get("api") or {}).get("versions") or []
+    return _short(versions[-1]) if versions else None
+
+
+def _device_type(device: Dict[str, Any]) -> Optional[str]:
+    # The cache keeps the singular resource type in "type"; the IS-04 device type URN may sit in "device_type"
+    device_type = device.get("device_type") or device.get("type")
+    return _short(device_type) if isinstance(device_type, str) and device_type.startswith("urn:") else None
+
+
+def _port(value: Any) -> Optional[int]:
+    return value if isinstance(value, int) and not isinstance(value, bool) else None
+
+
+# table -> plain column -> value taken from the resource
+COLUMNS: Dict[str, Dict[str, Callable[[Dict[str, Any]], Any]]] = {
+    "nodes": {
+        "label": lambda r: _short(r.get("label")),
+        "description": lambda r: _text(r.get("description")),
+        "hostname": lambda r: _short(r.get("hostname")),
+        "api_version": _api_version,
+    },
+    "devices": {
+        "label": lambda r: _short(r.get("label")),
+        "description": lambda r: _text(r.get("description")),
+        "type": _device_type,
+    },
+    "sources": {
+        "label": lambda r: _short(r.get("label")),
+        "description": lambda r: _text(r.get("description")),
+        "format": lambda r: _short(r.get("format")),
+    },
+    "flows": {
+        "label": lambda r: _short(r.get("label")),
+        "description": lambda r: _text(r.get("description")),
+        "format": lambda r: _short(r.get("format")),
+        "media_type": lambda r: _short(r.get("media_type")),
+    },
+    "senders": {
+        "label": lambda r: _short(r.get("label")),
+        "description": lambda r: _text(r.get("description")),
+        "transport": lambda r: _short(r.get("transport")),
+        "destination_host": lambda r: _short(r.get("destination_host")),
+        "destination_port": lambda r: _port(r.get("destination_port")),
+    },
+    "receivers": {
+        "label": lambda r: _short(r.get("label")),
+        "description": lambda r: _text(r.get("description")),
+        "format": lambda r: _short(r.get("format")),
+        "transport": lambda r: _short(r.get("transport")),
+    },
+}
+
+# The resource tables of init.sql in SQLite syntax, for the local stand-in
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, nmos_id VARCHAR(255) UNIQUE NOT NULL,
+    label VARCHAR(255), description TEXT, hostname VARCHAR(255), api_version VARCHAR(50),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+CREATE TABLE IF NOT EXISTS devices (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, nmos_id VARCHAR(255) UNIQUE NOT NULL,
+    node_id INTEGER REFERENCES nodes(id) ON DELETE CASCADE,
+    label VARCHAR(255), description TEXT, type VARCHAR(255),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+CREATE TABLE IF NOT EXISTS sources (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, nmos_id VARCHAR(255) UNIQUE NOT NULL,
+    device_id INTEGER REFERENCES devices(id) ON DELETE CASCADE,
+    label VARCHAR(255), description TEXT, format VARCHAR(255),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+CREATE TABLE IF NOT EXISTS flows (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, nmos_id VARCHAR(255) UNIQUE NOT NULL,
+    source_id INTEGER REFERENCES sources(id) ON DELETE CASCADE,
+    device_id INTEGER REFERENCES devices(id) ON DELETE CASCADE,
+    label VARCHAR(255), description TEXT, format VARCHAR(255), media_type VARCHAR(255),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+CREATE TABLE IF NOT EXISTS senders (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, nmos_id VARCHAR(255) UNIQUE NOT NULL,
+    flow_id INTEGER REFERENCES flows(id) ON DELETE CASCADE,
+    device_id INTEGER REFERENCES devices(id) ON DELETE CASCADE,
+    label VARCHAR(255), description TEXT, transport VARCHAR(255),
+    destination_host VARCHAR(255), destination_port INTEGER,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+CREATE TABLE IF NOT EXISTS receivers (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, nmos_id VARCHAR(255) UNIQUE NOT NULL,
+    device_id INTEGER REFERENCES devices(id) ON DELETE CASCADE,
+    label VARCHAR(255), description TEXT, format VARCHAR(255), transport VARCHAR(255),
+    subscription_sender_id INTEGER REFERENCES senders(id) ON DELETE SET NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+"""
+
+
+def table_columns(table: str) -> List[str]:
+    return ["nmos_id", *FOREIGN_KEYS[table], *COLUMNS[table]]
+
+
+def _upsert_sql(table: str, values: str) -> str:
+    columns = table_columns(table)
+    assignments = ", ".join(f"{column} = excluded.{column}" for column in columns[1:])
+    return (f"INSERT INTO {table} ({', '.join(columns)}) VALUES {values} "
+            f"ON CONFLICT (nmos_id) DO UPDATE SET {assignments}, updated_at = CURRENT_TIMESTAMP")
+
+
+class PostgresBackend:
+    """psycopg2: multi-row ``INSERT ... ON CONFLICT`` pages and ``= ANY(array)`` lookups."""
+
+    def __init__(self, database_url: str, page_size: int = 1000):
+        import psycopg2
+        import psycopg2.extras
+        self._psycopg2 = psycopg2
+        self.database_url = database_url
+        self.page_size = page_size
+        self.errors: Tuple[type, ...] = (psycopg2.Error,)
+
+    def connect(self):
+        return self._psycopg2.connect(self.database_url)
+
+    def upsert(self, cursor, table: str, rows: List[tuple]):
+        self._psycopg2.extras.execute_values(cursor, _upsert_sql(table, "%s"), rows, page_size=self.page_size)
+
+    def select_ids(self, cursor, table: str, nmos_ids: Iterable[str]) -> Dict[str, int]:
+        cursor.execute(f"SELECT nmos_id, id FROM {table} WHERE nmos_id = ANY(%s)", (list(nmos_ids),))
+        return dict(cursor.fetchall())
+
+    def all_nmos_ids(self, cursor, table: str) -> Set[str]:
+        cursor.execute(f"SELECT nmos_id FROM {table}")
+        return {row[0] for row in cursor.fetchall()}
+
+    def delete(self, cursor, table: str, nmos_ids: Iterable[str]):
+        cursor.execute(f"DELETE FROM {table} WHERE nmos_id = ANY(%s)", (list(nmos_ids),))
+
+
+class SqliteBackend:
+    """sqlite3 stand-in: ``executemany`` upserts inside the flush transaction, chunked ``IN`` lookups."""
+
+    # Below SQLite's default limit on bound parameters
+    CHUNK = 500
+
+    def __init__(self, path: str):
+        self.path = path
+        self.errors: Tuple[type, ...] = (sqlite3.Error,)
+
+    def connect(self):
+        # Used by one thread at a time, but not necessarily the one that connected
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.execute("PRAGMA foreign_keys = ON")
+        connection.executescript(SQLITE_SCHEMA)
+        return connection
+
+    def upsert(self, cursor, table: str, rows: List[tuple]):
+        placeholders = "(" + ", ".join("?" * len(table_columns(table))) + ")"
+        cursor.executemany(_upsert_sql(table, placeholders), rows)
+
+    def _chunks(self, nmos_ids: Iterable[str]) -> Iterable[List[str]]:
+        nmos_ids = list(nmos_ids)
+        for start in range(0, len(nmos_ids), self.CHUNK):
+            yield nmos_ids[start:start + self.CHUNK]
+
+    def select_ids(self, cursor, table: str, nmos_ids: Iterable[str]) -> Dict[str, int]:
+        found: Dict[str, int] = {}
+        for chunk in self._chunks(nmos_ids):
+            cursor.execute(f"SELECT nmos_id, id FROM {table} WHERE nmos_id IN ({', '.join('?' * len(chunk))})", chunk)
+            found.update(cursor.fetchall())
+        return found
+
+    def all_nmos_ids(self, cursor, table: str) -> Set[str]:
+        cursor.execute(f"SELECT nmos_id FROM {table}")
+        return {row[0] for row in cursor.fetchall()}
+
+    def delete(self, cursor, table: str, nmos_ids: Iterable[str]):
+        for chunk in self._chunks(nmos_ids):
+            cursor.execute(f"DELETE FROM {table} WHERE nmos_id IN ({', '.join('?' * len(chunk))})", chunk)
+
+
+def backend_for(database_url: str):
+    """Backend for ``postgresql://`` / ``postgres://`` or ``sqlite:///<path>`` URLs."""
+    if database_url.startswith(("postgresql://", "postgres://")):
+        return PostgresBackend(database_url)
+    if database_url.startswith("sqlite:///"):
+        return SqliteBackend(database_url[len("sqlite:///"):])
+    raise ValueError(f"Unsupported database URL scheme: {database_url.split('://', 1)[0]}")
+
+
+class CachePersister:
+    """
+    Background thread persisting the cache behind ``store``. ``poll_interval``
+    is how often the change log is tailed; ``flush_interval`` and
+    ``max_batch`` are the time and size flush triggers. ``complete`` tells
+    whether the cache is the whole inventory, so that stale rows may go.
+    """
+
+    def __init__(self, store: resource_store.ResourceStore, backend,
+                 flush_interval: float = 1.0, max_batch: int = 1000, poll_interval: float = 0.1,
+                 backoff_factory: Callable[[], resync.Backoff] = lambda: resync.Backoff(initial=1.0, maximum=30.0),
+                 complete: Callable[[], bool] = lambda: True):
+        self.store = store
+        self.backend = backend
+        self.complete = complete
+        self.flush_interval = flush_interval
+        self.max_batch = max(1, max_batch)
+        self.poll_interval = poll_interval
+        self.backoff = backoff_factory()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._connection = None
+        # Change log position; None until the first reconciliation
+        self._epoch: Optional[str] = None
+        self._sequence = 0
+        self._reconcile_needed = True
+        # A reconciliation ran on an incomplete cache and left stale rows in place
+        self._stale_rows_kept = False
+        # resource id -> latest change, in order of last change
+        self._pending: Dict[str, change_log.ChangeEntry] = {}
+        self._oldest_pending: Optional[float] = None
+        self._retry_at = 0.0
+        self.flushes = 0
+        self.reconciliations = 0
+        self.rows_upserted = 0
+        self.rows_deleted = 0
+        self.failures = 0
+        self.last_flush_seconds: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="cache-persister", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 30.0):
+        """Stops the thread after a last attempt to write what is pending."""
+        self._stop_event.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=timeout)
+        self._thread = None
+
+    def _run(self):
+        while not self._stop_event.wait(self.poll_interval):
+            self.step()
+        self._retry_at = 0.0
+        self.step(force=True)
+        self._close()
+
+    # --- Change log tailing ---
+
+    def _tail(self):
+        log = self.store.change_log
+        while not self._reconcile_needed:
+            result = log.changes_since(self._sequence, epoch=self._epoch, limit=self.max_batch)
+            if result.resync_required:
+                logger.warning("Persistence fell behind the change log (or the cache was replaced); "
+                               "the database will be reconciled with the cache.")
+                self._reconcile_needed = True
+                self._pending.clear()
+                self._oldest_pending = None
+                return
+            for entry in result.changes:
+                # Re-inserting keeps the dict in order of last change
+                self._pending.pop(entry.resource_id, None)
+                self._pending[entry.resource_id] = entry
+            if result.changes and self._oldest_pending is None:
+                self._oldest_pending = time.monotonic()
+            self._sequence = result.changes[-1].sequence if result.changes else result.current_sequence
+            if not result.has_more:
+                return
+
+    def step(self, force: bool = False) -> bool:
+        """Tails the change log and flushes (or reconciles) if due. Returns True if it wrote."""
+        self._tail()
+        if self._stale_rows_kept and not self._reconcile_needed and self.complete():
+            self._reconcile_needed = True
+        now = time.monotonic()
+        if now < self._retry_at:
+            return False
+        due = self._reconcile_needed or (self._pending and (
+            force or len(self._pending) >= self.max_batch
+            or now - self._oldest_pending >= self.flush_interval))
+        if not due:
+            return False
+        started = time.monotonic()
+        try:
+            if self._reconcile_needed:
+                self._reconcile()
+            else:
+                self._flush()
+        except self.backend.errors as e:
+            self.failures += 1
+            self.last_error = str(e)
+            delay = self.backoff.next_delay()
+            self._retry_at = time.monotonic() + delay
+            logger.error(f"Persisting the resource cache failed ({len(self._pending)} resources pending), "
+                         f"retrying in {delay:.1f}s: {e}")
+            self._close()
+            return False
+        self.last_flush_seconds = time.monotonic() - started
+        self.last_error = None
+        self.backoff.reset()
+        return True
+
+    # --- Database writes ---
+
+    def _cursor(self):
+        if self._connection is None:
+            self._connection = self.backend.connect()
+        return self._connection.cursor()
+
+    def _close(self):
+        connection, self._connection = self._connection, None
+        if connection is not None:
+            try:
+                connection.close()
+            except self.backend.errors:
+                pass
+
+    def _flush(self):
+        pending = self._pending
+        upserts: Dict[str, Dict[str, Dict[str, Any]]] = {table: {} for table in TABLE_ORDER}
+        deletes: Dict[str, List[str]] = {table: [] for table in TABLE_ORDER}
+        for entry in pending.values():
+            if entry.resource_type not in upserts:
+                continue
+            if entry.operation == change_log.OP_DELETE:
+                deletes[entry.resource_type].append(entry.resource_id)
+            else:
+                upserts[entry.resource_type][entry.resource_id] = entry.resource
+        snapshot = self.store.snapshot
+        deleted_ids = {resource_id for ids in deletes.values() for resource_id in ids}
+        self._keep_descendants(deletes, upserts, snapshot, deleted_ids)
+        cursor = self._cursor()
+        try:
+            deleted = self._write_deletes(cursor, deletes)
+            upserted = self._write_upserts(cursor, upserts, snapshot, deleted_ids)
+            self._connection.commit()
+        except self.backend.errors:
+            self._connection.rollback()
+            raise
+        finally:
+            cursor.close()
+        self._pending = {}
+        self._oldest_pending = None
+        self.flushes += 1
+        self.rows_upserted += upserted
+        self.rows_deleted += deleted
+        logger.debug(f"Persisted {upserted} upserts and {deleted} deletes ({len(pending)} coalesced changes).")
+
+    def _write_deletes(self, cursor, deletes: Dict[str, Iterable[str]]) -> int:
+        deleted = 0
+        for table in reversed(TABLE_ORDER):
+            if deletes[table]:
+                self.backend.delete(cursor, table, deletes[table])
+                deleted += len(deletes[table])
+        return deleted
+
+    @staticmethod
+    def _keep_descendants(deletes: Dict[str, Iterable[str]], upserts: Dict[str, Dict[str, Dict[str, Any]]],
+                          snapshot: resource_store.StoreSnapshot, deleted_ids: Set[str]):
+        """
+        Deleting a row cascades to its children's rows, but the cache may still
+        hold some of those children (a node removed before its devices). They
+        are queued for upsert after the deletes, with the reference now NULL.
+        """
+        queue = [(table, resource_id) for table in TABLE_ORDER for resource_id in deletes[table]]
+        while queue:
+            table, resource_id = queue.pop()
+            for child, field in child_references(table, cascading_only=True):
+                for child_id in snapshot.index.lookup(child, field, resource_id):
+                    if child_id in deleted_ids or child_id in upserts[child]:
+                        continue
+                    child_resource = snapshot.get(child, child_id)
+                    if child_resource is not None:
+                        upserts[child][child_id] = child_resource
+                        queue.append((child, child_id))
+
+    def _write_upserts(self, cursor, upserts: Dict[str, Dict[str, Dict[str, Any]]],
+                       snapshot: resource_store.StoreSnapshot, deleted_ids: Set[str]) -> int:
+        """Upserts table by table, parents first, resolving references in bulk. Returns the rows written."""
+        serial_ids: Dict[str, Dict[str, int]] = {table: {} for table in TABLE_ORDER}
+        written = 0
+        for table in TABLE_ORDER:
+            resources = upserts[table]
+            if not resources:
+                continue
+            for column, (parent, path) in FOREIGN_KEYS[table].items():
+                wanted = {resource_index.extract_field(resource, path) for resource in resources.values()}
+                wanted.discard(None)
+                wanted.difference_update(serial_ids[parent])
+                if wanted:
+                    serial_ids[parent].update(self.backend.select_ids(cursor, parent, wanted))
+            self._adopt_children(cursor, table, resources, upserts, snapshot, deleted_ids, serial_ids)
+            rows = []
+            for resource_id, resource in resources.items():
+                references = [serial_ids[parent].get(resource_index.extract_field(resource, path))
+                              for parent, path in FOREIGN_KEYS[table].values()]
+                rows.append((resource_id, *references, *(value(resource) for value in COLUMNS[table].values())))
+            self.backend.upsert(cursor, table, rows)
+            written += len(rows)
+        return written
+
+    def _adopt_children(self, cursor, table: str, resources: Dict[str, Dict[str, Any]],
+                        upserts: Dict[str, Dict[str, Dict[str, Any]]], snapshot: resource_store.StoreSnapshot,
+                        deleted_ids: Set[str], serial_ids: Dict[str, Dict[str, int]]):
+        """
+        Children written before their parent existed hold a NULL reference. When
+        this batch inserts a parent row for the first time, the cached children
+        that reference it (found through the store's secondary index) are
+        upserted again later in the same flush so their references resolve.
+        """
+        references = child_references(table)
+        if not references:
+            return
+        existing = self.backend.select_ids(cursor, table, resources)
+        serial_ids[table].update(existing)
+        for parent_id in resources.keys() - existing.keys():
+            for child, field in references:
+                for child_id in snapshot.index.lookup(child, field, parent_id):
+                    if child_id in upserts[child] or child_id in deleted_ids:
+                        continue
+                    child_resource = snapshot.get(child, child_id)
+                    if child_resource is not None:
+                        upserts[child][child_id] = child_resource
+
+    def _reconcile(self):
+        """Makes the tables match a store snapshot, then follows the change log from its generation."""
+        log = self.store.change_log
+        epoch = log.epoch
+        complete = self.complete()
+        snapshot = self.store.snapshot
+        cursor = self._cursor()
+        try:
+            upserts = {table: {resource["id"]: resource for resource in snapshot.values(table)} for table in TABLE_ORDER}
+            stale = ({table: self.backend.all_nmos_ids(cursor, table) - upserts[table].keys() for table in TABLE_ORDER}
+                     if complete else {table: set() for table in TABLE_ORDER})
+            # Deletes first, so that cascades cannot remove rows the upserts just wrote
+            deleted = self._write_deletes(cursor, stale)
+            upserted = self._write_upserts(cursor, upserts, snapshot, set())
+            self._connection.commit()
+        except self.backend.errors:
+            self._connection.rollback()
+            raise
+        finally:
+            cursor.close()
+        # Changes after the snapshot are replayed from the log; replaying an already written one is harmless
+        self._epoch = epoch
+        self._sequence = snapshot.generation
+        self._reconcile_needed = False
+        self._stale_rows_kept = not complete
+        self._pending = {}
+        self._oldest_pending = None
+        self.reconciliations += 1
+        self.rows_upserted += upserted
+        self.rows_deleted += deleted
+        logger.info(f"Reconciled the database with the cache: {upserted} rows upserted, "
+                    + (f"{deleted} stale rows deleted." if complete else "stale rows kept until the cache is complete."))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": len(self._pending),
+            "oldest_pending_seconds": time.monotonic() - self._oldest_pending if self._oldest_pending else 0.0,
+            "sequence": self._sequence,
+            "reconcile_needed": self._reconcile_needed,
+            "stale_rows_kept": self._stale_rows_kept,
+            "flushes": self.flushes,
+            "reconciliations": self.reconciliations,
+            "rows_upserted": self.rows_upserted,
+            "rows_deleted": self.rows_deleted,
+            "failures": self.failures,
+            "last_flush_seconds": self.last_flush_seconds,
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,86 @@
+"""
+Bounded, sequence-numbered change log for the cached NMOS resource store.
+
+Every mutation of the cache is given a monotonically increasing sequence
+number and recorded in a fixed-size ring buffer. Clients remember the last
+sequence they have seen and ask only for what happened after it; a client
+whose position has already been evicted from the ring (or who last synced
+against a different process or a wiped cache) is told to resync from the
+full ``/resources`` inventory instead.
+"""
+
+import itertools
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Any, Dict, List, NamedTuple, Optional
+
+OP_CREATE = "create"
+OP_UPDATE = "update"
+OP_DELETE = "delete"
+
+
+class ChangeEntry(NamedTuple):
+    sequence: int
+    operation: str
+    resource_type: str
+    resource_id: str
+    resource: Optional[Dict[str, Any]]
+    # Wall-clock time (time.time()) the change was applied to the cache
+    recorded_at: float = 0.0
+
+
+class ChangesSince(NamedTuple):
+    resync_required: bool
+    current_sequence: int
+    changes: List[ChangeEntry]
+    has_more: bool
+
+
+class ChangeLog:
+    def __init__(self, capacity: int = 10000):
+        self.capacity = capacity
+        # Identifies this process' sequence space; sequences from another epoch are meaningless here
+        self.epoch = uuid.uuid4().hex
+        self.sequence = 0
+        self._entries: deque = deque(maxlen=capacity)
+        # Lowest `since` that can still be served when the ring holds no entries (moves on reset)
+        self._floor = 0
+        self._lock = threading.Lock()
+
+    def record(self, operation: str, resource_type: str, resource_id: str,
+               resource: Optional[Dict[str, Any]] = None, recorded_at: Optional[float] = None) -> int:
+        with self._lock:
+            self.sequence += 1
+            self._entries.append(ChangeEntry(self.sequence, operation, resource_type, resource_id, resource,
+                                             time.time() if recorded_at is None else recorded_at))
+            return self.sequence
+
+    def reset(self) -> int:
+        """
+        Marks a wholesale replacement of the cache (new registry, full rediscovery).
+        The sequence keeps increasing, but nobody can catch up across the reset.
+        """
+        with self._lock:
+            self.sequence += 1
+            self._entries.clear()
+            self._floor = self.sequence
+            return self.sequence
+
+    def changes_since(self, since: int, epoch: Optional[str] = None, limit: Optional[int] = None) -> ChangesSince:
+        with self._lock:
+            current = self.sequence
+            min_since = self._entries[0].sequence - 1 if self._entries else self._floor
+            if (epoch is not None and epoch != self.epoch) or since < min_since or since > current:
+                return ChangesSince(True, current, [], False)
+            if since == current:
+                return ChangesSince(False, current, [], False)
+            # Entries are contiguous, so the first wanted one sits at a known offset
+            offset = since - min_since
+            stop = offset + limit + 1 if limit is not None else None
+            wanted = list(itertools.islice(self._entries, offset, stop))
+        has_more = limit is not None and len(wanted) > limit
+        if has_more:
+            wanted = wanted[:limit]
+        return ChangesSince(False, current, wanted, has_more)
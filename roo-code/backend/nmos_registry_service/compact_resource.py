@@ -0,0 +1,97 @@
+"""
+Compact in-memory representation of a cached NMOS resource.
+
+A parsed IS-04 resource is a dict of dicts and lists holding its own copies
+of every key and of every repeated URN (formats, transports, control types,
+tag values). At hundreds of thousands of resources that overhead dominates
+the registry service's memory. ``CompactResource`` instead keeps:
+
+* ``__slots__`` fields for the values the service reads on hot paths - id,
+  type, version as two ints, label, device/node/flow/source ids and the
+  subscription - with the repeated identifiers interned, so a device id
+  referenced by a hundred senders is stored once;
+* the complete resource as one compact UTF-8 JSON blob, decoded only when a
+  caller asks for the full body. Everything else, URNs included, lives in
+  that blob and costs no Python objects at all.
+
+Because the blob is the resource's own JSON, ``to_dict()`` round-trips to an
+identical body and whole inventories can be serialised by joining blobs.
+"""
+
+import json
+import sys
+from typing import Any, Dict, Optional, Tuple
+
+_intern = sys.intern
+
+_ID_FIELDS = ("device_id", "node_id", "flow_id", "source_id")
+_MISSING = object()
+
+
+def _intern_optional(value: Any) -> Any:
+    return _intern(value) if isinstance(value, str) else value
+
+
+class CompactResource:
+    __slots__ = ("id", "type", "version_seconds", "version_nanoseconds", "label",
+                 "device_id", "node_id", "flow_id", "source_id", "subscription", "blob")
+
+    def __init__(self, resource: Dict[str, Any]):
+        self.id = _intern(resource["id"])
+        self.type = _intern(resource["type"])
+        self.version_seconds: Optional[int] = None
+        self.version_nanoseconds: Optional[int] = None
+        version = resource.get("version")
+        if isinstance(version, str):
+            seconds, _, nanoseconds = version.partition(":")
+            # Only keep the parsed form if it formats back to exactly the same string
+            if seconds.isdigit() and nanoseconds.isdigit() and f"{int(seconds)}:{int(nanoseconds)}" == version:
+                self.version_seconds = int(seconds)
+                self.version_nanoseconds = int(nanoseconds)
+        self.label = resource.get("label")
+        self.device_id = _intern_optional(resource.get("device_id"))
+        self.node_id = _intern_optional(resource.get("node_id"))
+        self.flow_id = _intern_optional(resource.get("flow_id"))
+        self.source_id = _intern_optional(resource.get("source_id"))
+        subscription = resource.get("subscription")
+        self.subscription: Optional[Tuple[Tuple[str, Any], ...]] = (
+            tuple((_intern(key), _intern_optional(value)) for key, value in subscription.items())
+            if isinstance(subscription, dict) else None
+        )
+        self.blob: bytes = json.dumps(resource, separators=(",", ":")).encode("utf-8")
+
+    @property
+    def version(self) -> Optional[str]:
+        if self.version_seconds is None:
+            version = self.to_dict().get("version")
+            return version if isinstance(version, str) else None
+        return f"{self.version_seconds}:{self.version_nanoseconds}"
+
+    def version_tuple(self) -> Optional[Tuple[int, int]]:
+        if self.version_seconds is None:
+            return None
+        return self.version_seconds, self.version_nanoseconds
+
+    def to_dict(self) -> Dict[str, Any]:
+        return json.loads(self.blob)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """dict.get() look-alike that answers hot fields without decoding the blob."""
+        if key == "id":
+            return self.id
+        if key == "type":
+            return self.type
+        if key == "version" and self.version_seconds is not None:
+            return self.version
+        if key == "label" and self.label is not None:
+            return self.label
+        if key in _ID_FIELDS:
+            value = getattr(self, key)
+            return default if value is None else value
+        if key == "subscription" and self.subscription is not None:
+            return dict(self.subscription)
+        value = self.to_dict().get(key, _MISSING)
+        return default if value is _MISSING else value
+
+    def __repr__(self) -> str:
+        return f"CompactResource({self.type}/{self.id} @ {self.version})"
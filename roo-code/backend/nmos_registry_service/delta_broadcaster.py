@@ -0,0 +1,268 @@
+"""
+Server-push fan-out of registry cache deltas.
+
+A single broadcaster task on the API event loop tails the resource change log
+at a fixed tick, coalesces all changes of one tick per resource (so a resource
+updated fifty times in a tick is sent once), and fans the result out to every
+subscriber whose type/id filter matches. Each subscriber owns a bounded queue;
+a subscriber that cannot keep up is evicted rather than allowed to grow memory
+or hold back the others.
+
+A new subscriber first receives a snapshot of the (filtered) cache, then the
+deltas that follow. The snapshot's ``sequence`` is the generation of the store
+snapshot it was built from. The store records a batch in the change log before
+it publishes the batch's snapshot, so the broadcaster may already have fanned
+out changes the snapshot does not hold yet; those follow the snapshot at once
+as a catch-up delta. Changes that land between the snapshot and the next tick
+may be delivered although the snapshot already reflects them, so consumers
+apply deltas idempotently (create/update replace the resource, delete of an
+unknown id is a no-op).
+"""
+
+import asyncio
+import json
+import logging
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import change_log
+
+logger = logging.getLogger(__name__)
+
+EVICTED_SLOW_CONSUMER = "slow_consumer"
+
+
+class Subscriber:
+    def __init__(self, resource_types: Optional[Set[str]] = None,
+                 resource_ids: Optional[Set[str]] = None, max_queue: int = 256):
+        self.resource_types = frozenset(resource_types) if resource_types else None
+        self.resource_ids = frozenset(resource_ids) if resource_ids else None
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.evicted_reason: Optional[str] = None
+
+    @property
+    def filter_key(self) -> Tuple[Optional[frozenset], Optional[frozenset]]:
+        return self.resource_types, self.resource_ids
+
+    def matches(self, resource_type: str, resource_id: str) -> bool:
+        if self.resource_types is not None and resource_type not in self.resource_types:
+            return False
+        if self.resource_ids is not None and resource_id not in self.resource_ids:
+            return False
+        return True
+
+    async def next_message(self) -> Optional[str]:
+        """Returns the next encoded message, or None once the subscriber has been evicted."""
+        if self.evicted_reason:
+            return None
+        message = await self.queue.get()
+        return None if self.evicted_reason else message
+
+
+def coalesce(entries: Iterable[change_log.ChangeEntry]) -> List[change_log.ChangeEntry]:
+    """
+    Collapses several changes to the same resource into the one net change.
+    A resource created and deleted within the window disappears entirely.
+    """
+    first_ops: Dict[str, str] = {}
+    latest: Dict[str, change_log.ChangeEntry] = {}
+    for entry in entries:
+        first_ops.setdefault(entry.resource_id, entry.operation)
+        # Re-inserting moves the id to the end, so output stays in order of last change
+        latest.pop(entry.resource_id, None)
+        latest[entry.resource_id] = entry
+
+    net: List[change_log.ChangeEntry] = []
+    for resource_id, entry in latest.items():
+        first_op = first_ops[resource_id]
+        if first_op == change_log.OP_CREATE:
+            if entry.operation == change_log.OP_DELETE:
+                continue
+            entry = entry._replace(operation=change_log.OP_CREATE)
+        elif first_op == change_log.OP_DELETE and entry.operation != change_log.OP_DELETE:
+            entry = entry._replace(operation=change_log.OP_UPDATE)
+        net.append(entry)
+    return net
+
+
+class DeltaBroadcaster:
+    """
+    ``snapshot`` is called with a subscriber and must return the store
+    snapshot's generation and the filtered inventory as
+    ``(generation, {resource_type: [resource, ...]})``. ``generation`` returns
+    the current store generation without building anything. Encoded snapshots
+    are kept per filter until the generation moves on, so subscribers sharing a
+    filter share one snapshot even when they arrive one at a time.
+    """
+
+    def __init__(self, resource_change_log: change_log.ChangeLog,
+                 snapshot: Callable[[Subscriber], Tuple[int, Dict[str, List[Dict[str, Any]]]]],
+                 generation: Callable[[], int],
+                 tick_interval: float = 0.1, max_queue: int = 256, batch_limit: int = 5000,
+                 max_cached_snapshots: int = 64):
+        self.change_log = resource_change_log
+        self.snapshot = snapshot
+        self.generation = generation
+        self.tick_interval = tick_interval
+        self.max_queue = max_queue
+        self.batch_limit = batch_limit
+        self.subscribers: Set[Subscriber] = set()
+        self.position = resource_change_log.sequence
+        self.evicted_count = 0
+        # Subscribers whose snapshot could not be brought up to `position` (the cache was being
+        # replaced); they get a fresh snapshot on the next tick
+        self._pending_snapshots: Set[Subscriber] = set()
+        # Encoded snapshot message per filter, all of the generation in `_cached_generation`
+        self.max_cached_snapshots = max_cached_snapshots
+        self._cached_generation: Optional[int] = None
+        self._cached_snapshots: Dict[Tuple[Optional[frozenset], Optional[frozenset]], Tuple[int, str]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self.position = self.change_log.sequence
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def subscribe(self, resource_types: Optional[Set[str]] = None,
+                  resource_ids: Optional[Set[str]] = None) -> Subscriber:
+        subscriber = Subscriber(resource_types, resource_ids, self.max_queue)
+        self.subscribers.add(subscriber)
+        self._send_snapshots([subscriber])
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self.subscribers.discard(subscriber)
+        self._pending_snapshots.discard(subscriber)
+
+    def _snapshot_messages(self, subscriber: Subscriber) -> Optional[List[str]]:
+        """
+        The snapshot message for ``subscriber``'s filter plus, if the store snapshot is
+        behind ``position``, the catch-up delta; None if the changes in between are gone.
+        """
+        generation, message = self._encoded_snapshot(subscriber)
+        messages = [message]
+        if generation < self.position:
+            result = self.change_log.changes_since(generation, limit=self.position - generation)
+            if result.resync_required:
+                return None
+            selected = [entry._asdict() for entry in coalesce(result.changes)
+                        if subscriber.matches(entry.resource_type, entry.resource_id)]
+            if selected:
+                messages.append(json.dumps({
+                    "type": "delta",
+                    "epoch": self.change_log.epoch,
+                    "sequence": self.position,
+                    "changes": selected,
+                }))
+        return messages
+
+    def _encoded_snapshot(self, subscriber: Subscriber) -> Tuple[int, str]:
+        """The generation and encoded snapshot message for ``subscriber``'s filter, from the cache if current."""
+        current = self.generation()
+        if current != self._cached_generation:
+            self._cached_generation = current
+            self._cached_snapshots.clear()
+        key = subscriber.filter_key
+        cached = self._cached_snapshots.get(key)
+        if cached is not None:
+            return cached
+        generation, resources = self.snapshot(subscriber)
+        cached = (generation, json.dumps({
+            "type": "snapshot",
+            "epoch": self.change_log.epoch,
+            "sequence": generation,
+            "resources": resources,
+        }))
+        # The store may have moved on while the snapshot was built; only keep it if it is current
+        if generation == current:
+            if len(self._cached_snapshots) >= self.max_cached_snapshots:
+                # Drop the oldest filter; dicts keep insertion order
+                del self._cached_snapshots[next(iter(self._cached_snapshots))]
+            self._cached_snapshots[key] = cached
+        return cached
+
+    def _send_snapshots(self, subscribers: Iterable[Subscriber]):
+        # Subscribers sharing a filter share one encoded snapshot
+        encoded: Dict[Tuple[Optional[frozenset], Optional[frozenset]], Optional[List[str]]] = {}
+        for subscriber in subscribers:
+            key = subscriber.filter_key
+            if key not in encoded:
+                encoded[key] = self._snapshot_messages(subscriber)
+            messages = encoded[key]
+            if messages is None:
+                self._pending_snapshots.add(subscriber)
+                continue
+            self._pending_snapshots.discard(subscriber)
+            for message in messages:
+                self._offer(subscriber, message)
+
+    def _offer(self, subscriber: Subscriber, message: str):
+        try:
+            subscriber.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self._evict(subscriber, EVICTED_SLOW_CONSUMER)
+
+    def _evict(self, subscriber: Subscriber, reason: str):
+        subscriber.evicted_reason = reason
+        self.subscribers.discard(subscriber)
+        self.evicted_count += 1
+        # Wake the sender if it is idle so it notices the eviction promptly
+        try:
+            subscriber.queue.put_nowait("")
+        except asyncio.QueueFull:
+            pass
+        logger.warning(f"Evicted delta subscriber ({reason}); {len(self.subscribers)} subscribers remain.")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.tick_interval)
+            try:
+                self._tick()
+            except Exception as e:
+                logger.error(f"Delta broadcaster tick failed: {e}", exc_info=True)
+
+    def _tick(self):
+        has_more = True
+        while has_more:
+            result = self.change_log.changes_since(self.position, limit=self.batch_limit)
+            if result.resync_required:
+                # Fell off the ring or the cache was replaced: everyone starts over from a snapshot
+                self.position = result.current_sequence
+                logger.info(f"Delta broadcaster resynchronising {len(self.subscribers)} subscribers with snapshots.")
+                self._send_snapshots(list(self.subscribers))
+                return
+            if not result.changes:
+                self.position = result.current_sequence
+                break
+            has_more = result.has_more
+            self.position = result.changes[-1].sequence
+            if self.subscribers:
+                self._fan_out(coalesce(result.changes))
+        if self._pending_snapshots:
+            self._send_snapshots([subscriber for subscriber in self._pending_snapshots if subscriber in self.subscribers])
+
+    def _fan_out(self, changes: List[change_log.ChangeEntry]):
+        # Subscribers sharing a filter share one encoded message
+        encoded: Dict[Tuple[Optional[frozenset], Optional[frozenset]], Optional[str]] = {}
+        for subscriber in list(self.subscribers):
+            key = subscriber.filter_key
+            if key not in encoded:
+                selected = [entry._asdict() for entry in changes
+                            if subscriber.matches(entry.resource_type, entry.resource_id)]
+                encoded[key] = json.dumps({
+                    "type": "delta",
+                    "epoch": self.change_log.epoch,
+                    "sequence": self.position,
+                    "changes": selected,
+                }) if selected else None
+            message = encoded[key]
+            if message is not None:
+                self._offer(subscriber, message)
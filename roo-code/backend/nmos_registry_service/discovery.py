@@ -0,0 +1,234 @@
+"""
+IS-04 Query API discovery engine for the NMOS Registry Service.
+
+Walks the Query API list endpoints for every resource type concurrently,
+following IS-04 paging cursors (``paging.since`` / ``paging.limit``) so that
+no single request has to carry a whole inventory. All requests share one
+pooled async HTTP client and a semaphore bounding the number of requests in
+flight. Per-type progress and timing are tracked so a caller can report
+where a long discovery is spending its time. ``query_filters`` restricts
+the walk to the types (and IS-04 basic query filters) an instance serves.
+
+``Reconciler`` reuses the same walk to bring an existing cache up to date,
+applying only resources whose version changed and reporting the ones that
+disappeared from the registry.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+import httpx
+
+import resource_store
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_LIMIT = int(os.getenv("NMOS_DISCOVERY_PAGE_LIMIT", "1000"))
+DEFAULT_MAX_CONCURRENCY = int(os.getenv("NMOS_DISCOVERY_MAX_CONCURRENCY", "6"))
+DEFAULT_REQUEST_TIMEOUT = float(os.getenv("NMOS_DISCOVERY_REQUEST_TIMEOUT", "10"))
+# Guards against a registry that keeps handing back the same cursor
+MAX_PAGES_PER_TYPE = 10000
+
+
+@dataclass
+class TypeProgress:
+    """Progress of the paged walk over one resource type."""
+    resource_type: str
+    status: str = "pending"  # pending | running | done | error
+    pages: int = 0
+    fetched: int = 0
+    processed: int = 0
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+
+    @property
+    def duration(self) -> Optional[float]:
+        if self.started_at is None:
+            return None
+        end = self.finished_at if self.finished_at is not None else time.monotonic()
+        return end - self.started_at
+
+    def as_dict(self) -> Dict[str, Any]:
+        duration = self.duration
+        return {
+            "status": self.status,
+            "pages": self.pages,
+            "fetched": self.fetched,
+            "processed": self.processed,
+            "duration_seconds": round(duration, 3) if duration is not None else None,
+            "error": self.error,
+        }
+
+
+class DiscoveryEngine:
+    """
+    Fetches all IS-04 resource types from a Query API concurrently.
+
+    ``apply_page`` is called with ``(resource_type, resources)`` for every page
+    as it arrives and must return how many of the resources it accepted. It is
+    invoked on the event loop, so it must not block. ``query_filters`` maps a
+    resource type to extra query parameters; when given, only its types are
+    walked.
+    """
+
+    def __init__(self,
+                 query_api_base_url: str,
+                 apply_page: Callable[[str, List[Dict[str, Any]]], int],
+                 resource_types: Optional[List[str]] = None,
+                 page_limit: int = DEFAULT_PAGE_LIMIT,
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                 request_timeout: float = DEFAULT_REQUEST_TIMEOUT,
+                 query_filters: Optional[Dict[str, Dict[str, str]]] = None):
+        self.query_api_base_url = query_api_base_url.rstrip('/')
+        self.apply_page = apply_page
+        self.query_filters = query_filters or {}
+        self.resource_types = list(resource_types or query_filters or resource_store.RESOURCE_TYPES)
+        self.page_limit = max(1, page_limit)
+        self.max_concurrency = max(1, max_concurrency)
+        self.request_timeout = request_timeout
+        self.progress: Dict[str, TypeProgress] = {
+            res_type: TypeProgress(res_type) for res_type in self.resource_types
+        }
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    @property
+    def duration(self) -> Optional[float]:
+        if self.started_at is None:
+            return None
+        end = self.finished_at if self.finished_at is not None else time.monotonic()
+        return end - self.started_at
+
+    @property
+    def running(self) -> bool:
+        return self.started_at is not None and self.finished_at is None
+
+    def progress_report(self) -> Dict[str, Dict[str, Any]]:
+        return {res_type: progress.as_dict() for res_type, progress in self.progress.items()}
+
+    async def run(self) -> Dict[str, TypeProgress]:
+        """Walks every resource type concurrently and returns the final per-type progress."""
+        self.started_at = time.monotonic()
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        limits = httpx.Limits(max_connections=self.max_concurrency,
+                              max_keepalive_connections=self.max_concurrency)
+        try:
+            async with httpx.AsyncClient(limits=limits, timeout=self.request_timeout) as client:
+                await asyncio.gather(*(self._walk_type(client, res_type) for res_type in self.resource_types))
+        finally:
+            self.finished_at = time.monotonic()
+        summary = {res_type: (p.processed, round(p.duration or 0.0, 3)) for res_type, p in self.progress.items()}
+        logger.info(f"Discovery from {self.query_api_base_url} finished in {self.duration:.3f}s "
+                    f"(processed, seconds) per type: {summary}")
+        return self.progress
+
+    async def _walk_type(self, client: httpx.AsyncClient, res_type: str):
+        progress = self.progress[res_type]
+        progress.status = "running"
+        progress.started_at = time.monotonic()
+        url = f"{self.query_api_base_url}/{res_type}"
+        cursor = "0:0"
+        try:
+            while progress.pages < MAX_PAGES_PER_TYPE:
+                params = {
+                    **self.query_filters.get(res_type, {}),
+                    "paging.order": "update",
+                    "paging.since": cursor,
+                    "paging.limit": str(self.page_limit),
+                }
+                async with self._semaphore:
+                    response = await client.get(url, params=params)
+                response.raise_for_status()
+                page = response.json()
+                if not isinstance(page, list):
+                    raise ValueError(f"Expected a list of resources for {res_type} from {url}, but got {type(page)}")
+
+                progress.pages += 1
+                progress.fetched += len(page)
+                progress.processed += self.apply_page(res_type, page)
+                logger.debug(f"Discovery {res_type}: page {progress.pages} with {len(page)} resources (cursor {cursor})")
+
+                next_cursor = response.headers.get("X-Paging-Until")
+                if "X-Paging-Limit" not in response.headers:
+                    # Registry does not implement paging, so the first response was the whole list
+                    break
+                # The registry may clamp the requested limit, so compare against what it actually used
+                try:
+                    effective_limit = int(response.headers["X-Paging-Limit"])
+                except ValueError:
+                    effective_limit = self.page_limit
+                if len(page) < effective_limit or not next_cursor or next_cursor == cursor:
+                    break
+                cursor = next_cursor
+            else:
+                logger.warning(f"Discovery {res_type}: stopped after {MAX_PAGES_PER_TYPE} pages")
+            progress.status = "done"
+        except httpx.HTTPStatusError as e:
+            progress.status = "error"
+            progress.error = f"HTTP {e.response.status_code}: {e.response.text[:200]}"
+            logger.error(f"HTTP error fetching {res_type} from {url}: {progress.error}")
+        except httpx.HTTPError as e:
+            progress.status = "error"
+            progress.error = f"Request error: {e}"
+            logger.error(f"Request exception fetching {res_type} from {url}: {e}")
+        except ValueError as e:
+            # json decoding errors are ValueErrors as well
+            progress.status = "error"
+            progress.error = f"Invalid response: {e}"
+            logger.error(f"Invalid response for {res_type} from {url}: {e}")
+        finally:
+            progress.finished_at = time.monotonic()
+
+
+class Reconciler:
+    """
+    Reconciles resources already held (from a snapshot file, or a cache kept
+    across a reconnect) against a paged discovery of the live registry.
+
+    ``known_versions`` maps resource type to ``{id: version}`` for what is held.
+    Pass ``apply_page`` to a ``DiscoveryEngine``: resources whose version is
+    unchanged are skipped, only new or changed ones are handed to
+    ``apply_changed``. After the walk, ``vanished()`` lists the held ids the
+    registry no longer has, for every type whose walk completed.
+    """
+
+    def __init__(self,
+                 known_versions: Dict[str, Dict[str, Optional[str]]],
+                 apply_changed: Callable[[str, List[Dict[str, Any]]], int]):
+        self.known_versions = known_versions
+        self.apply_changed = apply_changed
+        self.seen: Dict[str, set] = {res_type: set() for res_type in known_versions}
+        self.unchanged = 0
+        self.changed = 0
+
+    def apply_page(self, res_type: str, resources_list: List[Dict[str, Any]]) -> int:
+        known = self.known_versions.get(res_type, {})
+        seen = self.seen.setdefault(res_type, set())
+        changed = []
+        for resource in resources_list:
+            if not isinstance(resource, dict) or "id" not in resource:
+                changed.append(resource)  # let apply_changed report it
+                continue
+            seen.add(resource["id"])
+            if resource["id"] in known and known[resource["id"]] == resource.get("version"):
+                self.unchanged += 1
+            else:
+                changed.append(resource)
+        self.changed += len(changed)
+        accepted = self.apply_changed(res_type, changed) if changed else 0
+        # Unchanged resources count as processed: they are in the cache and current
+        return accepted + len(resources_list) - len(changed)
+
+    def vanished(self, progress: Dict[str, TypeProgress]) -> Dict[str, List[str]]:
+        # A type whose walk failed was not fully listed, so nothing can be concluded about it
+        return {
+            res_type: [res_id for res_id in known if res_id not in self.seen.get(res_type, ())]
+            for res_type, known in self.known_versions.items()
+            if res_type in progress and progress[res_type].status == "done"
+        }
@@ -0,0 +1,391 @@
+"""
+Append-only history of the resource cache, for point-in-time queries.
+
+The cache only knows the latest version of each resource; this log keeps
+what it looked like before. A background thread tails the resource change
+log (so ingest pays only the ``recorded_at`` timestamp each change already
+carries) and appends every applied change to the current segment.
+
+A segment is a pair of files in the history directory:
+
+* ``segment-<n>.checkpoint.gz`` - the whole inventory when the segment was
+  started: a header line, then one ``{"t": <type>, "r": <resource>}`` line
+  per resource (gzip NDJSON, like the warm-restart snapshot);
+* ``segment-<n>.log.gz`` - the changes applied after that checkpoint, one
+  ``{"s": <sequence>, "t": <time>, "op": ..., "type": ..., "id": ...,
+  "r": <resource or null>}`` line each, appended as one gzip member per
+  batch (a multi-member gzip file reads as a single stream).
+
+``index.json`` is the time index: checkpoint time, time of the last change,
+sequence range and sizes per segment. It is rewritten atomically after each
+append, and a log is only ever read up to the size the index records, so a
+crash mid-append cannot corrupt what a query sees.
+
+A new segment (with a new checkpoint) is started when the log reaches
+``segment_bytes``, when the segment is ``segment_seconds`` old, and whenever
+the change log cannot be followed (cache replaced, restart, or the ring
+overtook the history writer - the segment is then marked as following a
+gap). The size of a segment bounds the replay cost of a query; the oldest
+segments are removed once the directory exceeds ``retention_bytes``.
+
+``state_at(t)`` loads the newest checkpoint taken at or before ``t`` and
+replays its log up to ``t``.
+"""
+
+import gzip
+import io
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+import change_log
+import resource_store
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_FORMAT = "nmos-registry-history-checkpoint"
+CHECKPOINT_FORMAT_VERSION = 1
+INDEX_FILE = "index.json"
+
+
+class PointInTime(NamedTuple):
+    at: float
+    segment: int
+    checkpoint_at: float
+    # Time of the last change replayed (the checkpoint time if none was)
+    last_change_at: float
+    # True if the segment started after changes were lost (or the service was down)
+    after_gap: bool
+    resources: Dict[str, Dict[str, Dict[str, Any]]]
+
+
+def _write_atomically(path: str, data: bytes):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as out:
+        out.write(data)
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(tmp_path, path)
+
+
+class HistoryLog:
+    """
+    Background thread appending the changes of ``store`` to the history in
+    ``directory`` every ``interval`` seconds.
+    """
+
+    def __init__(self, store: resource_store.ResourceStore, directory: str,
+                 segment_bytes: int = 16 * 2**20, segment_seconds: float = 3600.0,
+                 retention_bytes: int = 1024 * 2**20, interval: float = 1.0, batch_limit: int = 5000):
+        self.store = store
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.retention_bytes = retention_bytes
+        self.interval = interval
+        self.batch_limit = batch_limit
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # Serialises appends against each other; _index_lock guards the segment list queries read
+        self._append_lock = threading.Lock()
+        self._index_lock = threading.Lock()
+        self._segments: List[Dict[str, Any]] = []
+        self._current: Optional[Dict[str, Any]] = None
+        self._epoch: Optional[str] = None
+        self._sequence = 0
+        self.changes_appended = 0
+        self.segments_started = 0
+        self.segments_removed = 0
+        self.gaps = 0
+        self.last_append_seconds: Optional[float] = None
+        self.last_error: Optional[str] = None
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    # --- Files and index ---
+
+    def _path(self, number: int, kind: str) -> str:
+        return os.path.join(self.directory, f"segment-{number:08d}.{kind}.gz")
+
+    def _load_index(self):
+        path = os.path.join(self.directory, INDEX_FILE)
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path, "rb") as source:
+                segments = json.load(source)["segments"]
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.error(f"Ignoring unreadable history index {path}: {e}")
+            return
+        self._segments = [segment for segment in segments
+                          if os.path.exists(self._path(segment["number"], "checkpoint"))
+                          and os.path.exists(self._path(segment["number"], "log"))]
+        logger.info(f"History log: {len(self._segments)} segments found in {self.directory}")
+
+    def _write_index(self):
+        with self._index_lock:
+            body = json.dumps({"segments": self._segments}, separators=(",", ":")).encode("utf-8")
+        _write_atomically(os.path.join(self.directory, INDEX_FILE), body)
+
+    def _start_segment(self, after_gap: bool, resynced: bool = False):
+        """
+        Writes a checkpoint of the current cache and makes its (empty) log
+        current. ``resynced`` means the change log could not be followed; the
+        caller has decided ``after_gap`` and there is nothing to catch up on.
+        """
+        log = self.store.change_log
+        epoch = log.epoch
+        snapshot = self.store.snapshot
+        started_at = time.time()
+        if self._current is not None and not after_gap and not resynced:
+            # The previous log must reach the checkpoint, or the changes in between would be in neither
+            after_gap = self._append_until(snapshot.generation)
+        number = self._segments[-1]["number"] + 1 if self._segments else 1
+        header = {
+            "format": CHECKPOINT_FORMAT,
+            "format_version": CHECKPOINT_FORMAT_VERSION,
+            "time": started_at,
+            "sequence": snapshot.generation,
+            "epoch": epoch,
+            "counts": snapshot.counts(),
+        }
+        buffer = io.BytesIO()
+        with gzip.GzipFile(fileobj=buffer, mode="wb", compresslevel=6) as out:
+            out.write(json.dumps(header, separators=(",", ":")).encode("utf-8") + b"\n")
+            for resource_type in snapshot.resources:
+                prefix = b'{"t":' + json.dumps(resource_type).encode("utf-8") + b',"r":'
+                for _, blob in snapshot.json_items(resource_type):
+                    out.write(prefix + blob + b"}\n")
+        _write_atomically(self._path(number, "checkpoint"), buffer.getvalue())
+        open(self._path(number, "log"), "wb").close()
+        segment = {
+            "number": number,
+            "checkpoint_time": started_at,
+            "checkpoint_sequence": snapshot.generation,
+            "epoch": epoch,
+            "after_gap": after_gap,
+            "end_time": started_at,
+            "last_sequence": snapshot.generation,
+            "changes": 0,
+            "checkpoint_bytes": len(buffer.getvalue()),
+            "log_bytes": 0,
+        }
+        with self._index_lock:
+            self._segments.append(segment)
+        self._current = segment
+        self._epoch = epoch
+        self._sequence = snapshot.generation
+        self.segments_started += 1
+        if after_gap:
+            self.gaps += 1
+        self._apply_retention()
+        self._write_index()
+        logger.info(f"History segment {number} started with a checkpoint of {snapshot.total()} resources"
+                    f"{' (after a gap in the change log)' if after_gap else ''}")
+
+    def _apply_retention(self):
+        with self._index_lock:
+            total = sum(segment["checkpoint_bytes"] + segment["log_bytes"] for segment in self._segments)
+            removed = []
+            while total > self.retention_bytes and len(self._segments) > 1:
+                segment = self._segments.pop(0)
+                total -= segment["checkpoint_bytes"] + segment["log_bytes"]
+                removed.append(segment["number"])
+        for number in removed:
+            for kind in ("checkpoint", "log"):
+                try:
+                    os.remove(self._path(number, kind))
+                except OSError:
+                    pass
+            self.segments_removed += 1
+
+    # --- Appending ---
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="history-log", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 30.0):
+        self._stop_event.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=timeout)
+        self._thread = None
+        self.append_pending()
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self.append_pending()
+
+    def append_pending(self) -> int:
+        """Appends the changes applied since the last call. Returns how many were appended."""
+        with self._append_lock:
+            started = time.monotonic()
+            try:
+                appended = self._append()
+            except OSError as e:
+                # The change log keeps the changes until the next attempt (or a new segment follows a gap)
+                self.last_error = str(e)
+                logger.error(f"Appending to the history log in {self.directory} failed: {e}")
+                return 0
+            self.last_error = None
+            if appended:
+                self.last_append_seconds = time.monotonic() - started
+            return appended
+
+    def _append(self) -> int:
+        if self._current is None:
+            # Restarted: the change log sequences of the previous run mean nothing here
+            self._start_segment(after_gap=bool(self._segments))
+        appended = self.changes_appended
+        while self._append_until(None):
+            # A replaced cache is a new baseline; an overtaken ring means changes were lost
+            overtaken = self._sequence < self.store.change_log.sequence - self.store.change_log.capacity
+            self._start_segment(after_gap=overtaken, resynced=True)
+        segment = self._current
+        if (segment["log_bytes"] >= self.segment_bytes
+                or (segment["changes"] and time.time() - segment["checkpoint_time"] >= self.segment_seconds)):
+            self._start_segment(after_gap=False)
+        return self.changes_appended - appended
+
+    def _append_until(self, until: Optional[int]) -> bool:
+        """
+        Appends the changes after the current position (up to sequence
+        ``until`` if given) to the current segment. Returns True if the change
+        log could not be followed and a new segment is needed.
+        """
+        lines: List[bytes] = []
+        first: Optional[change_log.ChangeEntry] = None
+        last: Optional[change_log.ChangeEntry] = None
+        resync_required = False
+        while until is None or self._sequence < until:
+            limit = self.batch_limit if until is None else min(self.batch_limit, until - self._sequence)
+            result = self.store.change_log.changes_since(self._sequence, epoch=self._epoch, limit=limit)
+            if result.resync_required:
+                resync_required = True
+                break
+            for entry in result.changes:
+                lines.append(json.dumps({"s": entry.sequence, "t": entry.recorded_at, "op": entry.operation,
+                                         "type": entry.resource_type, "id": entry.resource_id, "r": entry.resource},
+                                        separators=(",", ":")).encode("utf-8"))
+            if result.changes:
+                first = first or result.changes[0]
+                last = result.changes[-1]
+                self._sequence = last.sequence
+            if not result.has_more:
+                break
+        self._write_changes(lines, first, last)
+        return resync_required
+
+    def _write_changes(self, lines: List[bytes], first: Optional[change_log.ChangeEntry],
+                       last: Optional[change_log.ChangeEntry]):
+        if not lines:
+            return
+        segment = self._current
+        member = gzip.compress(b"\n".join(lines) + b"\n", compresslevel=6)
+        with open(self._path(segment["number"], "log"), "ab") as out:
+            out.write(member)
+        with self._index_lock:
+            if not segment["changes"] and first.recorded_at < segment["checkpoint_time"]:
+                # Applied while the checkpoint was being taken: the checkpoint stands for the state just before
+                segment["checkpoint_time"] = first.recorded_at
+            segment["log_bytes"] += len(member)
+            segment["changes"] += len(lines)
+            segment["end_time"] = max(segment["end_time"], last.recorded_at)
+            segment["last_sequence"] = last.sequence
+        self.changes_appended += len(lines)
+        self._write_index()
+
+    # --- Queries ---
+
+    def segments(self) -> List[Dict[str, Any]]:
+        with self._index_lock:
+            return [dict(segment) for segment in self._segments]
+
+    def oldest_time(self) -> Optional[float]:
+        with self._index_lock:
+            return self._segments[0]["checkpoint_time"] if self._segments else None
+
+    def _read_checkpoint(self, number: int, types: Optional[Iterable[str]]) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        wanted = set(types) if types is not None else None
+        prefixes = tuple(b'{"t":' + json.dumps(resource_type).encode("utf-8") + b"," for resource_type in wanted) if wanted is not None else None
+        resources: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        with gzip.open(self._path(number, "checkpoint"), "rb") as source:
+            header = json.loads(source.readline())
+            if header.get("format") != CHECKPOINT_FORMAT or header.get("format_version") != CHECKPOINT_FORMAT_VERSION:
+                raise ValueError(f"segment {number}: not a history checkpoint of a readable format")
+            for resource_type in header.get("counts", {}):
+                if wanted is None or resource_type in wanted:
+                    resources[resource_type] = {}
+            for line in source:
+                # Skip unwanted types without decoding them
+                if prefixes is not None and not line.startswith(prefixes):
+                    continue
+                entry = json.loads(line)
+                resources.setdefault(entry["t"], {})[entry["r"]["id"]] = entry["r"]
+        return resources
+
+    def _read_changes(self, segment: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        # Only what the index accounts for: a member being appended right now is not read
+        with self._index_lock:
+            size = segment["log_bytes"]
+        if not size:
+            return
+        with open(self._path(segment["number"], "log"), "rb") as source:
+            data = source.read(size)
+        with gzip.GzipFile(fileobj=io.BytesIO(data), mode="rb") as changes:
+            for line in changes:
+                yield json.loads(line)
+
+    def state_at(self, at: float, types: Optional[Iterable[str]] = None) -> Optional[PointInTime]:
+        """
+        The inventory (of ``types``, or all types) as it was at Unix time
+        ``at``, or None if the retained history starts after ``at``.
+        Raises OSError or ValueError if the segment cannot be read.
+        """
+        with self._index_lock:
+            candidates = [segment for segment in self._segments if segment["checkpoint_time"] <= at]
+            segment = dict(candidates[-1]) if candidates else None
+        if segment is None:
+            return None
+        wanted = set(types) if types is not None else None
+        resources = self._read_checkpoint(segment["number"], wanted)
+        last_change_at = segment["checkpoint_time"]
+        for change in self._read_changes(segment):
+            if change["t"] > at:
+                break
+            last_change_at = change["t"]
+            if wanted is not None and change["type"] not in wanted:
+                continue
+            resources_of_type = resources.setdefault(change["type"], {})
+            if change["op"] == change_log.OP_DELETE:
+                resources_of_type.pop(change["id"], None)
+            else:
+                resources_of_type[change["id"]] = change["r"]
+        return PointInTime(at, segment["number"], segment["checkpoint_time"], last_change_at,
+                           segment["after_gap"], resources)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._index_lock:
+            total_bytes = sum(segment["checkpoint_bytes"] + segment["log_bytes"] for segment in self._segments)
+            segment_count = len(self._segments)
+            oldest = self._segments[0]["checkpoint_time"] if self._segments else None
+            current_changes = self._current["changes"] if self._current else 0
+        return {
+            "segments": segment_count,
+            "bytes": total_bytes,
+            "oldest_time": oldest,
+            "current_segment_changes": current_changes,
+            "changes_appended": self.changes_appended,
+            "segments_started": self.segments_started,
+            "segments_removed": self.segments_removed,
+            "gaps": self.gaps,
+            "lag": self.store.change_log.sequence - self._sequence if self._epoch == self.store.change_log.epoch else None,
+            "last_append_seconds": self.last_append_seconds,
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,263 @@
+"""
+Staged ingest pipeline for IS-04 subscription grains.
+
+The subscription sockets on the event loop (via ``submit_async``) only
+enqueue raw frames. A single worker thread drains the queue in batching windows, parses the frames,
+coalesces repeated changes to the same resource within the window and
+applies the net result to the store as one batch. A registry burst (a rack
+rebooting, say) therefore costs one store publication per window instead of
+one per grain, and never holds up the socket.
+
+When the queue is full the configured backpressure policy decides:
+
+* ``block``       - the receive thread waits (the registry sees TCP backpressure)
+* ``drop_oldest`` - the oldest queued frame is discarded to admit the new one
+* ``drop_newest`` - the incoming frame is discarded
+
+Dropping frames loses changes, so ``on_overflow`` is invoked after a drop to
+let the owner schedule a resynchronisation with the registry.
+
+``parse_frame`` returns a ``ParsedFrame``; when it carries the grain's
+creation time, ``observe_grain_latency`` is called with the delay from that
+time to the batch being applied.
+"""
+
+import asyncio
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import resource_store
+
+logger = logging.getLogger(__name__)
+
+BACKPRESSURE_BLOCK = "block"
+BACKPRESSURE_DROP_OLDEST = "drop_oldest"
+BACKPRESSURE_DROP_NEWEST = "drop_newest"
+BACKPRESSURE_POLICIES = (BACKPRESSURE_BLOCK, BACKPRESSURE_DROP_OLDEST, BACKPRESSURE_DROP_NEWEST)
+
+_STOP = object()
+
+
+class ParsedFrame(NamedTuple):
+    changes: List[resource_store.StoreChange]
+    # Wall-clock (Unix epoch) time at which the registry created the grain, if known
+    timestamp: Optional[float] = None
+
+
+def coalesce_changes(changes: List[resource_store.StoreChange]) -> List[resource_store.StoreChange]:
+    """
+    Keeps one net change per resource id, in order of last occurrence. Of two
+    updates the newer version wins; a deletion overrides earlier updates and
+    a later update overrides an earlier deletion.
+    """
+    net: Dict[str, resource_store.StoreChange] = {}
+    for change in changes:
+        previous = net.pop(change.resource_id, None)
+        if (previous is not None and previous.operation == resource_store.OP_UPDATE
+                and change.operation == resource_store.OP_UPDATE
+                and not resource_store.is_newer_version(change.resource, previous.resource)):
+            change = previous
+        net[change.resource_id] = change
+    return list(net.values())
+
+
+class GrainIngestPipeline:
+    def __init__(self,
+                 parse_frame: Callable[[str], ParsedFrame],
+                 apply_batch: Callable[[List[resource_store.StoreChange]], List[Optional[str]]],
+                 max_queue: int = 10000,
+                 batch_window: float = 0.05,
+                 max_batch_frames: int = 1000,
+                 backpressure: str = BACKPRESSURE_BLOCK,
+                 on_overflow: Optional[Callable[[], None]] = None,
+                 observe_grain_latency: Optional[Callable[[float], None]] = None):
+        if backpressure not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"Unknown backpressure policy '{backpressure}', expected one of {BACKPRESSURE_POLICIES}")
+        self.parse_frame = parse_frame
+        self.apply_batch = apply_batch
+        self.batch_window = batch_window
+        self.max_batch_frames = max_batch_frames
+        self.backpressure = backpressure
+        self.on_overflow = on_overflow
+        self.observe_grain_latency = observe_grain_latency
+        self._queue: "queue.Queue[Tuple[float, str]]" = queue.Queue(maxsize=max_queue)
+        self._worker: Optional[threading.Thread] = None
+        self._stats_lock = threading.Lock()
+        self.frames_received = 0
+        self.frames_dropped = 0
+        self.frames_invalid = 0
+        self.batches_applied = 0
+        self.changes_received = 0
+        self.changes_coalesced = 0
+        self.changes_applied = 0
+        self.last_batch_frames = 0
+        self.last_batch_changes = 0
+        self.max_batch_frames_seen = 0
+        self.last_apply_latency = 0.0
+        self.max_apply_latency = 0.0
+        self.total_apply_latency = 0.0
+        self.last_queue_wait = 0.0
+        self.max_queue_wait = 0.0
+
+    # --- Receive side (any thread or event loop) ---
+
+    def submit(self, frame: str) -> bool:
+        """Enqueues a raw frame. Returns False if the frame was dropped."""
+        item = (time.monotonic(), frame)
+        with self._stats_lock:
+            self.frames_received += 1
+        if self.backpressure == BACKPRESSURE_BLOCK:
+            self._queue.put(item)
+            return True
+        try:
+            self._queue.put_nowait(item)
+            return True
+        except queue.Full:
+            pass
+        if self.backpressure == BACKPRESSURE_DROP_OLDEST:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                pass
+            try:
+                self._queue.put_nowait(item)
+                dropped_incoming = False
+            except queue.Full:
+                dropped_incoming = True
+        else:
+            dropped_incoming = True
+        with self._stats_lock:
+            self.frames_dropped += 1
+        logger.warning(f"Ingest queue full ({self._queue.maxsize}), dropped a frame ({self.backpressure}).")
+        if self.on_overflow:
+            try:
+                self.on_overflow()
+            except Exception as e:
+                logger.error(f"Ingest overflow handler failed: {e}", exc_info=True)
+        return not dropped_incoming
+
+    async def submit_async(self, frame: str) -> bool:
+        """
+        ``submit`` for receivers running on an event loop. Under the ``block``
+        policy a full queue is waited for in an executor thread, so the socket
+        stops being read without stalling the loop.
+        """
+        if self.backpressure == BACKPRESSURE_BLOCK and self._queue.full():
+            return await asyncio.get_running_loop().run_in_executor(None, self.submit, frame)
+        return self.submit(frame)
+
+    # --- Worker side ---
+
+    def start(self):
+        if self._worker and self._worker.is_alive():
+            return
+        self._worker = threading.Thread(target=self._run, name="grain-ingest", daemon=True)
+        self._worker.start()
+
+    def stop(self, timeout: float = 5.0):
+        if self._worker and self._worker.is_alive():
+            self._queue.put((time.monotonic(), _STOP))
+            self._worker.join(timeout=timeout)
+        self._worker = None
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def _next_batch(self) -> Tuple[List[Tuple[float, str]], bool]:
+        first = self._queue.get()
+        if first[1] is _STOP:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.max_batch_frames:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item[1] is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        logger.info(f"Grain ingest worker started (window {self.batch_window * 1000:.0f} ms, "
+                    f"max {self.max_batch_frames} frames, backpressure {self.backpressure}).")
+        stopping = False
+        while not stopping:
+            batch, stopping = self._next_batch()
+            if batch:
+                try:
+                    self._process(batch)
+                except Exception as e:
+                    logger.error(f"Failed to apply ingest batch of {len(batch)} frames: {e}", exc_info=True)
+        logger.info("Grain ingest worker stopped.")
+
+    def _process(self, batch: List[Tuple[float, str]]):
+        started = time.monotonic()
+        changes: List[resource_store.StoreChange] = []
+        grain_timestamps: List[float] = []
+        invalid = 0
+        for _, frame in batch:
+            try:
+                parsed = self.parse_frame(frame)
+                changes.extend(parsed.changes)
+                if parsed.timestamp is not None:
+                    grain_timestamps.append(parsed.timestamp)
+            except Exception as e:
+                invalid += 1
+                logger.error(f"Failed to parse grain frame: {e}. Frame: {frame[:200]}")
+        net = coalesce_changes(changes)
+        applied = 0
+        if net:
+            applied = sum(1 for outcome in self.apply_batch(net) if outcome is not None)
+        finished = time.monotonic()
+        if self.observe_grain_latency and grain_timestamps:
+            applied_at = time.time()
+            for timestamp in grain_timestamps:
+                self.observe_grain_latency(applied_at - timestamp)
+        apply_latency = finished - started
+        queue_wait = started - batch[0][0]
+        with self._stats_lock:
+            self.frames_invalid += invalid
+            self.batches_applied += 1
+            self.changes_received += len(changes)
+            self.changes_coalesced += len(changes) - len(net)
+            self.changes_applied += applied
+            self.last_batch_frames = len(batch)
+            self.last_batch_changes = len(net)
+            self.max_batch_frames_seen = max(self.max_batch_frames_seen, len(batch))
+            self.last_apply_latency = apply_latency
+            self.max_apply_latency = max(self.max_apply_latency, apply_latency)
+            self.total_apply_latency += apply_latency
+            self.last_queue_wait = queue_wait
+            self.max_queue_wait = max(self.max_queue_wait, queue_wait)
+        logger.debug(f"Ingest batch: {len(batch)} frames, {len(changes)} changes -> {len(net)} coalesced, "
+                     f"{applied} applied in {apply_latency * 1000:.1f} ms")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {
+                "queue_depth": self.queue_depth,
+                "queue_capacity": self._queue.maxsize,
+                "backpressure_policy": self.backpressure,
+                "frames_received": self.frames_received,
+                "frames_dropped": self.frames_dropped,
+                "frames_invalid": self.frames_invalid,
+                "batches_applied": self.batches_applied,
+                "changes_received": self.changes_received,
+                "changes_coalesced": self.changes_coalesced,
+                "changes_applied": self.changes_applied,
+                "last_batch_frames": self.last_batch_frames,
+                "last_batch_changes": self.last_batch_changes,
+                "max_batch_frames": self.max_batch_frames_seen,
+                "last_apply_latency_ms": round(self.last_apply_latency * 1000, 3),
+                "max_apply_latency_ms": round(self.max_apply_latency * 1000, 3),
+                "avg_apply_latency_ms": round(self.total_apply_latency * 1000 / self.batches_applied, 3) if self.batches_applied else 0.0,
+                "last_queue_wait_ms": round(self.last_queue_wait * 1000, 3),
+                "max_queue_wait_ms": round(self.max_queue_wait * 1000, 3),
+            }
@@ -0,0 +1,171 @@
+"""
+Forwarding of non-read requests from reader workers to the ingest process.
+
+Reader workers (``NMOS_REGISTRY_ROLE=reader``) only hold the published store,
+so they answer the inventory reads themselves and pass everything else -
+configuration, registries, resync, node registration, ``/resources/changes``
+and the push channels - through to the ingest process. Clients keep talking
+to one port whichever worker accepts the connection.
+
+This is plain ASGI middleware rather than an ``@app.middleware("http")``
+function so that locally served reads pay nothing beyond one predicate call,
+and so that websockets can be relayed too. Streaming responses (server-sent
+events) are relayed chunk by chunk until either side goes away.
+"""
+
+import asyncio
+import logging
+from typing import Callable, List, Optional, Tuple
+
+import httpx
+import websockets
+
+logger = logging.getLogger(__name__)
+
+# Headers that describe one connection and must not be copied onto another
+HOP_BY_HOP_HEADERS = {b"connection", b"keep-alive", b"proxy-authenticate", b"proxy-authorization", b"te",
+                      b"trailers", b"transfer-encoding", b"upgrade", b"host"}
+FORWARDED_WEBSOCKET_HEADERS = {b"authorization", b"cookie", b"origin"}
+# websockets 14 renamed the client's header argument along with its new asyncio implementation
+_WEBSOCKET_HEADERS_ARGUMENT = "additional_headers" if int(websockets.__version__.split(".")[0]) >= 14 else "extra_headers"
+
+
+def _handshake_status(error: Exception) -> Optional[int]:
+    """HTTP status of a refused websocket handshake, for old and new websockets versions."""
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None) or getattr(error, "status_code", None)
+
+
+def _forwardable(headers: List[Tuple[bytes, bytes]]) -> List[Tuple[bytes, bytes]]:
+    return [(name, value) for name, value in headers if name.lower() not in HOP_BY_HOP_HEADERS]
+
+
+class IngestForwardingMiddleware:
+    """
+    Serves a request locally when ``is_local(scope_type, method, path)`` is
+    true and forwards it to ``ingest_url`` otherwise. Without an ingest URL
+    forwarded requests are answered with 421 Misdirected Request.
+    """
+
+    def __init__(self, app, ingest_url: Optional[str], is_local: Callable[[str, str, str], bool],
+                 timeout: float = 30.0):
+        self.app = app
+        self.ingest_url = ingest_url.rstrip('/') if ingest_url else None
+        self.is_local = is_local
+        # Reads may stream indefinitely (server-sent events), so only connecting is bounded
+        self._client = httpx.AsyncClient(timeout=httpx.Timeout(timeout, read=None))
+        self.forwarded = 0
+
+    async def __call__(self, scope, receive, send):
+        scope_type = scope["type"]
+        if scope_type not in ("http", "websocket") or self.is_local(scope_type, scope.get("method", "GET"), scope["path"]):
+            await self.app(scope, receive, send)
+            return
+        self.forwarded += 1
+        if scope_type == "http":
+            await self._forward_http(scope, receive, send)
+        else:
+            await self._relay_websocket(scope, receive, send)
+
+    def _target(self, scope, scheme: str) -> str:
+        url = f"{scheme}{self.ingest_url.split('://', 1)[1]}{scope['path']}"
+        query = scope.get("query_string", b"")
+        return f"{url}?{query.decode('latin-1')}" if query else url
+
+    @staticmethod
+    async def _send_json(send, status_code: int, body: bytes):
+        await send({"type": "http.response.start", "status": status_code,
+                    "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]})
+        await send({"type": "http.response.body", "body": body})
+
+    async def _forward_http(self, scope, receive, send):
+        if self.ingest_url is None:
+            await self._send_json(send, 421, b'{"detail":"This read-only worker cannot serve this request and no ingest process URL is configured."}')
+            return
+        body = b""
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body += message.get("body", b"")
+            if not message.get("more_body", False):
+                break
+        scheme = "https://" if self.ingest_url.startswith("https://") else "http://"
+        request = self._client.build_request(scope["method"], self._target(scope, scheme),
+                                             headers=_forwardable(scope["headers"]), content=body)
+        try:
+            upstream = await self._client.send(request, stream=True)
+        except httpx.HTTPError as e:
+            logger.error(f"Forwarding {scope['method']} {scope['path']} to the ingest process failed: {e}")
+            await self._send_json(send, 502, b'{"detail":"The ingest process is not reachable."}')
+            return
+        try:
+            await send({"type": "http.response.start", "status": upstream.status_code,
+                        "headers": _forwardable(upstream.headers.raw)})
+            pump = asyncio.ensure_future(self._pump_body(upstream, send))
+            disconnect = asyncio.ensure_future(self._wait_disconnect(receive))
+            done, pending = await asyncio.wait({pump, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+            for task in pending:
+                task.cancel()
+            if pump in done:
+                pump.result()
+        finally:
+            await upstream.aclose()
+
+    @staticmethod
+    async def _pump_body(upstream: httpx.Response, send):
+        async for chunk in upstream.aiter_raw():
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    @staticmethod
+    async def _wait_disconnect(receive):
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    async def _relay_websocket(self, scope, receive, send):
+        if (await receive())["type"] != "websocket.connect":
+            return
+        if self.ingest_url is None:
+            await send({"type": "websocket.close", "code": 1013})
+            return
+        scheme = "wss://" if self.ingest_url.startswith("https://") else "ws://"
+        headers = [(name.decode("latin-1"), value.decode("latin-1"))
+                   for name, value in scope["headers"] if name.lower() in FORWARDED_WEBSOCKET_HEADERS]
+        try:
+            upstream = await websockets.connect(self._target(scope, scheme), max_size=None,
+                                                **{_WEBSOCKET_HEADERS_ARGUMENT: headers})
+        except websockets.exceptions.InvalidHandshake as e:
+            # The ingest process refused the handshake (e.g. a bad token): refuse it the same way
+            await send({"type": "websocket.close", "code": 1008 if _handshake_status(e) == 403 else 1011})
+            return
+        except (OSError, asyncio.TimeoutError, websockets.exceptions.WebSocketException) as e:
+            logger.error(f"Relaying websocket {scope['path']} to the ingest process failed: {e}")
+            await send({"type": "websocket.close", "code": 1013})
+            return
+        await send({"type": "websocket.accept"})
+
+        async def downstream():
+            try:
+                async for message in upstream:
+                    key = "text" if isinstance(message, str) else "bytes"
+                    await send({"type": "websocket.send", key: message})
+            except websockets.exceptions.ConnectionClosed:
+                pass
+            await send({"type": "websocket.close", "code": upstream.close_code or 1000,
+                        "reason": upstream.close_reason or ""})
+
+        async def upstream_pump():
+            while True:
+                message = await receive()
+                if message["type"] == "websocket.disconnect":
+                    return
+                await upstream.send(message["text"] if message.get("text") is not None else message.get("bytes", b""))
+
+        tasks = {asyncio.ensure_future(downstream()), asyncio.ensure_future(upstream_pump())}
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await upstream.close()
@@ -1,18 +1,45 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, status, WebSocket, WebSocketDisconnect, Query, Header
+from fastapi.responses import StreamingResponse, JSONResponse, Response
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel, Field # 新增 Field
 import requests
+import httpx
 import uuid # For generating unique IDs for self-registration
+import hashlib
 from jose import JWTError, jwt
-from datetime import datetime, timedelta
-import websocket
+from datetime import datetime, timedelta, timezone
 import json
-import threading
+import time
 import asyncio
 import logging
 import os
-from typing import Dict, List, Any, Optional
+import subprocess
+import sys
+from typing import Dict, List, Any, Optional, Set, Tuple
 import security_config  # 导入 security_config 模块
+import auth
+import cache_persister
+import discovery
+import history_log
+import ingest_proxy
+import change_log
+import delta_broadcaster
+import ingest_pipeline
+import metrics
+import node_registration
+import registry_connection
+import registry_federation
+import resource_export
+import resource_index
+import resource_query
+import resource_store
+import response_cache
+import resync
+import shared_store
+import snapshot_file
+import subscription_manager
+import topology_graph
+import warm_up
 
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -36,21 +63,152 @@ app.add_middleware(
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-nmos_resources: Dict[str, Dict[str, Any]] = {
-    "nodes": {}, "devices": {}, "senders": {},
-    "receivers": {}, "sources": {}, "flows": {}
-}
-known_resource_ids: Dict[str, str] = {}
+# 启动预热 (快照加载、资源发现、订阅) 在后台进行; 记录各阶段及从进程启动到就绪的时间
+startup_warm_up = warm_up.WarmUp()
+
+# Sequence-numbered record of every cache mutation, served by /resources/changes
+resource_change_log = change_log.ChangeLog(capacity=int(os.getenv("NMOS_CHANGELOG_CAPACITY", "10000")))
+# Copy-on-write cache of NMOS resources plus their secondary indexes. The grain ingest thread
+# writes whole batches under the store's lock; API handlers read `nmos_store.snapshot`
+# without locking and never observe a partially applied grain.
+# NMOS_SEARCH_INDEX=0 turns off the full-text/tag index behind /search (saves its memory and ingest time)
+nmos_store = resource_store.ResourceStore(
+    resource_change_log, compact=os.getenv("NMOS_COMPACT_STORE", "0").lower() in ("1", "true", "yes"),
+    search=os.getenv("NMOS_SEARCH_INDEX", "1").lower() in ("1", "true", "yes")
+)
+# Pre-serialized /resources bodies, validated by the snapshot generation
+serialized_responses = response_cache.SerializedResponseCache(etag_prefix=resource_change_log.epoch[:12])
+# /search result pages, kept apart so that typing-ahead cannot evict the /resources bodies
+search_responses = response_cache.SerializedResponseCache(etag_prefix=resource_change_log.epoch[:12])
+
+# 进程角色 (NMOS_REGISTRY_ROLE): standalone - 单进程 (默认); ingest - 订阅注册中心并把 store 发布到共享内存;
+# reader - 只读 API worker, 从共享内存提供资源查询, 其余请求转发给采集进程 (NMOS_INGEST_URL)
+REGISTRY_ROLE = os.getenv("NMOS_REGISTRY_ROLE", shared_store.ROLE_STANDALONE).lower()
+if REGISTRY_ROLE not in shared_store.ROLES:
+    raise ValueError(f"NMOS_REGISTRY_ROLE must be one of {shared_store.ROLES}, not '{REGISTRY_ROLE}'")
+SHARED_STORE_DIR = os.getenv("NMOS_SHARED_STORE_DIR") or shared_store.default_directory()
+shared_store_publisher: Optional[shared_store.SharedStorePublisher] = (
+    shared_store.SharedStorePublisher(nmos_store, SHARED_STORE_DIR,
+                                      interval=float(os.getenv("NMOS_SHARED_STORE_INTERVAL_MS", "100")) / 1000.0,
+                                      status_fn=lambda: registry_status())
+    if REGISTRY_ROLE == shared_store.ROLE_INGEST else None
+)
+shared_store_reader: Optional[shared_store.SharedStoreReader] = (
+    shared_store.SharedStoreReader(SHARED_STORE_DIR) if REGISTRY_ROLE == shared_store.ROLE_READER else None
+)
 
-registry_url: Optional[str] = None
-ws_connection: Optional[websocket.WebSocketApp] = None
-ws_thread: Optional[threading.Thread] = None
+def current_snapshot():
+    """The store snapshot read endpoints serve: the local one, or in a reader worker the latest published one."""
+    global serialized_responses
+    if shared_store_reader is None:
+        return nmos_store.snapshot
+    snapshot = shared_store_reader.snapshot()
+    etag_prefix = snapshot.epoch[:12]
+    if serialized_responses.etag_prefix != etag_prefix:
+        # 采集进程重启后 generation 重新计数, 之前缓存的响应体和 ETag 都已失效
+        serialized_responses = response_cache.SerializedResponseCache(etag_prefix=etag_prefix)
+    return snapshot
+
+def served_by_reader(scope_type: str, method: str, path: str) -> bool:
+    """Requests a reader worker answers from the shared store itself; everything else goes to the ingest process."""
+    if scope_type != "http":
+        return False
+    if method == "OPTIONS":
+        return True
+    if method == "POST":
+        return path == "/token"
+    if method not in ("GET", "HEAD"):
+        return False
+    if path.startswith("/resources"):
+        return path not in ("/resources/changes", "/resources/stream")
+    return path in ("/health", "/health/live", "/health/ready", "/metrics", "/docs", "/docs/oauth2-redirect", "/redoc", "/openapi.json")
+
+if REGISTRY_ROLE == shared_store.ROLE_READER:
+    app.add_middleware(ingest_proxy.IngestForwardingMiddleware,
+                       ingest_url=os.getenv("NMOS_INGEST_URL"), is_local=served_by_reader)
+
+# 主注册中心连续失败 (心跳失败或重连失败) 达到该次数后切换到下一个已连接的注册中心
+PRIMARY_FAILOVER_THRESHOLD = int(os.getenv("NMOS_PRIMARY_FAILOVER_THRESHOLD", "3"))
+# 按资源类型的过滤订阅 (JSON 文件路径或内联 JSON); 未配置时订阅 "/" 接收所有类型的变更
+SUBSCRIPTIONS_CONFIG = os.getenv("NMOS_SUBSCRIPTIONS_CONFIG")
+SUBSCRIPTION_SPECS = subscription_manager.load_subscription_specs(SUBSCRIPTIONS_CONFIG) if SUBSCRIPTIONS_CONFIG else None
+if SUBSCRIPTION_SPECS:
+    logger.info(f"按类型过滤订阅: {[(spec.resource_type, spec.params) for spec in SUBSCRIPTION_SPECS]}")
 
 # Globals for self-registration
 self_node_id: Optional[str] = None
-self_node_heartbeat_thread: Optional[threading.Thread] = None
-self_node_heartbeat_stop_event = threading.Event()
-REGISTRATION_API_URL: Optional[str] = None # To store the base URL for registration API
+# 自身节点和虚拟节点的注册与心跳都在事件循环上由同一个调度器完成 (时间轮 + 共享连接池)
+heartbeat_scheduler = node_registration.HeartbeatScheduler(
+    interval=float(os.getenv("NMOS_HEARTBEAT_INTERVAL_SECONDS", "5")),
+    jitter=float(os.getenv("NMOS_HEARTBEAT_JITTER_SECONDS", "0.5")),
+    max_concurrency=int(os.getenv("NMOS_HEARTBEAT_MAX_CONCURRENCY", "32")),
+    failure_threshold=PRIMARY_FAILOVER_THRESHOLD,
+    on_registry_failing=lambda: request_primary_failover("heartbeat", registries.primary_url))
+# Event loop of the service, for callbacks arriving on other threads
+event_loop: Optional[asyncio.AbstractEventLoop] = None
+
+# Most recent (or currently running) paged discovery, for progress reporting
+current_discovery: Optional[discovery.DiscoveryEngine] = None
+
+# 缓存定期写入磁盘，重启时先加载快照再与注册中心对账 (未设置 NMOS_SNAPSHOT_PATH 时不启用)
+SNAPSHOT_PATH = os.getenv("NMOS_SNAPSHOT_PATH", "")
+snapshot_writer: Optional[snapshot_file.SnapshotWriter] = (
+    snapshot_file.SnapshotWriter(nmos_store, SNAPSHOT_PATH,
+                                 interval=float(os.getenv("NMOS_SNAPSHOT_INTERVAL_SECONDS", "30")),
+                                 registry_urls_fn=lambda: registries.urls)
+    if SNAPSHOT_PATH else None
+)
+# Background task filling the cache after start-up (see warm_up_cache)
+warm_up_task: Optional[asyncio.Task] = None
+
+# 已完整发现或对账过的注册中心; 缓存为空或仍在填充时不能据此删除数据库中的行
+complete_registries: Set[str] = set()
+
+def mark_registry_complete(query_api_url: str, progress: Dict[str, discovery.TypeProgress]):
+    if any(type_progress.status == "error" for type_progress in progress.values()):
+        complete_registries.discard(query_api_url)
+    else:
+        complete_registries.add(query_api_url)
+
+def cache_complete() -> bool:
+    """Whether the cache holds the whole inventory of every configured registry (warm-up finished, all listed)."""
+    urls = registries.urls
+    return startup_warm_up.ready and bool(urls) and all(url in complete_registries for url in urls)
+
+# 资源缓存异步批量写入 PostgreSQL (DATABASE_URL, 也可用 sqlite:///<path> 做本地测试); 只读 worker 不写数据库
+DATABASE_URL = os.getenv("DATABASE_URL", "")
+persistence_writer: Optional[cache_persister.CachePersister] = None
+if DATABASE_URL and REGISTRY_ROLE != shared_store.ROLE_READER:
+    try:
+        persistence_writer = cache_persister.CachePersister(
+            nmos_store, cache_persister.backend_for(DATABASE_URL),
+            flush_interval=float(os.getenv("NMOS_PERSIST_FLUSH_MS", "1000")) / 1000.0,
+            max_batch=int(os.getenv("NMOS_PERSIST_BATCH", "1000")),
+            complete=cache_complete)
+    except (ImportError, ValueError) as e:
+        logger.error(f"资源缓存持久化未启用 (DATABASE_URL 无法使用): {e}")
+
+# 资源变更历史 (NMOS_HISTORY_DIR): 分段压缩的变更日志 + 检查点, 支持按时间点查询 (GET /history); 只读 worker 不写历史
+HISTORY_DIR = os.getenv("NMOS_HISTORY_DIR", "")
+resource_history: Optional[history_log.HistoryLog] = (
+    history_log.HistoryLog(nmos_store, HISTORY_DIR,
+                           segment_bytes=int(float(os.getenv("NMOS_HISTORY_SEGMENT_MB", "16")) * 2**20),
+                           segment_seconds=float(os.getenv("NMOS_HISTORY_SEGMENT_SECONDS", "3600")),
+                           retention_bytes=int(float(os.getenv("NMOS_HISTORY_RETENTION_MB", "1024")) * 2**20),
+                           interval=float(os.getenv("NMOS_HISTORY_INTERVAL_MS", "1000")) / 1000.0)
+    if HISTORY_DIR and REGISTRY_ROLE != shared_store.ROLE_READER else None
+)
+
+# 媒体拓扑图 (node→device→sender/receiver→flow→source 及活动连接), 随变更日志增量维护 (GET /topology);
+# 只读 worker 把 /topology 请求转发到采集进程
+topology: Optional[topology_graph.TopologyGraph] = (
+    topology_graph.TopologyGraph(nmos_store,
+                                 interval=float(os.getenv("NMOS_TOPOLOGY_INTERVAL_MS", "250")) / 1000.0,
+                                 capacity=resource_change_log.capacity)
+    if REGISTRY_ROLE != shared_store.ROLE_READER else None
+)
+topology_responses = response_cache.SerializedResponseCache(
+    etag_prefix=topology.changes.epoch[:12] if topology else "topology", max_entries=64)
 
 # --- Pydantic Models for API Responses ---
 class ResourceModel(BaseModel): # 基础的NMOS资源模型 (可以更具体)
@@ -67,6 +225,21 @@ class ResourcesResponse(BaseModel):
     sources: List[Dict[str, Any]]
     flows: List[Dict[str, Any]]
 
+class ResourceChange(BaseModel):
+    sequence: int
+    operation: str # create | update | delete
+    resource_type: str
+    resource_id: str
+    resource: Optional[Dict[str, Any]] = None
+    recorded_at: Optional[float] = None # 变更写入缓存的时间 (Unix 秒)
+
+class ResourceChangesResponse(BaseModel):
+    epoch: str
+    current_sequence: int
+    resync_required: bool
+    has_more: bool = False
+    changes: List[ResourceChange]
+
 class SelfRegistrationStatus(BaseModel):
     node_id: Optional[str] = None
     status: str
@@ -85,11 +258,21 @@ class HealthResponse(BaseModel):
     nmos_registry_url: Optional[str] = None
     websocket_status: str
     cached_resources_count: CachedCounts
+    registries: Dict[str, str] = {}
 
 class DiscoverResponse(BaseModel):
     message: str
     processed_resource_count: int
     resource_summary: Dict[str, int]
+    duration_seconds: Optional[float] = None
+    type_progress: Optional[Dict[str, Dict[str, Any]]] = None
+    reconciled: Optional[Dict[str, int]] = None
+
+class DiscoveryProgressResponse(BaseModel):
+    query_api_url: Optional[str] = None
+    running: bool
+    duration_seconds: Optional[float] = None
+    type_progress: Dict[str, Dict[str, Any]]
 
 class RegistryConfig(BaseModel):
     registry_address: str
@@ -99,97 +282,310 @@ class ConfigureResponse(BaseModel):
     message: str
     url: Optional[str] = None
 
+class VirtualNodeRegistration(BaseModel):
+    node: Dict[str, Any]
+    devices: List[Dict[str, Any]] = []
+    sources: List[Dict[str, Any]] = []
+    flows: List[Dict[str, Any]] = []
+    senders: List[Dict[str, Any]] = []
+    receivers: List[Dict[str, Any]] = []
+
+class RegistryEndpoint(BaseModel):
+    query_api_url: str
+    primary: bool = False
+
 class UserPasswordChange(BaseModel):
     current_password: str
     new_password: str
 
 # JWT认证配置
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+# bcrypt 在专用线程池中执行，登录高峰不会阻塞事件循环; 已验证的 token 缓存到其 exp 为止
+# 默认线程数少于 CPU 核数, 为事件循环留出一个核 (单核机器上仍为 1)
+DEFAULT_AUTH_WORKERS = max(1, min(2, (os.cpu_count() or 1) - 1))
+password_hasher = auth.PasswordHasher(max_workers=int(os.getenv("NMOS_AUTH_WORKERS", str(DEFAULT_AUTH_WORKERS))),
+                                      max_pending=int(os.getenv("NMOS_AUTH_MAX_PENDING", "64")))
+verified_tokens = auth.TokenCache(max_entries=int(os.getenv("NMOS_TOKEN_CACHE_SIZE", "1024")))
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
-        expire = datetime.now(datetime.timezone.utc) + expires_delta
+        expire = datetime.now(timezone.utc) + expires_delta
     else:
-        expire = datetime.now(datetime.timezone.utc) + timedelta(minutes=security_config.ACCESS_TOKEN_EXPIRE_MINUTES)
+        expire = datetime.now(timezone.utc) + timedelta(minutes=security_config.ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(to_encode, security_config.SECRET_KEY, algorithm=security_config.ALGORITHM)
     return encoded_jwt
 
-# 获取当前登录用户 (使用JWT token)
-async def get_current_user(token: str = Depends(oauth2_scheme)):
+def authenticate_token(token: str):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, security_config.SECRET_KEY, algorithms=[security_config.ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
+    if shared_store_reader is not None:
+        security_config.reload_users_if_changed()
+    username = verified_tokens.get(token)
+    if username is None:
+        try:
+            payload = jwt.decode(token, security_config.SECRET_KEY, algorithms=[security_config.ALGORITHM])
+            username = payload.get("sub")
+            if username is None:
+                raise credentials_exception
+        except JWTError:
             raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-    user = security_config.USERS.get(username)
-    if user is None:
+        verified_tokens.put(token, username, payload.get("exp"))
+    # 用户仍需存在: 删除的用户即使 token 仍在缓存中也会被拒绝
+    user_key = security_config.find_user_key(username)
+    if user_key is None:
         raise credentials_exception
-    return user
+    return security_config.USERS[user_key]
+
+# 获取当前登录用户 (使用JWT token)
+async def get_current_user(token: str = Depends(oauth2_scheme)):
+    return authenticate_token(token)
 
 # --- NMOS Self-Registration and Discovery Functions --- 
 
-def fetch_initial_resources(query_api_base_url: str):
-    global nmos_resources, known_resource_ids
+def apply_store_changes(changes: List[resource_store.StoreChange], source: str,
+                        origin: Optional[str] = None) -> List[Optional[str]]:
+    """
+    Applies one batch to the cache and records its outcome and latency. Changes from a
+    registry (``origin``) go through the federation's merging rules.
+    """
+    started = time.perf_counter()
+    outcomes = registries.apply_changes(changes, origin) if origin else nmos_store.apply(changes)
+    metrics.STORE_APPLY_SECONDS.labels(source).observe(time.perf_counter() - started)
+    outcome_counts: Dict[str, int] = {}
+    for outcome in outcomes:
+        outcome = outcome or "skipped"
+        outcome_counts[outcome] = outcome_counts.get(outcome, 0) + 1
+    for outcome, count in outcome_counts.items():
+        metrics.RESOURCE_CHANGES.labels(source, outcome).inc(count)
+    return outcomes
+
+def apply_discovered_page(res_type: str, resources_list: List[Dict[str, Any]], origin: Optional[str] = None) -> int:
+    # A page is applied as one store batch
+    changes = [change for change in map(prepare_resource_update, resources_list) if change is not None]
+    return sum(1 for outcome in apply_store_changes(changes, "discovery", origin) if outcome is not None)
+
+def registry_resource_filters(query_api_base_url: str) -> Optional[Dict[str, Dict[str, str]]]:
+    # 配置了过滤订阅时，发现与对账也只覆盖订阅的类型和过滤条件
+    connection = registries.get(query_api_base_url)
+    return connection.resource_filters if connection else None
+
+def record_discovery_metrics(engine: discovery.DiscoveryEngine, kind: str):
+    metrics.DISCOVERY_RUNS.labels(kind).inc()
+    for res_type, type_progress in engine.progress.items():
+        metrics.DISCOVERY_DURATION_SECONDS.labels(res_type).set(type_progress.duration or 0.0)
+        metrics.DISCOVERY_RESOURCES.labels(res_type).set(type_progress.fetched)
+
+async def fetch_initial_resources(query_api_base_url: str):
+    global current_discovery
     logger.info(f"Fetching initial resources from {query_api_base_url}")
-    resource_types_to_fetch = ["nodes", "devices", "senders", "receivers", "sources", "flows"]
     # Clear existing resources before fetching new ones from a new registry
-    nmos_resources = {
-        "nodes": {}, "devices": {}, "senders": {},
-        "receivers": {}, "sources": {}, "flows": {}
+    nmos_store.replace_all()
+    complete_registries.clear()
+
+    # All six types are paged through concurrently, so the fetch takes as long as the slowest type
+    engine = discovery.DiscoveryEngine(query_api_base_url,
+                                       lambda res_type, page: apply_discovered_page(res_type, page, query_api_base_url),
+                                       query_filters=registry_resource_filters(query_api_base_url))
+    current_discovery = engine
+    progress = await engine.run()
+    record_discovery_metrics(engine, "full")
+    mark_registry_complete(query_api_base_url, progress)
+
+    summary = {res_type: type_progress.processed for res_type, type_progress in progress.items()}
+    processed_count = sum(summary.values())
+    failed_types = [res_type for res_type, type_progress in progress.items() if type_progress.status == "error"]
+    if failed_types:
+        logger.warning(f"Initial resource discovery failed for types: {failed_types}")
+    logger.info(f"Finished fetching initial resources in {engine.duration:.3f}s. Processed {processed_count} resources. Summary: {summary}")
+    return DiscoverResponse(message="Initial resource discovery complete.",
+                            processed_resource_count=processed_count,
+                            resource_summary=summary,
+                            duration_seconds=engine.duration,
+                            type_progress=engine.progress_report())
+
+async def reconcile_with_registry(query_api_base_url: str):
+    """
+    Brings the cache up to date with the registry without clearing it first: only
+    resources whose version changed are applied, vanished ones are deleted. Cached
+    versions are compared across all registries, so a resource another registry
+    already delivered at the same version is not applied again.
+    """
+    global current_discovery
+    snapshot = nmos_store.snapshot
+    known_versions = {
+        res_type: {res_id: record.get("version") for res_id, record in resources_dict.items()}
+        for res_type, resources_dict in snapshot.resources.items()
     }
-    known_resource_ids = {}
-    
+    logger.info(f"Reconciling {snapshot.total()} cached resources against {query_api_base_url}")
+    reconciler = discovery.Reconciler(known_versions,
+                                      lambda res_type, page: apply_discovered_page(res_type, page, query_api_base_url))
+    engine = discovery.DiscoveryEngine(query_api_base_url, reconciler.apply_page,
+                                       query_filters=registry_resource_filters(query_api_base_url))
+    current_discovery = engine
+    progress = await engine.run()
+    record_discovery_metrics(engine, "reconcile")
+    mark_registry_complete(query_api_base_url, progress)
+
+    vanished = reconciler.vanished(progress)
+    # 只删除由该注册中心提供的资源; 其他注册中心 (其他网段) 的资源不受影响
+    deletable = registries.deletable_ids(query_api_base_url, [res_id for ids in vanished.values() for res_id in ids])
+    deletions = [resource_store.StoreChange(resource_store.OP_DELETE, res_id) for res_id in deletable]
+    deleted_count = sum(1 for outcome in apply_store_changes(deletions, "reconcile", query_api_base_url) if outcome is not None) if deletions else 0
+    failed_types = [res_type for res_type, type_progress in progress.items() if type_progress.status == "error"]
+    if failed_types:
+        logger.warning(f"Reconciliation could not list types {failed_types}; their cached resources were kept as they are.")
+
+    summary = {res_type: type_progress.processed for res_type, type_progress in progress.items()}
+    processed_count = sum(summary.values())
+    logger.info(f"Reconciled with {query_api_base_url} in {engine.duration:.3f}s: {reconciler.unchanged} unchanged, "
+                f"{reconciler.changed} new or changed, {deleted_count} deleted.")
+    return DiscoverResponse(message=f"Cache reconciled: {reconciler.unchanged} unchanged, {reconciler.changed} new or changed, {deleted_count} deleted.",
+                            processed_resource_count=processed_count,
+                            resource_summary=summary,
+                            duration_seconds=engine.duration,
+                            type_progress=engine.progress_report(),
+                            reconciled={"unchanged": reconciler.unchanged, "changed": reconciler.changed, "deleted": deleted_count})
+
+async def discover_all_registries():
+    """Reconciles the cache with every configured registry concurrently."""
+    urls = registries.urls
+    started = time.monotonic()
+    results = await asyncio.gather(*(reconcile_with_registry(url) for url in urls), return_exceptions=True)
+    reconciled = {"unchanged": 0, "changed": 0, "deleted": 0}
     processed_count = 0
-    summary = {res_type: 0 for res_type in resource_types_to_fetch}
+    for url, result in zip(urls, results):
+        if isinstance(result, Exception):
+            logger.error(f"与注册中心 {url} 对账失败: {result}")
+            continue
+        processed_count += result.processed_resource_count
+        for key in reconciled:
+            reconciled[key] += result.reconciled.get(key, 0)
+    snapshot = nmos_store.snapshot
+    return DiscoverResponse(message=f"Reconciled with {len(urls)} registries: {snapshot.total()} unique resources cached.",
+                            processed_resource_count=processed_count,
+                            resource_summary=snapshot.counts(),
+                            duration_seconds=time.monotonic() - started,
+                            reconciled=reconciled)
+
+async def resync_registry(connection: registry_connection.RegistryConnection, reason: str) -> Dict[str, Any]:
+    metrics.RESYNCS.labels(connection.query_api_url, reason).inc()
+    result = await reconcile_with_registry(connection.query_api_url)
+    return {"registry_url": connection.query_api_url, "processed": result.processed_resource_count, **result.reconciled}
+
+def create_registry_connection(query_api_url: str) -> registry_connection.RegistryConnection:
+    # 每个注册中心有自己的 WebSocket 订阅、ingest 流水线和对账协调器，变更按来源合并到同一个缓存
+    return registry_connection.RegistryConnection(
+        query_api_url, parse_grain_message,
+        lambda changes, origin: apply_store_changes(changes, "grain", origin),
+        resync_registry,
+        pipeline_options={
+            "max_queue": int(os.getenv("NMOS_INGEST_QUEUE_SIZE", "10000")),
+            "batch_window": float(os.getenv("NMOS_INGEST_BATCH_WINDOW_MS", "50")) / 1000.0,
+            "max_batch_frames": int(os.getenv("NMOS_INGEST_MAX_BATCH_FRAMES", "1000")),
+            "backpressure": os.getenv("NMOS_INGEST_BACKPRESSURE", ingest_pipeline.BACKPRESSURE_BLOCK),
+        },
+        # 断线重连: 抖动指数退避; 主动关闭 (重新配置/服务关闭) 时不重连
+        backoff=resync.Backoff(initial=float(os.getenv("NMOS_RECONNECT_INITIAL_SECONDS", "1")),
+                               maximum=float(os.getenv("NMOS_RECONNECT_MAX_SECONDS", "60"))),
+        on_connection_lost=on_registry_connection_lost,
+        subscriptions=SUBSCRIPTION_SPECS)
+
+# All configured registries (NMOS_EXTERNAL_REGISTRY_URLS, /configure, /registries), merged into nmos_store
+registries = registry_federation.RegistryFederation(nmos_store, create_registry_connection)
+
+def primary_registry_url() -> Optional[str]:
+    return registries.primary_url
+
+def start_registry_subscriptions():
+    for connection in registries.connections():
+        if not connection.connected:
+            try:
+                connection.start()
+            except Exception as e:
+                logger.error(f"启动对 {connection.query_api_url} 的 WebSocket 订阅时发生错误: {e}", exc_info=True)
+
+async def fail_over_primary(reason: str, failed_url: Optional[str]):
+    """
+    Moves the primary away from ``failed_url`` (the primary when the failure was reported)
+    to another connected registry and re-registers the registered nodes there.
+    """
+    if failed_url is None or registries.primary_url != failed_url or len(registries.urls) < 2:
+        # 同一次故障的多个报告排队执行: 第一个已完成切换, 其余不能再把主注册中心切回去
+        return
+    new_primary = registries.fail_over(reason)
+    if new_primary is None:
+        return
+    metrics.PRIMARY_FAILOVERS.labels(reason).inc()
+    if heartbeat_scheduler.registration_api_url:
+        heartbeat_scheduler.move_to(registries.primary.registration_api_url)
+        logger.info(f"切换主注册中心后将在 {registries.primary.registration_api_url} 重新注册 {len(heartbeat_scheduler.nodes())} 个节点。")
+
+def request_primary_failover(reason: str, failed_url: Optional[str]):
+    # 可从 WebSocket 线程或事件循环调用; failed_url 在报告故障时记录
+    if event_loop is not None and not event_loop.is_closed():
+        asyncio.run_coroutine_threadsafe(fail_over_primary(reason, failed_url), event_loop)
+
+def on_registry_connection_lost(connection: registry_connection.RegistryConnection):
+    if (connection.query_api_url == registries.primary_url and len(registries.urls) > 1
+            and connection.consecutive_failures >= PRIMARY_FAILOVER_THRESHOLD):
+        request_primary_failover("websocket", connection.query_api_url)
+
+def load_cache_snapshot() -> bool:
+    """Loads the on-disk snapshot into the cache if it was taken from the configured registries."""
+    started = time.monotonic()
+    loaded = snapshot_file.read_snapshot(SNAPSHOT_PATH)
+    if loaded is None:
+        logger.info(f"没有可用的缓存快照 ({SNAPSHOT_PATH})，将执行完整的资源发现。")
+        return False
+    if set(loaded.registry_urls) != set(registries.urls):
+        logger.info(f"缓存快照来自注册中心 {loaded.registry_urls}，与当前配置 {registries.urls} 不同，忽略该快照。")
+        return False
+    snapshot = nmos_store.replace_all(loaded.resources, loaded.origins)
+    logger.info(f"已从快照 {SNAPSHOT_PATH} (写于 {loaded.header.get('written_at')}) 加载 {snapshot.total()} 个资源，"
+                f"耗时 {time.monotonic() - started:.3f}s。")
+    return True
 
-    for res_type in resource_types_to_fetch:
-        try:
-            url = f"{query_api_base_url}/{res_type}"
-            logger.debug(f"Fetching resources from URL: {url}")
-            response = requests.get(url, timeout=10)
-            logger.debug(f"Response status code for {url}: {response.status_code}")
-            # Log first 500 chars of response for debugging, be careful with large responses in production
-            logger.debug(f"Response text (first 500 chars) for {url}: {response.text[:500]}")
-            response.raise_for_status() # Will raise an HTTPError if the HTTP request returned an unsuccessful status code
-            resources_list = response.json()
-            if isinstance(resources_list, list):
-                for resource_data in resources_list:
-                    if process_resource_update(resource_data): # process_resource_update should exist elsewhere
-                        processed_count += 1
-                        summary[res_type] += 1
-            else:
-                logger.warning(f"Expected a list of resources for {res_type} from {url}, but got {type(resources_list)}")
-        except requests.exceptions.HTTPError as e:
-            logger.error(f"HTTP error fetching {res_type} from {url}: {e}. Response status: {e.response.status_code if e.response else 'N/A'}, Response text: {e.response.text if e.response else 'N/A'}")
-        except requests.RequestException as e:
-            logger.error(f"Request exception fetching {res_type} from {url}: {e}")
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON decode error for {res_type} from {url}: {e}. Response text that failed to parse: {response.text if 'response' in locals() else 'Response object not available'}")
-    logger.info(f"Finished fetching initial resources. Processed {processed_count} resources. Summary: {summary}")
-    return DiscoverResponse(message="Initial resource discovery complete.", processed_resource_count=processed_count, resource_summary=summary)
-
-def register_self_node_resource(registration_api_base_url: str):
-    global self_node_id, self_node_heartbeat_thread, self_node_heartbeat_stop_event, REGISTRATION_API_URL
-    
-    REGISTRATION_API_URL = registration_api_base_url # Store for heartbeat
+def finish_warm_up():
+    time_to_ready = startup_warm_up.mark_ready()
+    metrics.TIME_TO_READY_SECONDS.set(time_to_ready)
+    for phase in startup_warm_up.phases:
+        metrics.WARM_UP_PHASE_SECONDS.labels(phase.name).set(phase.duration)
+
+async def warm_up_cache():
+    """
+    Fills the cache in the background after start-up: the on-disk snapshot if it matches,
+    then a reconciliation with every registry, then the subscriptions. Discovery applies
+    each page to the store as it arrives, so the inventory is served while it grows.
+    """
+    snapshot_loaded = False
+    try:
+        if SNAPSHOT_PATH:
+            with startup_warm_up.phase("snapshot"):
+                snapshot_loaded = await asyncio.to_thread(load_cache_snapshot)
+        # 缓存为空时对账等同于完整发现; 多个注册中心并发进行
+        with startup_warm_up.phase("reconcile" if snapshot_loaded else "discovery"):
+            await discover_all_registries()
+    except Exception as e:
+        logger.error(f"启动时加载快照或发现资源失败: {e}", exc_info=True)
+    try:
+        with startup_warm_up.phase("subscriptions"):
+            start_registry_subscriptions()
+    finally:
+        finish_warm_up()
 
-    if self_node_heartbeat_thread and self_node_heartbeat_thread.is_alive():
-        logger.info("Stopping existing self-node heartbeat thread.")
-        self_node_heartbeat_stop_event.set()
-        self_node_heartbeat_thread.join(timeout=5)
-        if self_node_heartbeat_thread.is_alive():
-            logger.warning("Existing self-node heartbeat thread did not stop in time.")
-        self_node_heartbeat_thread = None
-    self_node_heartbeat_stop_event.clear()
+async def register_self_node_resource(registration_api_base_url: str):
+    global self_node_id
+
+    # 旧的自身节点先从原 Registration API 注销 (move_to 之后 DELETE 会发往新的注册中心, 旧注册中心只能等它过期);
+    # 然后所有已注册的节点 (包括虚拟节点) 跟随到该 Registration API, 自身节点以新的 ID 重新注册
+    if self_node_id:
+        await heartbeat_scheduler.unregister(self_node_id)
+    heartbeat_scheduler.move_to(registration_api_base_url)
 
     self_node_id = str(uuid.uuid4())
     # Determine host IP and port for the href. Fallback to localhost and a default/configurable port.
@@ -200,7 +596,7 @@ def register_self_node_resource(registration_api_base_url: str):
 
     node_resource = {
         "id": self_node_id,
-        "version": f"{int(datetime.now().timestamp())}:0", 
+        "version": node_registration.nmos_version(),
         "label": "NMOS Controller Application Node",
         "description": "This node represents the NMOS Controller application itself.",
         "href": node_href,
@@ -210,269 +606,183 @@ def register_self_node_resource(registration_api_base_url: str):
         "clocks": [],
         "interfaces": [] 
     }
-    resource_payload = {
-        "type": "node",
-        "data": node_resource
-    }
-    registration_url = f"{registration_api_base_url}/resource"
     try:
-        logger.info(f"Attempting to register self as node: {self_node_id} at {registration_url} with payload {json.dumps(resource_payload)}")
-        logger.debug(f"Attempting to register self as node. URL: {registration_url}, Payload: {json.dumps(resource_payload)}")
-        response = requests.post(registration_url, json=resource_payload, timeout=10)
-        logger.debug(f"Self-registration response status code: {response.status_code}")
-        logger.debug(f"Self-registration response text (first 500 chars): {response.text[:500]}")
-        response.raise_for_status()
-        registered_node = response.json()
-        logger.info(f"Successfully registered self as NMOS Node: {registered_node.get('id')}")
-        self_node_heartbeat_thread = threading.Thread(target=run_self_node_heartbeat, daemon=True)
-        self_node_heartbeat_thread.start()
-        return SelfRegistrationStatus(node_id=self_node_id, status="success", detail="Node registered and heartbeat started.")
-    except requests.exceptions.HTTPError as e:
-        error_detail = f"HTTP error during self-registration: {e}. Status: {e.response.status_code if e.response else 'N/A'}, Response: {e.response.text if e.response else 'N/A'}"
+        logger.info(f"Attempting to register self as node: {self_node_id} at {registration_api_base_url}/resource")
+        await heartbeat_scheduler.register(node_registration.RegisteredNode(node_resource))
+        logger.info(f"Successfully registered self as NMOS Node: {self_node_id}")
+        return SelfRegistrationStatus(node_id=self_node_id, status="success", detail="Node registered and heartbeat scheduled.")
+    except httpx.HTTPStatusError as e:
+        error_detail = f"HTTP error during self-registration: {e}. Status: {e.response.status_code}, Response: {e.response.text}"
         logger.error(error_detail)
         self_node_id = None 
         return SelfRegistrationStatus(node_id=None, status="error", detail=error_detail)
-    except requests.RequestException as e:
+    except httpx.HTTPError as e:
         error_detail = f"Request exception during self-registration: {e}"
         logger.error(error_detail)
         self_node_id = None 
         return SelfRegistrationStatus(node_id=None, status="error", detail=error_detail)
-    except json.JSONDecodeError as e:
-        error_detail = f"JSON decode error during self-registration: {e}. Response text: {response.text if 'response' in locals() else 'Response object not available'}"
-        logger.error(error_detail)
-        self_node_id = None
-        return SelfRegistrationStatus(node_id=None, status="error", detail=error_detail)
-
-def run_self_node_heartbeat():
-    global self_node_id, self_node_heartbeat_stop_event, REGISTRATION_API_URL
-    if not self_node_id or not REGISTRATION_API_URL:
-        logger.error("Cannot start self-node heartbeat: node_id or registration_api_url not set.")
-        return
-
-    heartbeat_url = f"{REGISTRATION_API_URL}/health/nodes/{self_node_id}"
-    logger.info(f"Starting self-node heartbeat for {self_node_id} to {heartbeat_url}")
-    # IS-04 recommends heartbeat interval of 5 seconds for registration API.
-    # The wait timeout for the event should be the heartbeat interval.
-    while not self_node_heartbeat_stop_event.wait(5.0):
-        try:
-            logger.debug(f"Sending heartbeat for node {self_node_id} to {heartbeat_url}")
-            response = requests.post(heartbeat_url, timeout=2) # Short timeout for the POST itself
-            logger.debug(f"Heartbeat response status code: {response.status_code}, text: {response.text[:200]}")
-            if response.status_code == 200:
-                logger.debug(f"Heartbeat successful for node {self_node_id}. Response: {response.json()}")
-            elif response.status_code == 404:
-                logger.warning(f"Node {self_node_id} not found during heartbeat (404). Attempting re-registration.")
-                # Simple re-registration attempt. Could be more sophisticated.
-                self_node_heartbeat_stop_event.set() # Stop current heartbeat attempt
-                logger.info("Attempting to re-register node...")
-                # Ensure REGISTRATION_API_URL is still valid and available
-                rereg_status = register_self_node_resource(REGISTRATION_API_URL) 
-                if rereg_status.status == "success":
-                    logger.info("Successfully re-registered node after 404 on heartbeat.")
-                    # The new register_self_node_resource call will start a new heartbeat thread if successful.
-                    # So, this current thread should exit.
-                    break # Exit this loop, new heartbeat thread is running
-                else:
-                    logger.error(f"Failed to re-register node after 404. Stopping heartbeat. Detail: {rereg_status.detail}")
-                    break # Exit this loop, re-registration failed
-            else:
-                logger.warning(f"Heartbeat for node {self_node_id} failed with status {response.status_code}: {response.text}")
-        except requests.exceptions.HTTPError as e:
-            logger.error(f"HTTP error during heartbeat for node {self_node_id}: {e}. Status: {e.response.status_code if e.response else 'N/A'}, Response: {e.response.text if e.response else 'N/A'}")
-            # If heartbeat fails due to HTTP error (e.g. 500 from registry), continue trying for a while
-        except requests.RequestException as e:
-            logger.error(f"Request exception during heartbeat for node {self_node_id}: {e}")
-        except Exception as e:
-            logger.error(f"Unexpected error in heartbeat thread: {e}", exc_info=True)
-    logger.info(f"Self-node heartbeat thread for {self_node_id} stopped.")
-
 
 
 # --- Helper Functions (与之前相同，为简洁省略，但它们应该在这里) ---
-def start_websocket_subscription():
-    global registry_url, ws_connection, ws_thread
-    if ws_thread and ws_thread.is_alive():
-        logger.info("WebSocket 线程已在运行。如果需要更改 URL，请先停止现有连接。")
-        if ws_connection:
-             logger.info("正在关闭现有 WebSocket 连接...")
-             ws_connection.close() 
-             ws_thread.join(timeout=5) 
-             logger.info("现有 WebSocket 连接已关闭。")
-        ws_connection = None
-        ws_thread = None
-
-    if registry_url:
-        try:
-            if not isinstance(registry_url, str) or not (registry_url.startswith("http://") or registry_url.startswith("https://")):
-                logger.error(f"无效的 NMOS 注册中心 URL 格式: {registry_url}. 应包含 http:// 或 https://")
-                return
-            query_api_base = registry_url
-            if query_api_base.endswith('/'):
-                query_api_base = query_api_base[:-1]
-            ws_path_segment = "/subscriptions" 
-            if query_api_base.startswith("https://"):
-                ws_scheme = "wss://"
-                base_for_ws_url = query_api_base[len("https://"):]
-            elif query_api_base.startswith("http://"):
-                ws_scheme = "ws://"
-                base_for_ws_url = query_api_base[len("http://"):]
-            else:
-                logger.error(f"registry_url ('{registry_url}') 必须以 http:// 或 https:// 开头。")
-                return
-            ws_url = f"{ws_scheme}{base_for_ws_url}{ws_path_segment}"
-            logger.info(f"尝试连接到 WebSocket: {ws_url}")
-            ws_connection = websocket.WebSocketApp(ws_url,
-                                        on_open=on_open,
-                                        on_message=on_message,
-                                        on_error=on_error,
-                                        on_close=on_close)
-            ws_thread = threading.Thread(target=ws_connection.run_forever, daemon=True)
-            ws_thread.start()
-            logger.info(f"WebSocket订阅线程已启动，连接到 {ws_url}")
-        except Exception as e:
-            logger.error(f"启动 WebSocket 订阅时发生错误: {e}", exc_info=True)
-    else:
-        logger.warning("未配置 NMOS 注册中心 URL，WebSocket 订阅未启动。")
-
-def process_resource_update(resource_data: Dict):
-    global nmos_resources, known_resource_ids
-    if not isinstance(resource_data, dict) or "id" not in resource_data or "type" not in resource_data:
-        logger.warning(f"收到的资源格式不正确或缺少id/type: {str(resource_data)[:200]}")
-        return False
-    resource_id = resource_data["id"]
-    resource_type_singular = resource_data["type"]
-    resource_type_plural = resource_type_singular + "s"
-    if resource_type_plural not in nmos_resources:
-        logger.warning(f"未知的资源类型复数形式: '{resource_type_plural}' (来自单数 '{resource_type_singular}')")
-        return False
-    existing_resource = nmos_resources[resource_type_plural].get(resource_id)
-    if existing_resource:
-        # 基本的版本比较逻辑 (假设版本是 <seconds>:<nanoseconds> 字符串)
-        # NMOS IS-04 v1.3 specifies version as "seconds:nanoseconds"
-        new_version_str = resource_data.get("version")
-        old_version_str = existing_resource.get("version")
-        if new_version_str and old_version_str:
-            try:
-                new_sec, new_nano = map(int, new_version_str.split(':'))
-                old_sec, old_nano = map(int, old_version_str.split(':'))
-                if new_sec < old_sec or (new_sec == old_sec and new_nano <= old_nano):
-                    logger.info(f"接收到的资源 {resource_type_plural}/{resource_id} 版本 ('{new_version_str}') 不比现有版本 ('{old_version_str}') 新，跳过更新。")
-                    return False # 不更新
-            except ValueError:
-                logger.warning(f"资源 {resource_type_plural}/{resource_id} 的版本号格式不正确 ('{new_version_str}' 或 '{old_version_str}')，将直接更新。")
-        logger.info(f"更新资源 {resource_type_plural}/{resource_id}")
-    else:
-        logger.info(f"新增资源 {resource_type_plural}/{resource_id}")
-    
+def normalize_legacy_resource(resource_data: Dict):
     # 版本适配逻辑：检查资源版本并处理字段差异
+    resource_type_singular = resource_data["type"]
     resource_version = resource_data.get("version", "")
-    if ":" in resource_version:
+    if isinstance(resource_version, str) and ":" in resource_version:
         # 假设版本格式为 "seconds:nanoseconds" 表示 v1.3
-        logger.debug(f"处理资源 {resource_type_plural}/{resource_id}，版本 v1.3 检测到")
-    else:
-        # 假设其他格式或缺少版本字段可能为 v1.2 或更旧版本
-        logger.debug(f"处理资源 {resource_type_plural}/{resource_id}，版本 v1.2 或更旧版本检测到")
-        # 为 v1.2 版本添加缺失字段的默认值
-        if resource_type_singular == "node":
-            resource_data.setdefault("attached_network_device", None)
-            resource_data.setdefault("authorization", False)
-        elif resource_type_singular == "device":
-            resource_data.setdefault("authorization", False)
-        elif resource_type_singular in ["source", "flow"]:
-            resource_data.setdefault("event_type", None)
-    
-    nmos_resources[resource_type_plural][resource_id] = resource_data
-    known_resource_ids[resource_id] = resource_type_plural
-    return True
+        return
+    # 假设其他格式或缺少版本字段可能为 v1.2 或更旧版本
+    logger.debug(f"处理资源 {resource_type_singular}s/{resource_data['id']}，版本 v1.2 或更旧版本检测到")
+    # 为 v1.2 版本添加缺失字段的默认值
+    if resource_type_singular == "node":
+        resource_data.setdefault("attached_network_device", None)
+        resource_data.setdefault("authorization", False)
+    elif resource_type_singular == "device":
+        resource_data.setdefault("authorization", False)
+    elif resource_type_singular in ["source", "flow"]:
+        resource_data.setdefault("event_type", None)
+
+def prepare_resource_update(resource_data: Dict) -> Optional[resource_store.StoreChange]:
+    if not isinstance(resource_data, dict) or "id" not in resource_data or "type" not in resource_data:
+        logger.warning(f"收到的资源格式不正确或缺少id/type: {str(resource_data)[:200]}")
+        return None
+    normalize_legacy_resource(resource_data)
+    return resource_store.StoreChange(resource_store.OP_UPDATE, resource_data["id"], resource_data)
+
+# NMOS grain 时间戳为 TAI 时间，比 UTC 快 (当前为 37 秒)
+GRAIN_TAI_OFFSET_SECONDS = float(os.getenv("NMOS_GRAIN_TAI_OFFSET_SECONDS", "37"))
+
+def grain_creation_time(message_obj: Dict[str, Any]) -> Optional[float]:
+    """返回 grain 的创建时间 (Unix 时间戳)，无法解析时返回 None。"""
+    timestamp = message_obj.get("creation_timestamp") or message_obj.get("grain", {}).get("creation_timestamp")
+    version = resource_store.parse_version(timestamp)
+    if version is None:
+        return None
+    seconds, nanoseconds = version
+    return seconds + nanoseconds / 1e9 - GRAIN_TAI_OFFSET_SECONDS
+
+def parse_grain_message(message_str: str) -> ingest_pipeline.ParsedFrame:
+    """在 ingest 工作线程上解析一个 WebSocket 帧，返回其中的资源变更。JSON 错误会抛出 ValueError。"""
+    message_obj = json.loads(message_str)
+    if not isinstance(message_obj, dict) or "grain" not in message_obj:
+        logger.warning(f"收到的WebSocket消息不是预期的 grain 格式: {message_str[:200]}")
+        return ingest_pipeline.ParsedFrame([])
+    grain = message_obj["grain"]
+    if not isinstance(grain, dict) or "data" not in grain or not isinstance(grain["data"], list):
+        logger.warning(f"grain 格式不正确或 grain.data 不是列表: {str(grain)[:200]}")
+        return ingest_pipeline.ParsedFrame([])
+    changes: List[resource_store.StoreChange] = []
+    for change_wrapper in grain["data"]:
+        if not isinstance(change_wrapper, dict) or "topic" not in change_wrapper:
+            logger.warning(f"grain.data 中的条目格式不正确，缺少 'topic': {str(change_wrapper)[:200]}")
+            continue
+        topic = change_wrapper.get("topic", "") 
+        pre_data = change_wrapper.get("pre")
+        post_data = change_wrapper.get("post")
+        resource_id_from_topic = topic.split('/')[-1]
+        if post_data is not None: 
+            change = prepare_resource_update(post_data)
+            if change is not None:
+                changes.append(change)
+        elif pre_data is not None and post_data is None: 
+            logger.debug(f"检测到资源删除信号 (post is null, pre exists) for topic: {topic}, ID: {resource_id_from_topic}")
+            changes.append(resource_store.StoreChange(resource_store.OP_DELETE, resource_id_from_topic))
+        else:
+            logger.debug(f"收到的 grain.data 条目既无 post 也无 pre 数据 (或 post 非 null): {str(change_wrapper)[:200]}")
+    return ingest_pipeline.ParsedFrame(changes, grain_creation_time(message_obj))
+
+# 每个注册中心的 ingest 流水线统计在抓取 /metrics 时读取
+metrics.register_collector(metrics.StatsCollector(
+    lambda: {connection.query_api_url: connection.pipeline.stats() for connection in registries.connections()},
+    label="registry",
+    counters={
+        "frames_received": ("nmos_registry_grain_frames_received_total", "WebSocket grain frames received"),
+        "frames_dropped": ("nmos_registry_grain_frames_dropped_total", "Grain frames dropped by the backpressure policy"),
+        "frames_invalid": ("nmos_registry_grain_frames_invalid_total", "Grain frames that could not be parsed"),
+        "batches_applied": ("nmos_registry_ingest_batches_total", "Ingest batches applied to the cache"),
+        "changes_coalesced": ("nmos_registry_ingest_changes_coalesced_total", "Changes superseded within an ingest batch"),
+    },
+    gauges={
+        "queue_depth": ("nmos_registry_ingest_queue_depth", "Grain frames waiting in the ingest queue"),
+    },
+))
+metrics.register_collector(metrics.StoreCollector(current_snapshot))
+metrics.register_collector(metrics.StatsCollector(
+    lambda: {HISTORY_DIR: resource_history.stats()} if resource_history else {},
+    label="directory",
+    counters={
+        "changes_appended": ("nmos_registry_history_changes_total", "Resource changes appended to the history log"),
+        "segments_started": ("nmos_registry_history_segments_started_total", "History segments started (each with a checkpoint)"),
+        "gaps": ("nmos_registry_history_gaps_total", "History segments started after changes could not be followed"),
+    },
+    gauges={
+        "segments": ("nmos_registry_history_segments", "Retained history segments"),
+        "bytes": ("nmos_registry_history_bytes", "Size of the retained history on disk"),
+    },
+))
+metrics.register_collector(metrics.StatsCollector(
+    lambda: {"topology": topology.stats()} if topology else {},
+    label="graph",
+    counters={
+        "rebuilds": ("nmos_registry_topology_rebuilds_total", "Topology graph rebuilds from a store snapshot"),
+        "store_changes_applied": ("nmos_registry_topology_changes_applied_total", "Cache changes applied to the topology graph"),
+    },
+    gauges={
+        "vertices": ("nmos_registry_topology_vertices", "Vertices (resources) in the topology graph"),
+        "edges": ("nmos_registry_topology_edges", "Visible edges in the topology graph"),
+        "lag": ("nmos_registry_topology_lag", "Cache changes not yet applied to the topology graph"),
+    },
+))
+metrics.register_collector(metrics.StatsCollector(
+    lambda: {"database": persistence_writer.stats()} if persistence_writer else {},
+    label="target",
+    counters={
+        "flushes": ("nmos_registry_persist_flushes_total", "Batched write-behind flushes committed to the database"),
+        "rows_upserted": ("nmos_registry_persist_rows_upserted_total", "Resource rows upserted into the database"),
+        "rows_deleted": ("nmos_registry_persist_rows_deleted_total", "Resource rows deleted from the database"),
+        "failures": ("nmos_registry_persist_failures_total", "Failed database flushes (retried with backoff)"),
+    },
+    gauges={
+        "pending": ("nmos_registry_persist_pending", "Coalesced resource changes waiting to be written"),
+        "oldest_pending_seconds": ("nmos_registry_persist_lag_seconds", "Age of the oldest unwritten change"),
+    },
+))
+
+# --- Push fan-out of cache deltas ---
+PUSH_KEEPALIVE_SECONDS = 15.0
+
+def build_subscriber_snapshot(subscriber: delta_broadcaster.Subscriber) -> Tuple[int, Dict[str, List[Dict[str, Any]]]]:
+    store_snapshot = nmos_store.snapshot
+    snapshot = {}
+    for resource_type_plural in store_snapshot.resources:
+        if subscriber.resource_types is not None and resource_type_plural not in subscriber.resource_types:
+            continue
+        if subscriber.resource_ids is not None:
+            found = (store_snapshot.get(resource_type_plural, res_id) for res_id in subscriber.resource_ids)
+            snapshot[resource_type_plural] = [resource for resource in found if resource is not None]
+        else:
+            snapshot[resource_type_plural] = list(store_snapshot.values(resource_type_plural))
+    return store_snapshot.generation, snapshot
+
+resource_delta_broadcaster = delta_broadcaster.DeltaBroadcaster(
+    resource_change_log, build_subscriber_snapshot, lambda: nmos_store.snapshot.generation,
+    tick_interval=float(os.getenv("NMOS_PUSH_TICK_SECONDS", "0.1")),
+    max_queue=int(os.getenv("NMOS_PUSH_MAX_QUEUE", "256"))
+)
 
-def process_resource_deletion(resource_id: str):
-    global nmos_resources, known_resource_ids
-    if resource_id in known_resource_ids:
-        resource_type_plural = known_resource_ids[resource_id]
-        if resource_id in nmos_resources.get(resource_type_plural, {}):
-            del nmos_resources[resource_type_plural][resource_id]
-            del known_resource_ids[resource_id]
-            logger.info(f"已删除资源 {resource_type_plural}/{resource_id} 从缓存。")
-            return True
-        else: 
-            logger.warning(f"尝试删除资源 {resource_id} (类型 {resource_type_plural}), 但在 nmos_resources 中未找到。可能已被删除。")
-            del known_resource_ids[resource_id] 
-            return False
-    else:
-        logger.debug(f"尝试删除资源 {resource_id}, 但在 known_resource_ids 中未找到。可能已被删除或从未被添加。")
-        return False
-
-def on_message(ws, message_str: str):
-    try:
-        message_obj = json.loads(message_str)
-        if not isinstance(message_obj, dict) or "grain" not in message_obj:
-            logger.warning(f"收到的WebSocket消息不是预期的 grain 格式: {message_str[:200]}")
-            return
-        grain = message_obj["grain"]
-        if not isinstance(grain, dict) or "data" not in grain or not isinstance(grain["data"], list):
-            logger.warning(f"grain 格式不正确或 grain.data 不是列表: {str(grain)[:200]}")
-            return
-        updates_processed_count = 0
-        for change_wrapper in grain["data"]:
-            if not isinstance(change_wrapper, dict) or "topic" not in change_wrapper:
-                logger.warning(f"grain.data 中的条目格式不正确，缺少 'topic': {str(change_wrapper)[:200]}")
-                continue
-            topic = change_wrapper.get("topic", "") 
-            pre_data = change_wrapper.get("pre")
-            post_data = change_wrapper.get("post")
-            resource_id_from_topic = topic.split('/')[-1]
-            if post_data is not None: 
-                if process_resource_update(post_data):
-                    updates_processed_count += 1
-            elif pre_data is not None and post_data is None: 
-                logger.info(f"检测到资源删除信号 (post is null, pre exists) for topic: {topic}, ID: {resource_id_from_topic}")
-                if process_resource_deletion(resource_id_from_topic):
-                    updates_processed_count +=1
-            else:
-                logger.debug(f"收到的 grain.data 条目既无 post 也无 pre 数据 (或 post 非 null): {str(change_wrapper)[:200]}")
-        if updates_processed_count > 0:
-            logger.info(f"通过 WebSocket 处理了 {updates_processed_count} 个资源的创建/更新/删除。")
-    except json.JSONDecodeError:
-        logger.error(f"解析WebSocket消息失败: {message_str[:200]}")
-    except Exception as e:
-        logger.error(f"处理WebSocket消息时发生错误: {e}", exc_info=True)
-
-def on_error(ws, error):
-    logger.error(f"WebSocket错误: {error}", exc_info=True)
-
-def on_close(ws, close_status_code, close_msg):
-    logger.info(f"WebSocket连接已关闭。状态码: {close_status_code}, 消息: {close_msg}")
-    global ws_connection, ws_thread
-    ws_connection = None 
-    ws_thread = None
-    # 尝试自动重连，除非是显式关闭 (例如服务关闭时)
-    # 这里简单处理，总是尝试重连，除非 close_status_code 表明是正常关闭
-    # 实际应用中可能需要更复杂的逻辑来判断是否应该重连
-    if close_status_code != 1000: # 1000 表示正常关闭
-        logger.info(f"WebSocket 连接意外关闭 (code: {close_status_code})，将在5秒后尝试重连...")
-        threading.Timer(5.0, start_websocket_subscription).start()
-
-def on_open(ws):
-    logger.info("WebSocket connection opened.")
-    # Subscribe to all resources, or specific types as needed
-    # Example: subscribe to all changes in the 'resource' path (IS-04 v1.3 default)
-    subscription_request = {
-        "id": str(uuid.uuid4()), # Unique ID for the subscription
-        "type": "subscription",
-        "resource_path": "/", # Subscribe to all top-level resource types
-        "params": {"grain_rate": {"numerator": 0, "denominator": 1}} # No updates unless changed
-    }
-    try:
-        ws.send(json.dumps(subscription_request))
-        logger.info(f"Sent subscription request: {subscription_request}")
-    except Exception as e:
-        logger.error(f"Error sending subscription request on WebSocket open: {e}")
+def parse_push_filters(types: Optional[str], ids: Optional[str]):
+    resource_types = {t.strip() for t in types.split(",") if t.strip()} if types else None
+    if resource_types:
+        unknown_types = resource_types - set(resource_store.RESOURCE_TYPES)
+        if unknown_types:
+            raise HTTPException(status_code=400, detail=f"未知的资源类型: {sorted(unknown_types)}")
+    resource_ids = {i.strip() for i in ids.split(",") if i.strip()} if ids else None
+    return resource_types, resource_ids
 
 # --- API Endpoints ---
 @app.post("/configure", response_model=ConfigureResponse)
 async def configure_registry(config: RegistryConfig, current_user_data: dict = Depends(get_current_user)):
     logger.info(f"--- Initiating /configure endpoint with registry_address: {config.registry_address}, port: {config.registry_port} ---")
-    global registry_url, ws_connection, ws_thread, self_node_heartbeat_thread, self_node_heartbeat_stop_event, nmos_resources, known_resource_ids, REGISTRATION_API_URL
 
     base_nmos_url = f"http://{config.registry_address}:{config.registry_port}"
     new_query_api_url = f"{base_nmos_url}/x-nmos/query/v1.3" 
@@ -482,42 +792,32 @@ async def configure_registry(config: RegistryConfig, current_user_data: dict = D
     logger.info(f"Derived Query API URL: {new_query_api_url}")
     logger.info(f"Derived Registration API URL: {new_registration_api_url}")
 
-    # 1. Stop existing self-node heartbeat (if running)
-    if self_node_heartbeat_thread and self_node_heartbeat_thread.is_alive():
-        logger.info("Stopping existing self-node heartbeat thread due to new configuration.")
-        self_node_heartbeat_stop_event.set()
-        self_node_heartbeat_thread.join(timeout=5)
-        if self_node_heartbeat_thread.is_alive():
-            logger.warning("Existing self-node heartbeat thread did not stop in time.")
-        self_node_heartbeat_thread = None 
-    self_node_heartbeat_stop_event.clear() 
-
-    # 2. Stop existing WebSocket subscription and clear old resources
-    if ws_thread and ws_thread.is_alive():
-        logger.info("Closing existing WebSocket connection due to new configuration.")
-        if ws_connection:
-            ws_connection.close() 
-        ws_thread.join(timeout=5)
-        if ws_thread.is_alive():
-            logger.warning("Existing WebSocket thread did not stop in time.")
-        ws_connection = None 
-        ws_thread = None 
-    
-    logger.info("Clearing previously cached NMOS resources.")
-    nmos_resources = { "nodes": {}, "devices": {}, "senders": {}, "receivers": {}, "sources": {}, "flows": {}}
-    known_resource_ids = {}
-
-    # 3. Set the new global registry_url (for Query API) and REGISTRATION_API_URL
-    registry_url = new_query_api_url 
-    REGISTRATION_API_URL = new_registration_api_url 
-    logger.info(f"Global NMOS Query API URL set to: {registry_url}")
-    logger.info(f"Global NMOS Query API URL set to: {registry_url}")
-    logger.info(f"Global NMOS Registration API URL set to: {REGISTRATION_API_URL}")
+    # 1. Registered nodes keep heartbeating the old registry until they are moved in step 6.
+    # 2. Stop existing WebSocket subscriptions (and any pending reconnect).
+    # /configure replaces the whole registry set with this one registry; use /registries to add more.
+    # Re-configuring the same registry keeps the cache serving and only reconciles the differences;
+    # a different registry's inventory has nothing to do with the cached one, so that is cleared.
+    same_registry = registries.urls == [new_query_api_url] and nmos_store.snapshot.total() > 0
+    logger.info("Closing existing WebSocket connections due to new configuration.")
+    registries.remove_all()
+    if not same_registry:
+        logger.info("Clearing previously cached NMOS resources.")
+        nmos_store.replace_all()
+        complete_registries.clear()
+
+    # 3. Set the new primary registry (for Query API)
+    registries.add(new_query_api_url, primary=True)
+    logger.info(f"Global NMOS Query API URL set to: {new_query_api_url}")
+    logger.info(f"Global NMOS Registration API URL set to: {new_registration_api_url}")
     logger.info(f"Self-node HOST_IP: {os.getenv('HOST_IP', '127.0.0.1')}, MY_PORT: {os.getenv('MY_PORT', '8000')}")
 
     # 4. Fetch initial resources from the new registry via HTTP Query API
-    logger.info("Fetching initial resources from the new registry...")
-    fetch_result = fetch_initial_resources(registry_url) 
+    if same_registry:
+        logger.info("Reconciling cached resources with the registry...")
+        fetch_result = await reconcile_with_registry(new_query_api_url)
+    else:
+        logger.info("Fetching initial resources from the new registry...")
+        fetch_result = await fetch_initial_resources(new_query_api_url)
     logger.info(f"Initial resource fetch status: {fetch_result.message}, Processed: {fetch_result.processed_resource_count}, Summary: {fetch_result.resource_summary}")
     if fetch_result.processed_resource_count == 0 and not any(fetch_result.resource_summary.values()): # Check if any resources were actually fetched
         # This could indicate an issue if the registry is expected to have resources but none were found/processed
@@ -525,11 +825,11 @@ async def configure_registry(config: RegistryConfig, current_user_data: dict = D
 
     # 5. Start WebSocket subscription to the new registry's Query API
     logger.info("Starting WebSocket subscription to the new registry...")
-    start_websocket_subscription() 
+    start_registry_subscriptions()
 
     # 6. Register this application instance as a Node to the new registry
     logger.info("Registering self as a node to the new registry...")
-    registration_status = register_self_node_resource(new_registration_api_url) 
+    registration_status = await register_self_node_resource(new_registration_api_url)
     logger.info(f"Self-registration status: {registration_status.status} - {registration_status.detail}")
 
     if registration_status.status == "error":
@@ -542,7 +842,7 @@ async def configure_registry(config: RegistryConfig, current_user_data: dict = D
         )
 
     logger.info(f"--- /configure endpoint completed successfully for {config.registry_address}:{config.registry_port} ---")
-    return ConfigureResponse(message=f"NMOS Registry configured. Query API: {registry_url}. Self-Registration: {registration_status.status}. Initial Fetch: {fetch_result.processed_resource_count} resources.", url=registry_url)
+    return ConfigureResponse(message=f"NMOS Registry configured. Query API: {new_query_api_url}. Self-Registration: {registration_status.status}. Initial Fetch: {fetch_result.processed_resource_count} resources.", url=new_query_api_url)
 
 @app.post("/users/change-password", summary="Change user password")
 async def change_password(payload: UserPasswordChange, current_user_data: dict = Depends(get_current_user)):
@@ -550,12 +850,17 @@ async def change_password(payload: UserPasswordChange, current_user_data: dict =
     if not username:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Username not found in token/session")
 
-    # 验证当前密码
-    if not security_config.verify_password(username, payload.current_password):
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Incorrect current password")
-
-    # 更新密码
-    if security_config.update_user_password(username, payload.new_password):
+    try:
+        # 验证当前密码
+        if not await password_hasher.run(security_config.verify_password, username, payload.current_password):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Incorrect current password")
+
+        # 更新密码
+        updated = await password_hasher.run(security_config.update_user_password, username, payload.new_password)
+    except auth.PasswordHasherBusy:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Too many password operations in progress, retry shortly",
+                            headers={"Retry-After": "1"})
+    if updated:
         return {"message": "Password updated successfully"}
     else:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to update password")
@@ -568,9 +873,17 @@ async def change_password(payload: UserPasswordChange, current_user_data: dict =
 # 登录端点以获取JWT token
 @app.post("/token")
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
-    # 查找用户，这里假设 username 字段直接对应 USERS 字典的键
-    user = security_config.USERS.get(form_data.username)
-    if not user or not security_config.verify_password(form_data.username, form_data.password):
+    # 查找用户: 可以使用 USERS 字典的键或用户的 username 字段登录
+    if shared_store_reader is not None:
+        security_config.reload_users_if_changed()
+    user_key = security_config.find_user_key(form_data.username)
+    user = security_config.USERS.get(user_key) if user_key else None
+    try:
+        password_ok = user is not None and await password_hasher.run(security_config.verify_password, user_key, form_data.password)
+    except auth.PasswordHasherBusy:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Too many logins in progress, retry shortly",
+                            headers={"Retry-After": "1"})
+    if not password_ok:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -584,47 +897,47 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
+def replace_cache_from_discovery(response: requests.Response, registry_url: str) -> resource_store.StoreSnapshot:
+    """Parses a GET /resources response and replaces the cache with its valid resources."""
+    query_api_resources_url = response.url
+    fetched_resource_list = response.json()
+    if not isinstance(fetched_resource_list, list):
+        logger.error(f"从 {query_api_resources_url} 获取的资源不是列表格式，而是 {type(fetched_resource_list)}。")
+        raise HTTPException(status_code=500, detail="从注册中心获取的资源格式不正确。")
+    logger.info(f"从注册中心发现 {len(fetched_resource_list)} 个资源条目。")
+    valid_resources = []
+    for resource in fetched_resource_list:
+        if not isinstance(resource, dict) or "id" not in resource or "type" not in resource:
+            logger.warning(f"发现的资源格式不正确或缺少id/type: {str(resource)[:200]}")
+            continue
+        valid_resources.append(resource)
+    # 新的缓存状态一次性替换旧状态，读取方不会看到半成品
+    return nmos_store.replace_all(valid_resources, {resource["id"]: registry_url for resource in valid_resources})
+
 @app.get("/discover", summary="Discover resources by querying the NMOS Registry", response_model=DiscoverResponse)
 async def discover_resources_api(current_user_data: dict = Depends(get_current_user)): # Renamed to avoid conflict
-    global nmos_resources, known_resource_ids
+    registry_url = primary_registry_url()
     if not registry_url:
         raise HTTPException(status_code=503, detail="NMOS 注册中心 URL 尚未配置。")
+    if len(registries.urls) > 1 or SUBSCRIPTION_SPECS:
+        # 多个注册中心: 整体替换会丢掉其他注册中心的资源，改为逐个对账
+        # 过滤订阅: GET /resources 不支持过滤，按订阅的类型和过滤条件分页发现
+        return await discover_all_registries()
     try:
         query_api_resources_url = f"{registry_url.rstrip('/')}/resources"
         logger.info(f"开始从 {query_api_resources_url} 发现资源...")
-        response = requests.get(query_api_resources_url, timeout=10)
+        # requests 是阻塞的, 放到线程中执行以免阻塞事件循环
+        response = await asyncio.to_thread(requests.get, query_api_resources_url, timeout=10)
         response.raise_for_status()
-        fetched_resource_list = response.json()
-        if not isinstance(fetched_resource_list, list):
-            logger.error(f"从 {query_api_resources_url} 获取的资源不是列表格式，而是 {type(fetched_resource_list)}。")
-            raise HTTPException(status_code=500, detail="从注册中心获取的资源格式不正确。")
-        logger.info(f"从注册中心发现 {len(fetched_resource_list)} 个资源条目。")
-        new_nmos_resources_state: Dict[str, Dict[str, Any]] = {
-            "nodes": {}, "devices": {}, "senders": {}, 
-            "receivers": {}, "sources": {}, "flows": {}
-        }
-        new_known_resource_ids_state: Dict[str, str] = {}
-        processed_count = 0
-        for resource in fetched_resource_list:
-            if not isinstance(resource, dict) or "id" not in resource or "type" not in resource:
-                logger.warning(f"发现的资源格式不正确或缺少id/type: {str(resource)[:200]}")
-                continue
-            res_id = resource["id"]
-            res_type_singular = resource["type"]
-            res_type_plural = res_type_singular + "s"
-            if res_type_plural in new_nmos_resources_state:
-                new_nmos_resources_state[res_type_plural][res_id] = resource
-                new_known_resource_ids_state[res_id] = res_type_plural
-                processed_count +=1
-            else:
-                logger.warning(f"发现未知资源类型: '{res_type_singular}' (ID: {res_id})")
-        nmos_resources = new_nmos_resources_state
-        known_resource_ids = new_known_resource_ids_state
+        # 解析、校验和整体替换都是 CPU 密集的, 与 load_cache_snapshot 一样放到线程中执行
+        snapshot = await asyncio.to_thread(replace_cache_from_discovery, response, registry_url)
+        complete_registries.add(registry_url)
+        processed_count = snapshot.total()
         logger.info(f"资源缓存已通过 /discover 更新，处理了 {processed_count} 个有效资源。")
         return DiscoverResponse(
             message="资源发现并更新缓存成功。",
             processed_resource_count=processed_count,
-            resource_summary={key: len(value) for key, value in nmos_resources.items()}
+            resource_summary=snapshot.counts()
         )
     except requests.exceptions.HTTPError as e:
         logger.error(f"请求注册服务 {query_api_resources_url} 失败: {e.response.status_code} - {e.response.text if e.response else str(e)}")
@@ -640,74 +953,667 @@ async def discover_resources_api(current_user_data: dict = Depends(get_current_u
         logger.error(f"资源发现过程中发生未知错误: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"资源发现错误: {str(e)}")
 
+@app.get("/discover/progress", summary="Per-type progress and timing of the latest paged discovery", response_model=DiscoveryProgressResponse)
+async def discovery_progress_api(current_user_data: dict = Depends(get_current_user)):
+    if current_discovery is None:
+        return DiscoveryProgressResponse(running=False, type_progress={})
+    return DiscoveryProgressResponse(
+        query_api_url=current_discovery.query_api_base_url,
+        running=current_discovery.running,
+        duration_seconds=current_discovery.duration,
+        type_progress=current_discovery.progress_report()
+    )
+
 @app.on_event("startup")
 async def startup_event_handler():
-    global registry_url
-    env_registry_url = os.getenv("NMOS_EXTERNAL_REGISTRY_URL")
-    if env_registry_url:
-        if registry_url and registry_url != env_registry_url:
-            logger.info(f"环境变量 NMOS_EXTERNAL_REGISTRY_URL ('{env_registry_url}') 将覆盖已有的 registry_url ('{registry_url}')。")
-        registry_url = env_registry_url
-        logger.info(f"从环境变量加载 NMOS 注册中心 URL: {registry_url}")
-    if registry_url:
-        try:
-            await discover_resources_api() # Call the renamed API function
-        except HTTPException as e: 
-            logger.error(f"启动时首次发现资源失败: {e.status_code} - {e.detail}")
-        except Exception as e:
-            logger.error(f"启动时首次发现资源发生未知错误: {e}", exc_info=True)
-        start_websocket_subscription()
+    global warm_up_task, event_loop
+    event_loop = asyncio.get_running_loop()
+    if shared_store_reader is not None:
+        # 只读 worker 不连接注册中心, 也不注册节点; 资源来自采集进程发布的共享内存
+        logger.info(f"只读 worker: 从 {SHARED_STORE_DIR} 读取采集进程发布的资源, 其余请求转发到 {os.getenv('NMOS_INGEST_URL')}")
+        return
+    if shared_store_publisher:
+        shared_store_publisher.start()
+    heartbeat_scheduler.start()
+    # NMOS_EXTERNAL_REGISTRY_URLS: 逗号分隔的多个注册中心 (第一个为主注册中心); 兼容单个的 NMOS_EXTERNAL_REGISTRY_URL
+    env_registry_urls = [url.strip() for url in os.getenv("NMOS_EXTERNAL_REGISTRY_URLS", "").split(",") if url.strip()]
+    if not env_registry_urls and os.getenv("NMOS_EXTERNAL_REGISTRY_URL"):
+        env_registry_urls = [os.getenv("NMOS_EXTERNAL_REGISTRY_URL")]
+    registries.bind_loop(asyncio.get_running_loop())
+    for env_registry_url in env_registry_urls:
+        registries.add(env_registry_url)
+        logger.info(f"从环境变量加载 NMOS 注册中心 URL: {env_registry_url}")
+    resource_delta_broadcaster.start()
+    if snapshot_writer:
+        snapshot_writer.start()
+    if persistence_writer:
+        persistence_writer.start()
+    if resource_history:
+        resource_history.start()
+    if topology:
+        topology.start()
+    if registries.urls:
+        # 不在启动时等待注册中心: 服务立即可响应 (/health/live), 缓存在后台填充, /health/ready 报告进度
+        warm_up_task = asyncio.create_task(warm_up_cache())
     else:
-        logger.info("NMOS 注册中心 URL 尚未配置。请通过 POST /configure 或设置 NMOS_EXTERNAL_REGISTRY_URL 环境变量进行配置。")
+        logger.info("NMOS 注册中心 URL 尚未配置。请通过 POST /configure 或设置 NMOS_EXTERNAL_REGISTRY_URL(S) 环境变量进行配置。")
+        finish_warm_up()
+
+def cached_json_response(cache_key: str, snapshot: resource_store.StoreSnapshot, build_body,
+                         if_none_match: Optional[str],
+                         cache: Optional[response_cache.SerializedResponseCache] = None) -> Response:
+    cache = cache or serialized_responses
+    etag = cache.etag_for(snapshot.generation)
+    if if_none_match and response_cache.etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    cached = cache.get(cache_key, snapshot.generation, build_body)
+    return Response(content=cached.body, media_type="application/json", headers={"ETag": cached.etag})
+
+def observe_resources_response(endpoint: str, started: float, response: Response) -> Response:
+    metrics.HTTP_REQUEST_SECONDS.labels(endpoint).observe(time.perf_counter() - started)
+    metrics.HTTP_RESPONSE_BYTES.labels(endpoint).observe(len(response.body))
+    return response
+
+def parse_resource_query(fields: Optional[str], filter_expression: Optional[str]) -> resource_query.ResourceQuery:
+    try:
+        return resource_query.ResourceQuery(fields, filter_expression)
+    except resource_query.QueryError as e:
+        raise HTTPException(status_code=400, detail=f"无效的 fields/filter 参数: {e}")
+
+def query_json_array(query: resource_query.ResourceQuery, snapshot, resource_type: str) -> bytes:
+    return json.dumps(query.select(snapshot, resource_type), separators=(",", ":")).encode("utf-8")
 
 @app.get("/resources", summary="Get current cached NMOS resources", response_model=ResourcesResponse)
-async def get_resources_api_endpoint(current_user_data: dict = Depends(get_current_user)): # Renamed from get_resources_api to be more distinct
-    output_resources = {}
-    for resource_type_plural_key, resources_dict in nmos_resources.items():
-        output_resources[resource_type_plural_key] = list(resources_dict.values())
+async def get_resources_api_endpoint(fields: Optional[str] = None,
+                                     filter: Optional[str] = None,
+                                     if_none_match: Optional[str] = Header(None),
+                                     current_user_data: dict = Depends(get_current_user)): # Renamed from get_resources_api to be more distinct
+    """
+    `fields=id,label,device_id,subscription` 只返回列出的字段 (支持 `a.b` 路径);
+    `filter=` 按表达式过滤每种资源, 语法见 resource_query 模块, 例如
+    `filter=device_id in (X, Y) and label^=Cam`、`filter=tags.location=studio-a`。
+    """
+    # 序列化后的响应体按 store generation 缓存; 缓存未变化时直接返回 304 或复用已编码的响应体，
+    # 不再每次重建列表并经过 pydantic 校验 (响应结构与 ResourcesResponse 一致)。
+    # 投影/过滤后的响应体同样按 (fields, 规范化后的 filter) 缓存。
+    started = time.perf_counter()
+    snapshot = current_snapshot()
+    query = parse_resource_query(fields, filter)
+    if query.empty:
+        def build_body():
+            # 按类型拼接 JSON 数组; 紧凑存储模式下直接拼接每个资源已编码的 JSON
+            parts = [json.dumps(key).encode("utf-8") + b":" + snapshot.json_array(key) for key in ResourcesResponse.__fields__.keys()]
+            return b"{" + b",".join(parts) + b"}"
+        cache_key = "all"
+    else:
+        def build_body():
+            parts = [json.dumps(key).encode("utf-8") + b":" + query_json_array(query, snapshot, key) for key in ResourcesResponse.__fields__.keys()]
+            return b"{" + b",".join(parts) + b"}"
+        cache_key = f"all?{query.cache_key}"
+    return observe_resources_response("/resources", started,
+                                      cached_json_response(cache_key, snapshot, build_body, if_none_match))
+
+@app.get("/resources/changes", summary="Get cache changes since a sequence number", response_model=ResourceChangesResponse)
+async def get_resource_changes_api(since: int = 0, epoch: Optional[str] = None, limit: int = 1000,
+                                   current_user_data: dict = Depends(get_current_user)):
+    """
+    返回自 `since` 序列号之后的创建/更新/删除。客户端保存响应中的 `epoch` 和 `current_sequence`
+    (或 has_more 时最后一条变更的 sequence)，下次轮询时传回。
+    若 `resync_required` 为 true，客户端需重新获取 /resources 全量清单后再继续增量轮询。
+    """
+    result = resource_change_log.changes_since(since, epoch=epoch, limit=max(1, limit))
+    return ResourceChangesResponse(
+        epoch=resource_change_log.epoch,
+        current_sequence=result.current_sequence,
+        resync_required=result.resync_required,
+        has_more=result.has_more,
+        changes=[ResourceChange(**entry._asdict()) for entry in result.changes]
+    )
+
+@app.websocket("/ws/resources")
+async def resource_deltas_websocket(websocket: WebSocket, token: Optional[str] = None,
+                                    types: Optional[str] = None, ids: Optional[str] = None):
+    """
+    推送缓存变更: 先发送 (按 types/ids 过滤的) snapshot 消息，之后发送合并后的 delta 消息。
+    浏览器无法为 WebSocket 设置 Authorization 头，因此 JWT 通过 `token` 查询参数传递。
+    """
+    try:
+        authenticate_token(token or "")
+        resource_types, resource_ids = parse_push_filters(types, ids)
+    except HTTPException as e:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=str(e.detail))
+        return
+    await websocket.accept()
+    subscriber = resource_delta_broadcaster.subscribe(resource_types, resource_ids)
+    try:
+        while True:
+            try:
+                message = await asyncio.wait_for(subscriber.next_message(), timeout=PUSH_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                await websocket.send_text(json.dumps({"type": "keepalive"}))
+                continue
+            if message is None:
+                # 1013: try again later - the client should reconnect and take a fresh snapshot
+                await websocket.close(code=1013, reason=subscriber.evicted_reason)
+                break
+            if message:
+                await websocket.send_text(message)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        resource_delta_broadcaster.unsubscribe(subscriber)
+
+@app.get("/resources/stream", summary="Server-sent events stream of cache snapshot and deltas")
+async def resource_deltas_sse(types: Optional[str] = None, ids: Optional[str] = None,
+                              current_user_data: dict = Depends(get_current_user)):
+    resource_types, resource_ids = parse_push_filters(types, ids)
+    subscriber = resource_delta_broadcaster.subscribe(resource_types, resource_ids)
+
+    async def event_stream():
+        try:
+            while True:
+                try:
+                    message = await asyncio.wait_for(subscriber.next_message(), timeout=PUSH_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if message is None:
+                    yield f"event: evicted\ndata: {json.dumps({'reason': subscriber.evicted_reason})}\n\n"
+                    break
+                if message:
+                    yield f"data: {message}\n\n"
+        finally:
+            resource_delta_broadcaster.unsubscribe(subscriber)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/resources/export", summary="Stream the inventory as NDJSON, MessagePack or CBOR, optionally gzip/zstd compressed")
+async def export_resources_api(types: Optional[str] = None,
+                               fields: Optional[str] = None,
+                               filter: Optional[str] = None,
+                               format: Optional[str] = None,
+                               accept: Optional[str] = Header(None),
+                               accept_encoding: Optional[str] = Header(None),
+                               if_none_match: Optional[str] = Header(None),
+                               current_user_data: dict = Depends(get_current_user)):
+    """
+    逐条流式导出快照中的资源, 不在内存中构建完整响应体。格式由 `Accept` 协商
+    (application/x-ndjson 默认、application/msgpack、application/cbor-seq) 或 `format=ndjson|msgpack|cbor` 指定;
+    `Accept-Encoding` 可选 zstd/gzip 压缩。`types`、`fields`、`filter` 与 `/resources` 相同。
+    第一条记录为导出头 (generation/epoch), 最后一条为 {"end": true, "count": N}。
+    """
+    snapshot = current_snapshot()
+    resource_types, _ = parse_push_filters(types, None)
+    query = parse_resource_query(fields, filter)
+    try:
+        media_type = resource_export.negotiate_format(accept, format)
+    except resource_export.NotAcceptable as e:
+        raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE, detail=str(e))
+    encoding = resource_export.negotiate_encoding(accept_encoding)
+    # 同一 generation 的导出内容不变; 强 ETag 必须区分字节不同的响应体, 因此同时包含格式和压缩方式
+    variant = media_type.rsplit("/", 1)[-1] + (f"-{encoding}" if encoding else "")
+    etag = f'"{serialized_responses.etag_prefix}-{snapshot.generation}-{variant}"'
+    headers = {"ETag": etag, "Vary": "Accept, Accept-Encoding", "Cache-Control": "no-transform", "X-Accel-Buffering": "no"}
+    if response_cache.etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    epoch = snapshot.epoch if shared_store_reader is not None else resource_change_log.epoch
+    body = resource_export.export_stream(snapshot, [t for t in resource_store.RESOURCE_TYPES if not resource_types or t in resource_types],
+                                         media_type, epoch, query, encoding)
+    # 同步生成器由 Starlette 放到线程池中迭代, 编码和压缩不阻塞事件循环
+    return StreamingResponse(body, media_type=media_type, headers=headers)
+
+@app.get("/resources/{resource_type}", summary="Get cached resources of one type, optionally filtered by an indexed reference", response_model=List[Dict[str, Any]])
+async def get_resources_by_type_api(resource_type: str,
+                                    device_id: Optional[str] = None,
+                                    node_id: Optional[str] = None,
+                                    flow_id: Optional[str] = None,
+                                    source_id: Optional[str] = None,
+                                    subscription_sender_id: Optional[str] = Query(None, alias="subscription.sender_id"),
+                                    fields: Optional[str] = None,
+                                    filter: Optional[str] = None,
+                                    if_none_match: Optional[str] = Header(None),
+                                    current_user_data: dict = Depends(get_current_user)):
+    """
+    例如 `GET /resources/receivers?device_id=X`、`GET /resources/senders?flow_id=Y`、
+    `GET /resources/receivers?subscription.sender_id=S`。多个过滤条件取交集，通过二级索引查询，
+    耗时与结果数量成正比，而不是与缓存总量成正比。
+    同样支持 `fields` 投影和 `filter` 表达式 (与上述参数取交集)。
+    """
+    started = time.perf_counter()
+    snapshot = current_snapshot()
+    if resource_type not in snapshot.resources:
+        raise HTTPException(status_code=404, detail=f"未知的资源类型: '{resource_type}'")
+    filters = {
+        "device_id": device_id,
+        "node_id": node_id,
+        "flow_id": flow_id,
+        "source_id": source_id,
+        "subscription.sender_id": subscription_sender_id,
+    }
+    filters = {field: value for field, value in filters.items() if value is not None}
+    if fields is not None or filter is not None:
+        # 引用字段参数并入过滤表达式, 统一通过索引求交集
+        expression = " and ".join([f"{field}={json.dumps(value)}" for field, value in filters.items()] + ([filter] if filter and filter.strip() else []))
+        query = parse_resource_query(fields, expression)
+        return observe_resources_response("/resources/{resource_type}", started,
+                                          cached_json_response(f"type:{resource_type}?{query.cache_key}", snapshot,
+                                                               lambda: query_json_array(query, snapshot, resource_type), if_none_match))
+    if not filters:
+        return observe_resources_response("/resources/{resource_type}", started,
+                                          cached_json_response(f"type:{resource_type}", snapshot, lambda: snapshot.json_array(resource_type), if_none_match))
+    matching_ids = snapshot.index.lookup_all(resource_type, filters)
+    found = (snapshot.get(resource_type, res_id) for res_id in matching_ids)
+    body = json.dumps([resource for resource in found if resource is not None], separators=(",", ":")).encode("utf-8")
+    return observe_resources_response("/resources/{resource_type}", started,
+                                      Response(content=body, media_type="application/json"))
+
+def resource_etag(resource: Dict[str, Any]) -> str:
+    # IS-04 bumps `version` on every change, so it identifies the representation
+    version = resource.get("version")
+    if isinstance(version, str) and version:
+        return f'"{version}"'
+    return '"' + hashlib.sha1(json.dumps(resource, sort_keys=True).encode("utf-8")).hexdigest() + '"'
+
+@app.get("/resources/{resource_type}/{resource_id}", summary="Get a single cached resource (supports If-None-Match)")
+async def get_single_resource_api(resource_type: str, resource_id: str,
+                                  if_none_match: Optional[str] = Header(None),
+                                  current_user_data: dict = Depends(get_current_user)):
+    snapshot = current_snapshot()
+    if resource_type not in snapshot.resources:
+        raise HTTPException(status_code=404, detail=f"未知的资源类型: '{resource_type}'")
+    resource = snapshot.get(resource_type, resource_id)
+    if resource is None:
+        raise HTTPException(status_code=404, detail=f"资源 {resource_type}/{resource_id} 未在缓存中找到。")
+    etag = resource_etag(resource)
+    if response_cache.etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    return JSONResponse(content=resource, headers={"ETag": etag})
+
+@app.post("/resync", summary="Reconcile the cache with the registries, applying only differences")
+async def trigger_resync_api(query_api_url: Optional[str] = None, current_user_data: dict = Depends(get_current_user)):
+    if not registries.urls:
+        raise HTTPException(status_code=503, detail="NMOS 注册中心 URL 尚未配置。")
+    if query_api_url:
+        connection = registries.get(query_api_url)
+        if connection is None:
+            raise HTTPException(status_code=404, detail=f"未配置的注册中心: {query_api_url}")
+        targets = [connection]
+    else:
+        targets = registries.connections()
+    return {connection.query_api_url: {"scheduled": connection.resync_coordinator.request("manual"),
+                                       "running": connection.resync_coordinator.running}
+            for connection in targets}
+
+@app.get("/resync/status", summary="Recent cache resynchronisations per registry and what they reconciled")
+async def resync_status_api(current_user_data: dict = Depends(get_current_user)):
+    return {connection.query_api_url: {"running": connection.resync_coordinator.running,
+                                       "reports": connection.resync_coordinator.recent_reports()}
+            for connection in registries.connections()}
+
+@app.get("/ingest/stats", summary="Grain ingest pipeline queue depth, batch sizes and apply latency per registry")
+async def ingest_stats_api(current_user_data: dict = Depends(get_current_user)):
+    return {connection.query_api_url: connection.pipeline.stats() for connection in registries.connections()}
+
+def parse_history_time(value: str) -> float:
+    """`at` 可以是 Unix 时间戳 (秒) 或 ISO 8601 时间; 不带时区的时间按 UTC 处理。"""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"无法解析时间 '{value}'，请使用 ISO 8601 或 Unix 时间戳。")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+@app.get("/history", summary="Rebuild the cached inventory (optionally filtered) as it was at a point in time")
+async def get_history_api(at: str,
+                          types: Optional[str] = None,
+                          device_id: Optional[str] = None,
+                          node_id: Optional[str] = None,
+                          flow_id: Optional[str] = None,
+                          source_id: Optional[str] = None,
+                          subscription_sender_id: Optional[str] = Query(None, alias="subscription.sender_id"),
+                          current_user_data: dict = Depends(get_current_user)):
+    """
+    例如 `GET /history?at=2024-05-01T14:02:31Z`、`GET /history?at=...&types=receivers&device_id=X`。
+    从 `at` 之前最近的检查点开始回放变更日志重建当时的清单; 过滤条件与 `/resources/{resource_type}` 相同。
+    """
+    if resource_history is None:
+        raise HTTPException(status_code=404, detail="未启用资源历史 (未设置 NMOS_HISTORY_DIR)。")
+    timestamp = parse_history_time(at)
+    resource_types, _ = parse_push_filters(types, None)
+    filters = {
+        "device_id": device_id,
+        "node_id": node_id,
+        "flow_id": flow_id,
+        "source_id": source_id,
+        "subscription.sender_id": subscription_sender_id,
+    }
+    filters = {resource_index.INDEXED_FIELDS[field]: value for field, value in filters.items() if value is not None}
+    try:
+        # 读取检查点和回放日志可能耗时较长, 放到线程中执行, 不阻塞事件循环
+        state = await asyncio.to_thread(resource_history.state_at, timestamp, resource_types)
+    except (OSError, ValueError) as e:
+        logger.error(f"重建 {at} 时的资源清单失败: {e}")
+        raise HTTPException(status_code=500, detail=f"读取资源历史失败: {e}")
+    if state is None:
+        oldest = resource_history.oldest_time()
+        raise HTTPException(status_code=404, detail=f"{at} 早于保留的最早历史"
+                            f" ({datetime.fromtimestamp(oldest, timezone.utc).isoformat() if oldest else '暂无历史'})。")
+    resources = {resource_type: [resource for resource in resources_dict.values()
+                                 if all(resource_index.extract_field(resource, path) == value for path, value in filters.items())]
+                 for resource_type, resources_dict in state.resources.items()}
+    return {
+        "at": datetime.fromtimestamp(state.at, timezone.utc).isoformat(),
+        "checkpoint_at": datetime.fromtimestamp(state.checkpoint_at, timezone.utc).isoformat(),
+        "last_change_at": datetime.fromtimestamp(state.last_change_at, timezone.utc).isoformat(),
+        "segment": state.segment,
+        "after_gap": state.after_gap,
+        "resources": resources,
+    }
 
-    # Ensure all keys required by ResourcesResponse are present, even if empty
-    for key_to_check in ResourcesResponse.model_fields.keys():
-        if key_to_check not in output_resources:
-            output_resources[key_to_check] = []
+@app.get("/history/stats", summary="Resource history segments, size and retention")
+async def history_stats_api(current_user_data: dict = Depends(get_current_user)):
+    if resource_history is None:
+        raise HTTPException(status_code=404, detail="未启用资源历史 (未设置 NMOS_HISTORY_DIR)。")
+    return {**resource_history.stats(), "segment_index": resource_history.segments()}
+
+@app.get("/search", summary="Ranked full-text, tag and id-prefix search over the cached resources")
+async def search_resources_api(q: str,
+                               types: Optional[str] = None,
+                               offset: int = Query(0, ge=0),
+                               limit: int = Query(20, ge=1, le=200),
+                               if_none_match: Optional[str] = Header(None),
+                               current_user_data: dict = Depends(get_current_user)):
+    """
+    `q` 由空格分隔的词组成, 所有词都必须匹配: 普通词匹配 label / description / tag 值中的单词 (或单词前缀),
+    4 个字符以上的十六进制词也匹配 id 前缀; `key=value` (或 `key=`) 匹配 tag。
+    例如 `q=cam studio`、`q=location=studio-a&types=senders,receivers`、`q=3f1c`。
+    结果按得分 (id > label > tag > description) 排序并分页; `total` 为匹配总数。
+    """
+    started = time.perf_counter()
+    snapshot = nmos_store.snapshot
+    if snapshot.search is None:
+        raise HTTPException(status_code=404, detail="未启用搜索索引 (NMOS_SEARCH_INDEX=0)。")
+    resource_types, _ = parse_push_filters(types, None)
+    type_key = ",".join(sorted(resource_types)) if resource_types else ""
+
+    def build_body():
+        result = snapshot.search.search(q, resource_types, offset=offset, limit=limit)
+        return json.dumps({
+            "query": q,
+            "total": result.total,
+            "offset": offset,
+            "limit": limit,
+            "results": [{"type": hit.resource_type, "id": hit.resource_id, "label": hit.label, "score": hit.score}
+                        for hit in result.hits],
+        }, separators=(",", ":")).encode("utf-8")
+
+    cache_key = f"{' '.join(q.lower().split())}|{type_key}|{offset}|{limit}"
+    return observe_resources_response("/search", started,
+                                      cached_json_response(cache_key, snapshot, build_body, if_none_match, search_responses))
+
+def topology_scope(node_id: Optional[str], device_id: Optional[str]):
+    if node_id and device_id:
+        raise HTTPException(status_code=400, detail="node_id 和 device_id 只能指定一个。")
+    if node_id:
+        return node_id, "node"
+    if device_id:
+        return device_id, "device"
+    return None, None
+
+@app.get("/topology", summary="Media topology graph (vertices and edges), optionally scoped to one node or device")
+async def get_topology_api(node_id: Optional[str] = None,
+                           device_id: Optional[str] = None,
+                           if_none_match: Optional[str] = Header(None),
+                           current_user_data: dict = Depends(get_current_user)):
+    """
+    返回 `{"epoch", "sequence", "generation", "vertices", "edges", "external"}`。
+    边类型: belongs_to_node、belongs_to_device、sends_flow、flow_of_source、active_connection;
+    `node_id=` / `device_id=` 只返回该节点/设备的子树, 子树外的连接端点放在 `external` 中。
+    之后用 `/topology/changes?since=<sequence>&epoch=<epoch>` 增量更新。
+    """
+    if topology is None:
+        raise HTTPException(status_code=404, detail="拓扑图未启用。")
+    started = time.perf_counter()
+    root_id, root_type = topology_scope(node_id, device_id)
+    # 追上尚未应用的缓存变更 (通常只有后台线程上次处理之后的少量变更)
+    sequence = await asyncio.to_thread(topology.sync)
+    etag = topology_responses.etag_for(sequence)
+    if if_none_match and response_cache.etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    def build_body():
+        view = topology.view(root_id, root_type)
+        return json.dumps(view._asdict(), separators=(",", ":")).encode("utf-8")
 
-    return ResourcesResponse(**output_resources)
+    try:
+        cached = await asyncio.to_thread(topology_responses.get, f"{root_type}:{root_id}", sequence, build_body)
+    except topology_graph.UnknownScope as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return observe_resources_response("/topology", started, Response(
+        content=cached.body, media_type="application/json", headers={"ETag": cached.etag}))
+
+@app.get("/topology/changes", summary="Topology graph changes since a sequence number")
+async def get_topology_changes_api(since: int = 0, epoch: Optional[str] = None, limit: int = 1000,
+                                   node_id: Optional[str] = None,
+                                   device_id: Optional[str] = None,
+                                   current_user_data: dict = Depends(get_current_user)):
+    """
+    与 /resources/changes 相同的轮询方式, 变更对象是 `vertices` / `edges`。
+    `resync_required` 为 true 时 (拓扑图从快照重建过) 需重新获取 /topology。
+    """
+    if topology is None:
+        raise HTTPException(status_code=404, detail="拓扑图未启用。")
+    root_id, root_type = topology_scope(node_id, device_id)
+    await asyncio.to_thread(topology.sync)
+    try:
+        found = topology.changes_since(since, epoch=epoch, limit=max(1, limit), root_id=root_id, root_type=root_type)
+    except topology_graph.UnknownScope as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return {
+        "epoch": found.epoch,
+        "current_sequence": found.result.current_sequence,
+        "resync_required": found.result.resync_required,
+        "has_more": found.result.has_more,
+        "changes": [{"sequence": entry.sequence, "operation": entry.operation, "kind": entry.resource_type,
+                     "id": entry.resource_id, "data": entry.resource} for entry in found.result.changes],
+        "external": found.external,
+    }
+
+@app.get("/persistence/stats", summary="Write-behind database persistence: pending changes, flushes and errors")
+async def persistence_stats_api(current_user_data: dict = Depends(get_current_user)):
+    if persistence_writer is None:
+        raise HTTPException(status_code=404, detail="未启用数据库持久化 (未设置 DATABASE_URL)。")
+    return persistence_writer.stats()
+
+@app.get("/registration/nodes", summary="Nodes this service registers and heartbeats, and the heartbeat scheduler state")
+async def list_registered_nodes_api(current_user_data: dict = Depends(get_current_user)):
+    return {"scheduler": heartbeat_scheduler.status(),
+            "self_node_id": self_node_id,
+            "nodes": [node.status() for node in heartbeat_scheduler.nodes()]}
+
+@app.post("/registration/nodes", summary="Register a virtual node with its devices, sources, flows, senders and receivers")
+async def register_virtual_node_api(payload: VirtualNodeRegistration, current_user_data: dict = Depends(get_current_user)):
+    if not heartbeat_scheduler.registration_api_url:
+        raise HTTPException(status_code=503, detail="尚未配置 Registration API，请先调用 POST /configure。")
+    version = node_registration.nmos_version()
+    node_resource = {"version": version, **payload.node}
+    node_resource.setdefault("id", str(uuid.uuid4()))
+    if heartbeat_scheduler.get(node_resource["id"]) is not None:
+        raise HTTPException(status_code=409, detail=f"节点 {node_resource['id']} 已注册。")
+    sub_resources = {res_type: [{"version": version, **resource} for resource in getattr(payload, f"{res_type}s")]
+                     for res_type in node_registration.SUB_RESOURCE_TYPES}
+    for res_type, resources in sub_resources.items():
+        if any("id" not in resource for resource in resources):
+            raise HTTPException(status_code=400, detail=f"每个 {res_type} 都需要 'id'。")
+    try:
+        node = await heartbeat_scheduler.register(node_registration.RegisteredNode(node_resource, sub_resources))
+    except httpx.HTTPStatusError as e:
+        raise HTTPException(status_code=502, detail=f"Registration API 拒绝注册: {e.response.status_code} {e.response.text[:200]}")
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=503, detail=f"Registration API 不可达: {e}")
+    return node.status()
+
+@app.delete("/registration/nodes/{node_id}", summary="Unregister a virtual node and its sub-resources")
+async def unregister_virtual_node_api(node_id: str, current_user_data: dict = Depends(get_current_user)):
+    if node_id == self_node_id:
+        raise HTTPException(status_code=400, detail="自身节点由 /configure 管理。")
+    if not await heartbeat_scheduler.unregister(node_id):
+        raise HTTPException(status_code=404, detail=f"未注册的节点: {node_id}")
+    return {"unregistered": node_id}
+
+@app.get("/registries", summary="Configured registries, their subscription state and the primary")
+async def list_registries_api(current_user_data: dict = Depends(get_current_user)):
+    return {"primary": registries.primary_url,
+            "registries": [connection.status() for connection in registries.connections()]}
+
+@app.post("/registries", summary="Add a registry whose resources are merged into the cache")
+async def add_registry_api(endpoint: RegistryEndpoint, current_user_data: dict = Depends(get_current_user)):
+    try:
+        registry_connection.check_query_api_url(endpoint.query_api_url)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    previous_primary = registries.primary_url
+    connection = registries.add(endpoint.query_api_url, primary=endpoint.primary)
+    result = await reconcile_with_registry(connection.query_api_url)
+    if not connection.connected:
+        connection.start()
+    if heartbeat_scheduler.registration_api_url and registries.primary_url != previous_primary:
+        # 已注册的节点跟随主注册中心
+        heartbeat_scheduler.move_to(connection.registration_api_url)
+        logger.info(f"将在新的主注册中心 {connection.registration_api_url} 重新注册 {len(heartbeat_scheduler.nodes())} 个节点。")
+    return {"registry": connection.status(), "primary": registries.primary_url, "reconciled": result.dict()}
+
+@app.delete("/registries", summary="Remove a registry and the resources only it supplied")
+async def remove_registry_api(query_api_url: str, current_user_data: dict = Depends(get_current_user)):
+    if registries.get(query_api_url) is None:
+        raise HTTPException(status_code=404, detail=f"未配置的注册中心: {query_api_url}")
+    deleted = await asyncio.to_thread(registries.remove, query_api_url)
+    # 被删除的资源中可能有其他注册中心同样提供的，对账后重新加入
+    for connection in registries.connections():
+        connection.resync_coordinator.request("registry_removed")
+    return {"deleted": deleted, "primary": registries.primary_url, "registries": registries.urls}
+
+@app.get("/metrics", summary="Prometheus metrics", include_in_schema=False)
+async def metrics_api():
+    return Response(content=metrics.render_latest(), media_type=metrics.CONTENT_TYPE_LATEST)
+
+def registry_status() -> Dict[str, Any]:
+    primary = registries.primary
+    return {
+        "nmos_registry_url": registries.primary_url,
+        "websocket_status": "connected" if primary and primary.connected else "disconnected",
+        "registries": {connection.query_api_url: "connected" if connection.connected else "disconnected"
+                       for connection in registries.connections()},
+        "ready": startup_warm_up.ready,
+    }
 
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
-    ws_status = "disconnected"
-    if ws_connection and ws_connection.sock and ws_connection.sock.connected:
-        ws_status = "connected"
-    elif ws_thread and ws_thread.is_alive():
-        ws_status = "connecting_or_alive_but_socket_issue"
+    snapshot = current_snapshot()
+    # 只读 worker 报告采集进程随 store 一起发布的注册中心状态
+    registry_state = registry_status() if shared_store_reader is None else snapshot.status
 
-    counts = {key: len(value) for key, value in nmos_resources.items()}
+    counts = snapshot.counts()
     # Ensure all keys required by CachedCounts are present
-    for key_to_check in CachedCounts.model_fields.keys():
+    for key_to_check in CachedCounts.__fields__.keys():
         if key_to_check not in counts:
             counts[key_to_check] = 0
 
     return HealthResponse(
-        status="ok",
-        nmos_registry_url=registry_url,
-        websocket_status=ws_status,
-        cached_resources_count=CachedCounts(**counts)
+        status="ok" if shared_store_reader is None or snapshot.published else "waiting_for_ingest",
+        nmos_registry_url=registry_state.get("nmos_registry_url"),
+        websocket_status=registry_state.get("websocket_status", "disconnected"),
+        cached_resources_count=CachedCounts(**counts),
+        registries=registry_state.get("registries", {})
     )
 
+@app.get("/health/live", summary="Liveness: the process is up and its event loop responds")
+async def liveness_check():
+    return {"status": "alive", "uptime_seconds": round(time.monotonic() - startup_warm_up.started_at, 3)}
+
+@app.get("/health/ready", summary="Readiness: the start-up warm-up has finished; 503 with its progress until then")
+async def readiness_check():
+    snapshot = current_snapshot()
+    if shared_store_reader is not None:
+        # 只读 worker 在采集进程发布了预热完成的 store 之后才就绪
+        ready = snapshot.published and bool(snapshot.status.get("ready"))
+        body = {"ready": ready, "state": warm_up.STATE_READY if ready else "waiting_for_ingest"}
+    else:
+        body = startup_warm_up.report()
+        if current_discovery is not None and current_discovery.running:
+            body["discovery"] = current_discovery.progress_report()
+    body["cached_resources"] = snapshot.total()
+    return JSONResponse(status_code=200 if body["ready"] else 503, content=body)
+
 @app.on_event("shutdown")
 async def shutdown_event_handler():
     logger.info("NMOS Registry Service 正在关闭...")
-    if ws_connection:
-        logger.info("正在关闭 WebSocket 连接...")
-        ws_connection.close()
-    if ws_thread and ws_thread.is_alive():
-        logger.info("等待 WebSocket 线程结束...")
-        ws_thread.join(timeout=5)
+    if shared_store_reader is not None:
+        return
+    if warm_up_task is not None and not warm_up_task.done():
+        warm_up_task.cancel()
+    await resource_delta_broadcaster.stop()
+    logger.info("正在关闭 WebSocket 连接...")
+    registries.stop_all()
+    await heartbeat_scheduler.stop()
+    password_hasher.shutdown()
+    if snapshot_writer:
+        snapshot_writer.stop()
+    if shared_store_publisher:
+        shared_store_publisher.stop()
+    if persistence_writer:
+        # 停止前把尚未写入的变更刷新到数据库
+        persistence_writer.stop()
+    if resource_history:
+        resource_history.stop()
+    if topology:
+        topology.stop()
     logger.info("NMOS Registry Service 已关闭。")
 
 if __name__ == "__main__":
+    import signal
     import uvicorn
+    api_host = os.getenv("API_HOST", "0.0.0.0")
     api_port = int(os.getenv("API_PORT", "8000"))
     log_level = os.getenv("LOG_LEVEL", "info").lower()
-    logger.info(f"启动 NMOS Registry Service 在端口 {api_port}，日志级别 {log_level}")
-    uvicorn.run(app, host="0.0.0.0", port=api_port, log_level=log_level)
+    api_workers = int(os.getenv("NMOS_API_WORKERS", "1"))
+    if api_workers > 1 and REGISTRY_ROLE == shared_store.ROLE_STANDALONE:
+        # 多 worker 模式: 子进程作为采集进程独占注册中心订阅并发布 store (仅监听本机端口),
+        # 对外端口由 N 个只读 worker 提供服务
+        ingest_port = int(os.getenv("NMOS_INGEST_PORT", "8090"))
+        service_dir = os.path.dirname(os.path.abspath(__file__))
+        ingest_process = subprocess.Popen([sys.executable, os.path.join(service_dir, "main.py")], cwd=service_dir, env={
+            **os.environ, "NMOS_REGISTRY_ROLE": shared_store.ROLE_INGEST, "NMOS_API_WORKERS": "1",
+            "API_HOST": "127.0.0.1", "API_PORT": str(ingest_port), "NMOS_SHARED_STORE_DIR": SHARED_STORE_DIR})
+        # worker 由 uvicorn 命令行启动: 在本进程内 uvicorn.run(workers=N) 会让每个 worker 把本文件再执行一遍
+        reader_processes = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", api_host, "--port", str(api_port),
+             "--workers", str(api_workers), "--log-level", log_level], cwd=service_dir, env={
+                **os.environ, "NMOS_REGISTRY_ROLE": shared_store.ROLE_READER, "NMOS_SHARED_STORE_DIR": SHARED_STORE_DIR,
+                "NMOS_INGEST_URL": f"http://127.0.0.1:{ingest_port}"})
+        logger.info(f"启动 NMOS Registry Service 在端口 {api_port}: {api_workers} 个只读 worker, 采集进程在端口 {ingest_port}")
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        processes = [ingest_process, reader_processes]
+        try:
+            # 任一方退出则整体退出, 由容器的重启策略负责拉起
+            while all(process.poll() is None for process in processes):
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for process in processes:
+                if process.poll() is None:
+                    process.terminate()
+            for process in processes:
+                process.wait(timeout=30)
+    else:
+        logger.info(f"启动 NMOS Registry Service 在端口 {api_port}，日志级别 {log_level}")
+        uvicorn.run(app, host=api_host, port=api_port, log_level=log_level)
@@ -0,0 +1,119 @@
+"""
+Prometheus metrics for the NMOS Registry Service, served by ``GET /metrics``.
+
+Hot paths update metrics once per batch or request, never per resource, and
+each update is a single lock-protected add. Counters that components already
+keep for themselves - the ingest pipeline statistics, the store counts - are
+read only when Prometheus scrapes, through the collectors at the bottom, so
+they cost the hot path nothing extra.
+"""
+
+from typing import Callable, Dict, Iterator
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, REGISTRY
+from prometheus_client.registry import Collector
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = tuple(1024 * 4 ** n for n in range(10))  # 1 KiB .. 256 MiB
+
+# --- Store writes ---
+RESOURCE_CHANGES = Counter(
+    "nmos_registry_resource_changes_total",
+    "Resource changes offered to the cache, by source and outcome (create/update/delete, or skipped for stale versions and unknown ids)",
+    ["source", "outcome"])
+STORE_APPLY_SECONDS = Histogram(
+    "nmos_registry_store_apply_seconds", "Time to apply one batch of changes to the cache",
+    ["source"], buckets=LATENCY_BUCKETS)
+GRAIN_TO_APPLY_SECONDS = Histogram(
+    "nmos_registry_grain_to_apply_seconds",
+    "Time from a grain's creation timestamp at the registry to its changes being applied to the cache",
+    buckets=LATENCY_BUCKETS)
+
+# --- Registry connection ---
+DISCOVERY_DURATION_SECONDS = Gauge(
+    "nmos_registry_discovery_duration_seconds", "Duration of the latest paged discovery walk per resource type",
+    ["resource_type"])
+DISCOVERY_RESOURCES = Gauge(
+    "nmos_registry_discovery_resources", "Resources fetched by the latest paged discovery walk per resource type",
+    ["resource_type"])
+DISCOVERY_RUNS = Counter(
+    "nmos_registry_discovery_runs_total", "Paged discovery walks, by kind (full or reconcile)", ["kind"])
+WEBSOCKET_RECONNECTS = Counter(
+    "nmos_registry_websocket_reconnects_total", "Reconnects scheduled after a registry subscription closed unexpectedly",
+    ["registry"])
+RESYNCS = Counter(
+    "nmos_registry_resyncs_total", "Cache reconciliations with a registry, by trigger", ["registry", "reason"])
+PRIMARY_FAILOVERS = Counter(
+    "nmos_registry_primary_failovers_total", "Primary registry failovers, by reason", ["reason"])
+HEARTBEAT_RTT_SECONDS = Histogram(
+    "nmos_registry_heartbeat_rtt_seconds", "Round-trip time of registered node heartbeats to the Registration API",
+    buckets=LATENCY_BUCKETS)
+HEARTBEAT_FAILURES = Counter(
+    "nmos_registry_heartbeat_failures_total", "Failed registered node heartbeats, by reason", ["reason"])
+NODE_REGISTRATIONS = Counter(
+    "nmos_registry_node_registrations_total", "Node registrations with the Registration API, by kind (initial or reregister)",
+    ["kind"])
+
+# --- Start-up ---
+TIME_TO_READY_SECONDS = Gauge(
+    "nmos_registry_time_to_ready_seconds", "Time from process start until the start-up warm-up finished (0 until then)")
+WARM_UP_PHASE_SECONDS = Gauge(
+    "nmos_registry_warm_up_phase_seconds", "Duration of each start-up warm-up phase", ["phase"])
+
+# --- HTTP API ---
+HTTP_REQUEST_SECONDS = Histogram(
+    "nmos_registry_http_request_seconds", "Time to build responses for the resource endpoints",
+    ["endpoint"], buckets=LATENCY_BUCKETS)
+HTTP_RESPONSE_BYTES = Histogram(
+    "nmos_registry_http_response_bytes", "Body size of responses from the resource endpoints",
+    ["endpoint"], buckets=SIZE_BUCKETS)
+
+
+class StatsCollector(Collector):
+    """
+    Exports components' own statistics dicts at scrape time. ``sources_fn``
+    returns ``{label value: stats dict}``; ``counters`` and ``gauges`` map a
+    stats key to ``(metric name, help)``.
+    """
+
+    def __init__(self, sources_fn: Callable[[], Dict[str, Dict]], label: str,
+                 counters: Dict[str, tuple], gauges: Dict[str, tuple]):
+        self.sources_fn = sources_fn
+        self.label = label
+        self.counters = counters
+        self.gauges = gauges
+
+    def collect(self) -> Iterator:
+        sources = self.sources_fn()
+        for family_type, metric_specs in ((CounterMetricFamily, self.counters), (GaugeMetricFamily, self.gauges)):
+            for key, (name, documentation) in metric_specs.items():
+                family = family_type(name, documentation, labels=[self.label])
+                for label_value, stats in sources.items():
+                    family.add_metric([label_value], stats[key])
+                yield family
+
+
+class StoreCollector(Collector):
+    """Exports the cached resource count per type and the store generation."""
+
+    def __init__(self, snapshot_fn: Callable):
+        self.snapshot_fn = snapshot_fn
+
+    def collect(self) -> Iterator:
+        snapshot = self.snapshot_fn()
+        cached = GaugeMetricFamily("nmos_registry_cached_resources", "Resources in the cache per type",
+                                   labels=["resource_type"])
+        for resource_type, count in snapshot.counts().items():
+            cached.add_metric([resource_type], count)
+        yield cached
+        yield GaugeMetricFamily("nmos_registry_cache_generation", "Generation (change sequence) of the cache snapshot",
+                                value=snapshot.generation)
+
+
+def register_collector(collector: Collector):
+    REGISTRY.register(collector)
+
+
+def render_latest() -> bytes:
+    return generate_latest(REGISTRY)
@@ -0,0 +1,676 @@
+"""
+Local stand-in for an IS-04 registry, for benchmarks and development.
+
+``MockRegistry`` serves, from a synthetic plant held in memory, the parts of
+the IS-04 Query API (v1.3) this service talks to:
+
+* ``GET /{type}`` list endpoints with basic query filters (dotted paths, a
+  list matches if it contains the value) and update-ordered cursor paging:
+  ``paging.since`` / ``paging.until`` / ``paging.limit``, answered with the
+  ``X-Paging-Limit`` / ``X-Paging-Since`` / ``X-Paging-Until`` headers;
+* ``GET /{type}/{id}``, and the flat ``GET /resources`` list ``/discover``
+  reads;
+* ``POST /subscriptions``, whose ``ws_href`` first sends sync grains with
+  every matching resource (``pre`` equal to ``post``) and then one grain per
+  resource type per batch of changes.
+
+Churn comes from ``churn(count)``: version and label bumps, receivers
+switching senders, senders and receivers registered again under a new id.
+``start_churn(rate)`` keeps that up at a steady rate. Grains carry their
+``creation_timestamp`` (TAI), so a consumer can measure how long a change
+takes to reach it. ``max_update_rate_ms`` is accepted but not enforced;
+each ``churn`` call is one batch.
+
+The registry runs in-process - ``app`` is an ASGI app, e.g. for
+``httpx.ASGITransport`` - or as a local server on a background thread
+(``start()`` / ``stop()``), or from the command line:
+
+    python mock_registry.py --nodes 2000 --churn 200 --port 8235
+
+Update timestamps come from a counter, rendered as TAI ``seconds:nanoseconds``
+after the versions of the synthetic plant.
+"""
+
+import argparse
+import asyncio
+import bisect
+import concurrent.futures
+import json
+import logging
+import random
+import socket
+import sys
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import websockets
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, Response
+
+import resource_store
+
+logger = logging.getLogger(__name__)
+
+QUERY_API_PATH = "/x-nmos/query/v1.3"
+# Update timestamps start after the version of the synthetic plant
+EPOCH_SECONDS = 1700000001
+TAI_OFFSET_SECONDS = 37
+DEFAULT_PAGE_LIMIT = 1000
+# Resources per sync grain sent when a subscription opens
+SYNC_GRAIN_SIZE = 500
+# Grains a subscriber may have waiting before it is disconnected as too slow
+MAX_PENDING_GRAINS = 10000
+
+
+# --- Synthetic plant generation ---
+
+def synthetic_plant(nodes: int, devices_per_node: int = 2, senders_per_device: int = 4,
+                    receivers_per_device: int = 4, seed: int = 1) -> List[Dict[str, Any]]:
+    """Builds an IS-04 shaped inventory: node -> devices -> sources/flows/senders, receivers."""
+    return list(iter_synthetic_plant(nodes, devices_per_node, senders_per_device, receivers_per_device, seed))
+
+
+def iter_synthetic_plant(nodes: int, devices_per_node: int = 2, senders_per_device: int = 4,
+                         receivers_per_device: int = 4, seed: int = 1) -> Iterator[Dict[str, Any]]:
+    """Lazy variant of ``synthetic_plant`` for inventories too large to hold twice."""
+    rng = random.Random(seed)
+    version = "1700000000:0"
+    sender_ids: List[str] = []
+    for n in range(nodes):
+        node_id = str(uuid.UUID(int=rng.getrandbits(128)))
+        yield {
+            "id": node_id, "type": "node", "version": version, "label": f"Node {n}",
+            "description": f"Synthetic node {n}", "tags": {"location": [f"rack-{n % 20}"]},
+            "href": f"http://10.0.{n // 250}.{n % 250}:80/", "hostname": f"node-{n}",
+            "caps": {}, "services": [], "clocks": [], "interfaces": [],
+        }
+        for d in range(devices_per_node):
+            device_id = str(uuid.UUID(int=rng.getrandbits(128)))
+            yield {
+                "id": device_id, "type": "device", "version": version, "label": f"Device {n}.{d}",
+                "description": "", "tags": {}, "node_id": node_id, "senders": [], "receivers": [],
+                "device_type": "urn:x-nmos:device:generic",
+                "controls": [{"type": "urn:x-nmos:control:sr-ctrl/v1.1", "href": f"http://node-{n}/x-nmos/connection/v1.1/"}],
+            }
+            for s in range(senders_per_device):
+                source_id = str(uuid.UUID(int=rng.getrandbits(128)))
+                flow_id = str(uuid.UUID(int=rng.getrandbits(128)))
+                sender_id = str(uuid.UUID(int=rng.getrandbits(128)))
+                sender_ids.append(sender_id)
+                yield {
+                    "id": source_id, "type": "source", "version": version, "label": f"Source {n}.{d}.{s}",
+                    "description": "", "tags": {}, "device_id": device_id, "parents": [],
+                    "format": "urn:x-nmos:format:video", "caps": {}, "clock_name": "clk0",
+                }
+                yield {
+                    "id": flow_id, "type": "flow", "version": version, "label": f"Flow {n}.{d}.{s}",
+                    "description": "", "tags": {}, "device_id": device_id, "source_id": source_id, "parents": [],
+                    "format": "urn:x-nmos:format:video", "media_type": "video/raw",
+                    "grain_rate": {"numerator": 50, "denominator": 1}, "frame_width": 1920, "frame_height": 1080,
+                }
+                yield {
+                    "id": sender_id, "type": "sender", "version": version, "label": f"Sender {n}.{d}.{s}",
+                    "description": "", "tags": {}, "device_id": device_id, "flow_id": flow_id,
+                    "transport": "urn:x-nmos:transport:rtp.mcast", "manifest_href": f"http://node-{n}/sdp/{sender_id}.sdp",
+                    "interface_bindings": ["eth0"], "subscription": {"receiver_id": None, "active": False},
+                }
+            for r in range(receivers_per_device):
+                subscribed = rng.choice(sender_ids) if sender_ids and rng.random() < 0.5 else None
+                yield {
+                    "id": str(uuid.UUID(int=rng.getrandbits(128))), "type": "receiver", "version": version,
+                    "label": f"Receiver {n}.{d}.{r}", "description": "", "tags": {}, "device_id": device_id,
+                    "format": "urn:x-nmos:format:video", "caps": {"media_types": ["video/raw"]},
+                    "transport": "urn:x-nmos:transport:rtp.mcast", "interface_bindings": ["eth0"],
+                    "subscription": {"sender_id": subscribed, "active": subscribed is not None},
+                }
+
+
+def bump_version(resource: Dict[str, Any], counter: int) -> Dict[str, Any]:
+    updated = dict(resource)
+    seconds, _ = resource["version"].split(":")
+    updated["version"] = f"{seconds}:{counter}"
+    updated["label"] = f"{resource['label'].split(' #')[0]} #{counter}"
+    return updated
+
+
+# --- Timestamps and filters ---
+
+def render_timestamp(ticks: int) -> str:
+    return f"{EPOCH_SECONDS + ticks // 1_000_000_000}:{ticks % 1_000_000_000}"
+
+
+def parse_timestamp(text: str) -> int:
+    """``"seconds:nanoseconds"`` -> ticks of the update clock. Raises ValueError."""
+    seconds, nanoseconds = (int(part) for part in text.split(":"))
+    return max(0, (seconds - EPOCH_SECONDS) * 1_000_000_000 + nanoseconds)
+
+
+def tai_now() -> str:
+    now = time.time() + TAI_OFFSET_SECONDS
+    return f"{int(now)}:{int(now % 1 * 1_000_000_000)}"
+
+
+def _matches(resource: Dict[str, Any], filters: Dict[str, str]) -> bool:
+    for path, expected in filters.items():
+        value: Any = resource
+        for key in path.split("."):
+            value = value.get(key) if isinstance(value, dict) else None
+        if isinstance(value, list):
+            if expected not in [str(item) for item in value]:
+                return False
+        elif value is None or (str(value).lower() if isinstance(value, bool) else str(value)) != expected:
+            return False
+    return True
+
+
+def grain_frame(subscription_id: str, resource_type: str,
+                entries: List[Tuple[str, Optional[Dict[str, Any]], Optional[Dict[str, Any]]]]) -> str:
+    """One IS-04 data grain for ``(id, pre, post)`` entries of one type, as WebSocket text."""
+    timestamp = tai_now()
+    return json.dumps({
+        "grain_type": "event", "source_id": subscription_id, "flow_id": subscription_id,
+        "origin_timestamp": timestamp, "sync_timestamp": timestamp, "creation_timestamp": timestamp,
+        "rate": {"numerator": 0, "denominator": 1}, "duration": {"numerator": 0, "denominator": 1},
+        "grain": {
+            "type": "urn:x-nmos:format:data.event", "topic": f"/{resource_type}/",
+            # `topic` per entry as well: this service derives deleted ids from it
+            "data": [{"path": resource_id, "topic": f"/{resource_type}/{resource_id}", "pre": pre, "post": post}
+                     for resource_id, pre, post in entries],
+        },
+    }, separators=(",", ":"))
+
+
+class _Subscriber:
+    """One open subscription WebSocket."""
+
+    def __init__(self, subscription_id: str, resource_type: Optional[str], filters: Dict[str, str]):
+        self.subscription_id = subscription_id
+        self.resource_type = resource_type
+        self.filters = filters
+        self.queue: "asyncio.Queue[Optional[str]]" = asyncio.Queue()
+        self.close_code: Optional[int] = 1000
+
+    def wants(self, resource_type: str) -> bool:
+        return self.resource_type is None or self.resource_type == resource_type
+
+    def disconnect(self, code: Optional[int]):
+        """Ends the subscription with close ``code``, or None if the client already closed it."""
+        # Frames still waiting are dropped: a slow subscriber resyncs anyway
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.close_code = code
+        self.queue.put_nowait(None)
+
+
+class MockRegistry:
+    """An in-memory IS-04 Query API over ``resources`` (IS-04 dicts with ``type``)."""
+
+    def __init__(self, resources: Iterable[Dict[str, Any]] = (), page_limit: int = DEFAULT_PAGE_LIMIT,
+                 base_path: str = QUERY_API_PATH, reregister_fraction: float = 0.05,
+                 resubscribe_fraction: float = 0.2, seed: int = 1):
+        self.base_path = base_path.rstrip("/")
+        self.page_limit = max(1, page_limit)
+        self.reregister_fraction = reregister_fraction
+        self.resubscribe_fraction = resubscribe_fraction
+        self._rng = random.Random(seed)
+        self._resources: Dict[str, Dict[str, Dict[str, Any]]] = {resource_type: {} for resource_type in resource_store.RESOURCE_TYPES}
+        self._type_of: Dict[str, str] = {}
+        # Update order per type as (ticks, id); superseded entries stay until compacted
+        self._order: Dict[str, List[Tuple[int, str]]] = {resource_type: [] for resource_type in resource_store.RESOURCE_TYPES}
+        self._updated: Dict[str, int] = {}
+        # Ids in a list for uniform random picks, with their positions for O(1) removal
+        self._ids: List[str] = []
+        self._positions: Dict[str, int] = {}
+        self._ticks = 0
+        self._subscribers: Set[_Subscriber] = set()
+        self._subscriptions: Dict[str, Dict[str, Any]] = {}
+        self._churn_task: Optional[asyncio.Task] = None
+        self._server = None
+        self._thread: Optional[threading.Thread] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.query_api_url: Optional[str] = None
+        self.requests = 0
+        self.resources_served = 0
+        self.grains_sent = 0
+        self.changes_emitted = 0
+        self.subscribers_dropped = 0
+        for resource in resources:
+            self._store(f"{resource['type']}s", resource)
+        self.app = self._build_app()
+
+    # --- State ---
+
+    def _tick(self) -> int:
+        self._ticks += 1
+        return self._ticks
+
+    def _store(self, resource_type: str, resource: Dict[str, Any]):
+        resource_id = resource["id"]
+        ticks = self._tick()
+        if resource_id not in self._type_of:
+            self._type_of[resource_id] = resource_type
+            self._positions[resource_id] = len(self._ids)
+            self._ids.append(resource_id)
+        self._resources[resource_type][resource_id] = resource
+        self._updated[resource_id] = ticks
+        order = self._order[resource_type]
+        order.append((ticks, resource_id))
+        if len(order) > 2 * len(self._resources[resource_type]) + 1000:
+            self._order[resource_type] = [entry for entry in order if self._updated.get(entry[1]) == entry[0]]
+
+    def _remove(self, resource_id: str) -> Dict[str, Any]:
+        resource_type = self._type_of.pop(resource_id)
+        del self._updated[resource_id]
+        position = self._positions.pop(resource_id)
+        last = self._ids.pop()
+        if last != resource_id:
+            self._ids[position] = last
+            self._positions[last] = position
+        return self._resources[resource_type].pop(resource_id)
+
+    def get(self, resource_type: str, resource_id: str) -> Optional[Dict[str, Any]]:
+        return self._resources.get(resource_type, {}).get(resource_id)
+
+    def counts(self) -> Dict[str, int]:
+        return {resource_type: len(resources) for resource_type, resources in self._resources.items()}
+
+    def total(self) -> int:
+        return len(self._type_of)
+
+    def versions(self) -> Dict[str, str]:
+        """``{id: version}`` of every resource, e.g. to compare a consumer's cache against."""
+        return {resource_id: resource.get("version")
+                for resources in self._resources.values() for resource_id, resource in resources.items()}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "resources": self.total(), "requests": self.requests, "resources_served": self.resources_served,
+            "subscribers": len(self._subscribers), "subscriptions": len(self._subscriptions),
+            "grains_sent": self.grains_sent, "changes_emitted": self.changes_emitted,
+            "subscribers_dropped": self.subscribers_dropped,
+        }
+
+    # --- Paging ---
+
+    def page(self, resource_type: str, filters: Optional[Dict[str, str]] = None, since: Optional[int] = None,
+             until: Optional[int] = None, limit: Optional[int] = None) -> Tuple[List[Dict[str, Any]], int, int, int]:
+        """
+        One page of ``paging.order=update``: ``(resources newest first, limit, since, until)``.
+        With ``since`` the page holds the oldest matches after it, otherwise the newest up to
+        ``until`` (default: now), as IS-04 describes.
+        """
+        limit = min(self.page_limit, max(1, limit or self.page_limit))
+        now = self._ticks
+        until = now if until is None else min(until, now)
+        order, updated, resources = self._order[resource_type], self._updated, self._resources[resource_type]
+        filters = filters or {}
+        selected: List[Tuple[int, Dict[str, Any]]] = []
+
+        def current(position: int) -> Optional[Tuple[int, Dict[str, Any]]]:
+            ticks, resource_id = order[position]
+            if updated.get(resource_id) != ticks:
+                return None
+            resource = resources[resource_id]
+            return (ticks, resource) if not filters or _matches(resource, filters) else None
+
+        if since is not None:
+            position = bisect.bisect_right(order, (since, "\uffff"))
+            while position < len(order) and len(selected) < limit:
+                entry = current(position)
+                if entry is not None:
+                    if entry[0] > until:
+                        break
+                    selected.append(entry)
+                position += 1
+            page_until = selected[-1][0] if len(selected) == limit else until
+            page_since = since
+            selected.reverse()
+        else:
+            position = bisect.bisect_right(order, (until, "\uffff")) - 1
+            while position >= 0 and len(selected) < limit:
+                entry = current(position)
+                if entry is not None:
+                    selected.append(entry)
+                position -= 1
+            page_since = selected[-1][0] - 1 if len(selected) == limit else 0
+            page_until = until
+        return [resource for _, resource in selected], limit, page_since, page_until
+
+    # --- Churn ---
+
+    def _random_id(self, resource_type: Optional[str] = None) -> Optional[str]:
+        if resource_type is None:
+            return self._rng.choice(self._ids) if self._ids else None
+        resources = self._resources[resource_type]
+        if not resources:
+            return None
+        # Random ids until one of the type turns up; senders and receivers are most of a plant
+        for _ in range(64):
+            resource_id = self._rng.choice(self._ids)
+            if self._type_of[resource_id] == resource_type:
+                return resource_id
+        return next(iter(resources))
+
+    def _bump(self) -> List[Tuple[str, str, Optional[Dict[str, Any]], Optional[Dict[str, Any]]]]:
+        resource_id = self._random_id()
+        if resource_id is None:
+            return []
+        resource_type = self._type_of[resource_id]
+        pre = self._resources[resource_type][resource_id]
+        post = dict(pre)
+        post["version"] = render_timestamp(self._ticks + 1)
+        post["label"] = f"{pre.get('label', '').split(' #')[0]} #{self._ticks + 1}"
+        self._store(resource_type, post)
+        return [(resource_type, resource_id, pre, post)]
+
+    def _resubscribe(self) -> List[Tuple[str, str, Optional[Dict[str, Any]], Optional[Dict[str, Any]]]]:
+        receiver_id = self._random_id("receivers")
+        if receiver_id is None:
+            return self._bump()
+        pre = self._resources["receivers"][receiver_id]
+        sender_id = self._random_id("senders") if self._rng.random() < 0.7 else None
+        post = dict(pre, version=render_timestamp(self._ticks + 1),
+                    subscription={"sender_id": sender_id, "active": sender_id is not None})
+        self._store("receivers", post)
+        return [("receivers", receiver_id, pre, post)]
+
+    def _reregister(self) -> List[Tuple[str, str, Optional[Dict[str, Any]], Optional[Dict[str, Any]]]]:
+        resource_type = self._rng.choice(("senders", "receivers"))
+        old_id = self._random_id(resource_type)
+        if old_id is None:
+            return self._bump()
+        pre = self._remove(old_id)
+        # uuid4: ids from the seeded generator would repeat the plant's
+        post = dict(pre, id=str(uuid.uuid4()), version=render_timestamp(self._ticks + 1))
+        self._store(resource_type, post)
+        return [(resource_type, old_id, pre, None), (resource_type, post["id"], None, post)]
+
+    def churn(self, count: int) -> List[Tuple[str, str, Optional[Dict[str, Any]], Optional[Dict[str, Any]]]]:
+        """
+        Applies ``count`` random changes and sends them to the open subscriptions. Returns
+        ``(type, id, pre, post)`` per change (a re-registration is two). Call it on the
+        registry's loop when it is serving (see ``call``).
+        """
+        changes = []
+        for _ in range(count):
+            roll = self._rng.random()
+            if roll < self.reregister_fraction:
+                changes.extend(self._reregister())
+            elif roll < self.reregister_fraction + self.resubscribe_fraction:
+                changes.extend(self._resubscribe())
+            else:
+                changes.extend(self._bump())
+        self.changes_emitted += len(changes)
+        self._broadcast(changes)
+        return changes
+
+    def _broadcast(self, changes: List[Tuple[str, str, Optional[Dict[str, Any]], Optional[Dict[str, Any]]]]):
+        if not self._subscribers:
+            return
+        by_type: Dict[str, List[Tuple[str, Optional[Dict[str, Any]], Optional[Dict[str, Any]]]]] = {}
+        for resource_type, resource_id, pre, post in changes:
+            by_type.setdefault(resource_type, []).append((resource_id, pre, post))
+        for subscriber in list(self._subscribers):
+            for resource_type, entries in by_type.items():
+                if not subscriber.wants(resource_type):
+                    continue
+                if subscriber.filters:
+                    entries = [(resource_id, pre, post) for resource_id, pre, post in entries
+                               if any(resource is not None and _matches(resource, subscriber.filters) for resource in (pre, post))]
+                if not entries:
+                    continue
+                if subscriber.queue.qsize() >= MAX_PENDING_GRAINS:
+                    logger.warning(f"Subscriber {subscriber.subscription_id} is {MAX_PENDING_GRAINS} grains behind, disconnecting it")
+                    self.subscribers_dropped += 1
+                    self._subscribers.discard(subscriber)
+                    subscriber.disconnect(1008)
+                    break
+                subscriber.queue.put_nowait(grain_frame(subscriber.subscription_id, resource_type, entries))
+
+    def call(self, fn: Callable[..., Any], *args) -> Any:
+        """Runs ``fn(*args)`` on the loop the registry serves on and returns its result."""
+        loop = self.loop
+        if loop is None or not loop.is_running() or threading.current_thread() is self._thread:
+            return fn(*args)
+        future: concurrent.futures.Future = concurrent.futures.Future()
+
+        def run():
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+
+        loop.call_soon_threadsafe(run)
+        return future.result()
+
+    def start_churn(self, rate: float, interval: float = 0.02):
+        """Keeps generating about ``rate`` changes per second until ``stop_churn``."""
+        async def run():
+            owed, last = 0.0, time.monotonic()
+            while True:
+                await asyncio.sleep(interval)
+                now = time.monotonic()
+                owed += (now - last) * rate
+                last = now
+                if owed >= 1:
+                    self.churn(int(owed))
+                    owed -= int(owed)
+
+        def schedule():
+            self.stop_churn()
+            self._churn_task = asyncio.get_event_loop().create_task(run())
+
+        self.call(schedule)
+
+    def stop_churn(self):
+        def cancel():
+            if self._churn_task is not None:
+                self._churn_task.cancel()
+                self._churn_task = None
+        self.call(cancel)
+
+    # --- Subscriptions ---
+
+    def _sync_frames(self, subscriber: _Subscriber) -> Iterator[str]:
+        for resource_type in resource_store.RESOURCE_TYPES:
+            if not subscriber.wants(resource_type):
+                continue
+            entries = [(resource_id, resource, resource) for resource_id, resource in self._resources[resource_type].items()
+                       if not subscriber.filters or _matches(resource, subscriber.filters)]
+            for start in range(0, len(entries), SYNC_GRAIN_SIZE):
+                yield grain_frame(subscriber.subscription_id, resource_type, entries[start:start + SYNC_GRAIN_SIZE])
+
+    async def _serve_subscription(self, websocket: WebSocket, subscription_id: str, resource_path: str, params: Dict[str, Any]):
+        resource_type = resource_path.strip("/") or None
+        if resource_type is not None and resource_type not in self._resources:
+            await websocket.close(code=1003)
+            return
+        filters = {key: value for key, value in params.items() if isinstance(value, str) and not key.startswith(("paging.", "query."))}
+        subscriber = _Subscriber(subscription_id, resource_type, filters)
+        # Registered before the sync grains are built, on the same loop as churn: nothing falls in between
+        self._subscribers.add(subscriber)
+
+        async def watch_client():
+            # The client sends nothing more; reading is only to notice it closing while no grains are due
+            try:
+                while (await websocket.receive())["type"] != "websocket.disconnect":
+                    pass
+            except (WebSocketDisconnect, RuntimeError):
+                pass
+            subscriber.disconnect(None)
+
+        watcher = asyncio.ensure_future(watch_client())
+        try:
+            for frame in list(self._sync_frames(subscriber)):
+                await websocket.send_text(frame)
+                self.grains_sent += 1
+            while True:
+                frame = await subscriber.queue.get()
+                if frame is None:
+                    if subscriber.close_code is not None:
+                        await websocket.close(code=subscriber.close_code)
+                    return
+                await websocket.send_text(frame)
+                self.grains_sent += 1
+        except (WebSocketDisconnect, websockets.exceptions.ConnectionClosed, ConnectionError):
+            pass
+        finally:
+            watcher.cancel()
+            self._subscribers.discard(subscriber)
+
+    # --- HTTP API ---
+
+    def _build_app(self) -> FastAPI:
+        app = FastAPI(title="Mock IS-04 Query API")
+        base = self.base_path
+
+        @app.on_event("startup")
+        async def capture_loop():
+            self.loop = asyncio.get_running_loop()
+
+        @app.get(base + "/resources")
+        async def all_resources():
+            self.requests += 1
+            resources = [resource for resources in self._resources.values() for resource in resources.values()]
+            self.resources_served += len(resources)
+            return Response(content=json.dumps(resources, separators=(",", ":")), media_type="application/json")
+
+        @app.post(base + "/subscriptions", status_code=201)
+        async def create_subscription(request: Request):
+            self.requests += 1
+            body = await request.json()
+            subscription_id = str(uuid.uuid4())
+            http_base = str(request.base_url).rstrip("/")
+            subscription = {
+                "id": subscription_id,
+                "ws_href": f"ws{http_base[len('http'):]}{base}/ws/{subscription_id}",
+                "resource_path": body.get("resource_path", ""),
+                "params": body.get("params", {}),
+                "max_update_rate_ms": body.get("max_update_rate_ms", 100),
+                "persist": bool(body.get("persist", False)),
+                "secure": False,
+                "authorization": False,
+            }
+            self._subscriptions[subscription_id] = subscription
+            return JSONResponse(subscription, status_code=201)
+
+        @app.get(base + "/subscriptions")
+        async def list_subscriptions():
+            return list(self._subscriptions.values())
+
+        @app.websocket(base + "/ws/{subscription_id}")
+        async def subscription_socket(websocket: WebSocket, subscription_id: str):
+            subscription = self._subscriptions.get(subscription_id)
+            if subscription is None:
+                await websocket.close(code=1008)
+                return
+            await websocket.accept()
+            await self._serve_subscription(websocket, subscription_id, subscription["resource_path"], subscription["params"])
+
+        @app.get(base + "/{resource_type}")
+        async def list_resources(resource_type: str, request: Request):
+            if resource_type not in self._resources:
+                return JSONResponse({"code": 404, "error": f"unknown resource type {resource_type}", "debug": None}, status_code=404)
+            self.requests += 1
+            query = request.query_params
+            try:
+                since = parse_timestamp(query["paging.since"]) if "paging.since" in query else None
+                until = parse_timestamp(query["paging.until"]) if "paging.until" in query else None
+                limit = int(query["paging.limit"]) if "paging.limit" in query else None
+            except ValueError as e:
+                return JSONResponse({"code": 400, "error": f"invalid paging parameter: {e}", "debug": None}, status_code=400)
+            if query.get("paging.order", "update") != "update":
+                return JSONResponse({"code": 501, "error": "only paging.order=update is supported", "debug": None}, status_code=501)
+            filters = {key: value for key, value in query.items() if not key.startswith(("paging.", "query."))}
+            resources, limit, page_since, page_until = self.page(resource_type, filters, since, until, limit)
+            self.resources_served += len(resources)
+            return Response(content=json.dumps(resources, separators=(",", ":")), media_type="application/json",
+                            headers={"X-Paging-Limit": str(limit), "X-Paging-Since": render_timestamp(page_since),
+                                     "X-Paging-Until": render_timestamp(page_until)})
+
+        @app.get(base + "/{resource_type}/{resource_id}")
+        async def single_resource(resource_type: str, resource_id: str):
+            self.requests += 1
+            resource = self.get(resource_type, resource_id)
+            if resource is None:
+                return JSONResponse({"code": 404, "error": f"{resource_type}/{resource_id} not found", "debug": None}, status_code=404)
+            return resource
+
+        return app
+
+    # --- Local server ---
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Serves on ``host:port`` (0 picks a free port) from a background thread; returns the Query API URL."""
+        import uvicorn
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host, port))
+        config = uvicorn.Config(self.app, log_level="warning", lifespan="on", loop="none", ws="websockets")
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._server.run, kwargs={"sockets": [sock]}, name="mock-registry", daemon=True)
+        self._thread.start()
+        deadline = time.monotonic() + 10
+        while not self._server.started:
+            if time.monotonic() > deadline or not self._thread.is_alive():
+                raise RuntimeError(f"mock registry did not start on {host}:{port}")
+            time.sleep(0.01)
+        self.query_api_url = f"http://{host}:{sock.getsockname()[1]}{self.base_path}"
+        logger.info(f"Mock registry with {self.total()} resources serving {self.query_api_url}")
+        return self.query_api_url
+
+    def stop(self, timeout: float = 10.0):
+        if self._server is None:
+            return
+        self.stop_churn()
+
+        def close_subscribers():
+            for subscriber in list(self._subscribers):
+                subscriber.disconnect(1001)
+            self._subscribers.clear()
+
+        self.call(close_subscribers)
+        self._server.should_exit = True
+        self._thread.join(timeout=timeout)
+        self._server = None
+        self._thread = None
+        self.loop = None
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8235)
+    parser.add_argument("--nodes", type=int, default=500)
+    parser.add_argument("--devices-per-node", type=int, default=2)
+    parser.add_argument("--senders-per-device", type=int, default=4)
+    parser.add_argument("--receivers-per-device", type=int, default=4)
+    parser.add_argument("--churn", type=float, default=0.0, help="changes per second sent to subscribers")
+    parser.add_argument("--page-limit", type=int, default=DEFAULT_PAGE_LIMIT, help="largest page the list endpoints return")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    registry = MockRegistry(iter_synthetic_plant(args.nodes, args.devices_per_node, args.senders_per_device,
+                                                 args.receivers_per_device, args.seed),
+                            page_limit=args.page_limit, seed=args.seed)
+    url = registry.start(args.host, args.port)
+    print(f"Query API: {url}  ({registry.total()} resources: {registry.counts()})")
+    if args.churn:
+        registry.start_churn(args.churn)
+    try:
+        while True:
+            time.sleep(10)
+            logger.info(f"mock registry: {registry.call(registry.stats)}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        registry.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
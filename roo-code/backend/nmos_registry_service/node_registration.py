@@ -0,0 +1,349 @@
+"""
+Self-registration of nodes with an IS-04 Registration API.
+
+The controller registers its own node and, optionally, virtual nodes with
+their devices, sources, flows, senders and receivers (a multiviewer proxy,
+say). ``HeartbeatScheduler`` keeps all of them alive from the event loop:
+
+* Due heartbeats are kept in a ``TimerWheel`` - one slot per tick across the
+  heartbeat interval - so finding the due nodes costs a slot lookup per
+  tick, however many nodes are registered.
+* Each node's next heartbeat is ``interval`` minus a random jitter of up to
+  ``jitter`` seconds, and nodes registered together are spread across the
+  first interval, so hundreds of nodes do not heartbeat in lockstep.
+* Heartbeats share one pooled keep-alive ``httpx.AsyncClient`` with at most
+  ``max_concurrency`` requests in flight.
+* A 404 (the registry expired or lost the node) re-registers the node and
+  its sub-resources in the same task; nothing spawns a thread.
+
+``on_registry_failing`` is called once per streak of ``failure_threshold``
+consecutive requests the registry did not answer (transport errors and 5xx
+responses), so the owner can fail over to another registry and ``move_to``
+it. A request the registry answered, even with a 4xx for one node, ends the
+streak. While a streak lasts the handler is called at most once per
+heartbeat interval, and outcomes of requests sent to a previous
+Registration API are ignored.
+"""
+
+import asyncio
+import logging
+import math
+import random
+import time
+from typing import Any, Callable, Dict, List, Optional, Set
+
+import httpx
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Registration order: a resource must be registered after the resources it references
+SUB_RESOURCE_TYPES = ["device", "source", "flow", "sender", "receiver"]
+
+DEFAULT_INTERVAL = 5.0
+DEFAULT_JITTER = 0.5
+DEFAULT_TICK = 0.05
+
+# What a heartbeat or re-registration says about the registry
+OUTCOME_OK = "ok"
+OUTCOME_REJECTED = "rejected"        # the registry answered, but refused this node (4xx)
+OUTCOME_UNREACHABLE = "unreachable"  # transport error or 5xx: the registry itself is failing
+
+
+def nmos_version() -> str:
+    """Current time as an IS-04 ``<seconds>:<nanoseconds>`` version."""
+    now_ns = time.time_ns()
+    return f"{now_ns // 1_000_000_000}:{now_ns % 1_000_000_000}"
+
+
+class TimerWheel:
+    """
+    Single-level hashed timer wheel. ``schedule`` files a key ``delay`` seconds
+    ahead (delays beyond one revolution are clamped); ``advance`` moves one tick
+    and returns the keys that became due.
+    """
+
+    def __init__(self, tick: float, span: float):
+        self.tick = tick
+        self.slots: List[Set[str]] = [set() for _ in range(int(math.ceil(span / tick)) + 1)]
+        self.cursor = 0
+        self._slot_of: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._slot_of)
+
+    def schedule(self, key: str, delay: float):
+        self.cancel(key)
+        ticks = min(len(self.slots) - 1, max(1, int(math.ceil(delay / self.tick))))
+        slot = (self.cursor + ticks) % len(self.slots)
+        self.slots[slot].add(key)
+        self._slot_of[key] = slot
+
+    def cancel(self, key: str):
+        slot = self._slot_of.pop(key, None)
+        if slot is not None:
+            self.slots[slot].discard(key)
+
+    def advance(self) -> List[str]:
+        self.cursor = (self.cursor + 1) % len(self.slots)
+        due = self.slots[self.cursor]
+        if not due:
+            return []
+        self.slots[self.cursor] = set()
+        for key in due:
+            del self._slot_of[key]
+        return list(due)
+
+
+class RegisteredNode:
+    """A node resource and the sub-resources registered with it."""
+
+    def __init__(self, node: Dict[str, Any], sub_resources: Optional[Dict[str, List[Dict[str, Any]]]] = None,
+                 label: Optional[str] = None):
+        self.node = node
+        # Keyed by singular IS-04 type ("device", "sender", ...)
+        self.sub_resources = {res_type: list((sub_resources or {}).get(res_type, [])) for res_type in SUB_RESOURCE_TYPES}
+        self.label = label or node.get("label")
+        self.registered = False
+        self.registrations = 0
+        self.heartbeats = 0
+        self.failures = 0
+        self.due_at: Optional[float] = None
+        self.last_heartbeat_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    @property
+    def node_id(self) -> str:
+        return self.node["id"]
+
+    def resources_in_order(self):
+        yield "node", self.node
+        for res_type in SUB_RESOURCE_TYPES:
+            for resource in self.sub_resources[res_type]:
+                yield res_type, resource
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "node_id": self.node_id,
+            "label": self.label,
+            "registered": self.registered,
+            "sub_resources": {res_type: len(resources) for res_type, resources in self.sub_resources.items()},
+            "registrations": self.registrations,
+            "heartbeats": self.heartbeats,
+            "failures": self.failures,
+            "last_heartbeat_at": self.last_heartbeat_at,
+            "last_error": self.last_error,
+        }
+
+
+class HeartbeatScheduler:
+    def __init__(self,
+                 interval: float = DEFAULT_INTERVAL,
+                 jitter: float = DEFAULT_JITTER,
+                 tick: float = DEFAULT_TICK,
+                 max_concurrency: int = 32,
+                 request_timeout: float = 2.0,
+                 failure_threshold: int = 3,
+                 on_registry_failing: Optional[Callable[[], None]] = None,
+                 rng: Optional[random.Random] = None):
+        self.interval = interval
+        self.jitter = min(jitter, interval / 2)
+        self.max_concurrency = max(1, max_concurrency)
+        self.request_timeout = request_timeout
+        self.failure_threshold = failure_threshold
+        self.on_registry_failing = on_registry_failing
+        self.registration_api_url: Optional[str] = None
+        self.consecutive_failures = 0
+        self._failing_reported_at: Optional[float] = None
+        self._rng = rng or random.Random()
+        self._wheel = TimerWheel(tick, interval)
+        self._nodes: Dict[str, RegisteredNode] = {}
+        self._in_flight: Set[asyncio.Task] = set()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._runner: Optional[asyncio.Task] = None
+        self.max_lateness = 0.0
+
+    # --- Lifecycle (event loop) ---
+
+    def start(self):
+        if self._runner is not None and not self._runner.done():
+            return
+        limits = httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency)
+        self._client = httpx.AsyncClient(limits=limits, timeout=self.request_timeout)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._runner = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        runner, self._runner = self._runner, None
+        if runner is not None:
+            runner.cancel()
+        for task in list(self._in_flight):
+            task.cancel()
+        await asyncio.gather(*(t for t in [runner, *self._in_flight] if t is not None), return_exceptions=True)
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    # --- Nodes ---
+
+    def nodes(self) -> List[RegisteredNode]:
+        return list(self._nodes.values())
+
+    def get(self, node_id: str) -> Optional[RegisteredNode]:
+        return self._nodes.get(node_id)
+
+    async def register(self, node: RegisteredNode) -> RegisteredNode:
+        """Registers a node and its sub-resources, then keeps it alive. Raises httpx.HTTPError on failure."""
+        if not self.registration_api_url or self._client is None:
+            raise RuntimeError("Heartbeat scheduler is not started or has no Registration API")
+        self._nodes[node.node_id] = node
+        try:
+            await self._register_resources(node)
+        except Exception:
+            del self._nodes[node.node_id]
+            raise
+        self._schedule(node, self._rng.uniform(self._wheel.tick, self.interval))
+        return node
+
+    async def unregister(self, node_id: str) -> bool:
+        node = self._nodes.pop(node_id, None)
+        if node is None:
+            return False
+        self._wheel.cancel(node_id)
+        if node.registered and self.registration_api_url and self._client is not None:
+            # Sub-resources first, so nothing is left referencing a deleted node
+            for res_type, resource in reversed(list(node.resources_in_order())):
+                try:
+                    response = await self._client.delete(f"{self.registration_api_url}/resource/{res_type}s/{resource['id']}")
+                    if response.status_code not in (204, 404):
+                        logger.warning(f"Deleting {res_type} {resource['id']} returned {response.status_code}")
+                except httpx.HTTPError as e:
+                    logger.warning(f"Deleting {res_type} {resource['id']} failed: {e}; the registry will expire it.")
+        return True
+
+    def move_to(self, registration_api_url: str):
+        """Switches to another Registration API; every node is re-registered there, spread over one interval."""
+        self.registration_api_url = registration_api_url.rstrip('/')
+        self.consecutive_failures = 0
+        self._failing_reported_at = None
+        for node in self._nodes.values():
+            node.registered = False
+            self._schedule(node, self._rng.uniform(self._wheel.tick, self.interval))
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "registration_api_url": self.registration_api_url,
+            "nodes": len(self._nodes),
+            "scheduled": len(self._wheel),
+            "in_flight": len(self._in_flight),
+            "consecutive_failures": self.consecutive_failures,
+            "max_lateness_ms": round(self.max_lateness * 1000, 3),
+        }
+
+    # --- Internals ---
+
+    def _schedule(self, node: RegisteredNode, delay: float):
+        node.due_at = time.monotonic() + delay
+        self._wheel.schedule(node.node_id, delay)
+
+    async def _register_resources(self, node: RegisteredNode):
+        for res_type, resource in node.resources_in_order():
+            response = await self._client.post(f"{self.registration_api_url}/resource",
+                                               json={"type": res_type, "data": resource})
+            response.raise_for_status()
+        node.registered = True
+        node.registrations += 1
+        node.last_error = None
+        metrics.NODE_REGISTRATIONS.labels("initial" if node.registrations == 1 else "reregister").inc()
+        logger.info(f"Registered node {node.node_id} ({node.label}) with "
+                    f"{sum(len(r) for r in node.sub_resources.values())} sub-resources at {self.registration_api_url}")
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time() + self._wheel.tick
+        while True:
+            await asyncio.sleep(max(0.0, next_tick - loop.time()))
+            now = loop.time()
+            # If the loop was held up, catch up on every tick that has passed
+            while next_tick <= now:
+                for node_id in self._wheel.advance():
+                    node = self._nodes.get(node_id)
+                    if node is not None:
+                        task = loop.create_task(self._beat(node))
+                        self._in_flight.add(task)
+                        task.add_done_callback(self._in_flight.discard)
+                next_tick += self._wheel.tick
+
+    async def _beat(self, node: RegisteredNode):
+        if node.due_at is not None:
+            lateness = max(0.0, time.monotonic() - node.due_at)
+            self.max_lateness = max(self.max_lateness, lateness)
+        async with self._semaphore:
+            registration_api_url = self.registration_api_url
+            outcome = await (self._heartbeat(node) if node.registered else self._reregister(node))
+        if node.node_id in self._nodes:
+            self._schedule(node, self.interval - self._rng.uniform(0.0, self.jitter))
+        if registration_api_url == self.registration_api_url:
+            self._record_outcome(outcome)
+
+    async def _heartbeat(self, node: RegisteredNode) -> str:
+        started = time.perf_counter()
+        try:
+            response = await self._client.post(f"{self.registration_api_url}/health/nodes/{node.node_id}")
+        except httpx.HTTPError as e:
+            metrics.HEARTBEAT_FAILURES.labels("request_error").inc()
+            node.failures += 1
+            node.last_error = str(e)
+            logger.error(f"Heartbeat for node {node.node_id} failed: {e}")
+            return OUTCOME_UNREACHABLE
+        metrics.HEARTBEAT_RTT_SECONDS.observe(time.perf_counter() - started)
+        if response.status_code == 200:
+            node.heartbeats += 1
+            node.last_heartbeat_at = time.time()
+            return OUTCOME_OK
+        metrics.HEARTBEAT_FAILURES.labels(f"http_{response.status_code}").inc()
+        node.failures += 1
+        node.last_error = f"HTTP {response.status_code}"
+        if response.status_code == 404:
+            logger.warning(f"Node {node.node_id} not found during heartbeat (404). Re-registering.")
+            node.registered = False
+            return await self._reregister(node)
+        logger.warning(f"Heartbeat for node {node.node_id} failed with status {response.status_code}: {response.text[:200]}")
+        return OUTCOME_UNREACHABLE if response.status_code >= 500 else OUTCOME_REJECTED
+
+    async def _reregister(self, node: RegisteredNode) -> str:
+        # The registry holds new versions only; bump them so the re-registration is not taken as stale
+        version = nmos_version()
+        for _, resource in node.resources_in_order():
+            resource["version"] = version
+        try:
+            await self._register_resources(node)
+            return OUTCOME_OK
+        except httpx.HTTPError as e:
+            node.failures += 1
+            node.last_error = str(e)
+            logger.error(f"Re-registration of node {node.node_id} failed: {e}; retrying at its next heartbeat.")
+            if isinstance(e, httpx.HTTPStatusError) and e.response.status_code < 500:
+                return OUTCOME_REJECTED
+            return OUTCOME_UNREACHABLE
+
+    def _record_outcome(self, outcome: str):
+        if outcome != OUTCOME_UNREACHABLE:
+            # The registry answered; a node it refused is that node's problem, not a reason to fail over
+            self.consecutive_failures = 0
+            self._failing_reported_at = None
+            return
+        self.consecutive_failures += 1
+        if self.consecutive_failures < self.failure_threshold or not self.on_registry_failing:
+            return
+        now = time.monotonic()
+        # Hundreds of nodes fail together; report the streak once, and again only an interval later
+        # if it goes on (no other registry could take over the first time)
+        if self._failing_reported_at is None or now - self._failing_reported_at >= self.interval:
+            self._failing_reported_at = now
+            try:
+                self.on_registry_failing()
+            except Exception as e:
+                logger.error(f"Registry failure handler failed: {e}", exc_info=True)
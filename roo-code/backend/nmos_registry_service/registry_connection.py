@@ -0,0 +1,141 @@
+"""
+Connection to one IS-04 registry.
+
+A ``RegistryConnection`` owns everything that is per registry: the Query API
+subscriptions (with jittered reconnect backoff), its own grain ingest
+pipeline and its own resync coordinator. The subscriptions are run by a
+``SubscriptionManager`` on the event loop, which creates each one with
+``POST /subscriptions`` and follows its ``ws_href``: one unfiltered
+subscription to ``/`` without a subscription configuration, one filtered
+subscription per type with one. Changes are not applied to
+the cache directly but handed to ``apply_changes`` tagged with the
+registry's Query API URL, so that a ``RegistryFederation`` can merge several
+registries into one cache.
+"""
+
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import ingest_pipeline
+import metrics
+import resource_store
+import resync
+import subscription_manager
+
+logger = logging.getLogger(__name__)
+
+
+def registration_api_url_for(query_api_url: str) -> str:
+    """Derives the Registration API base URL served next to a Query API."""
+    if "/x-nmos/query/" in query_api_url:
+        return query_api_url.replace("/x-nmos/query/", "/x-nmos/registration/")
+    return f"{query_api_url.rstrip('/')}/x-nmos/registration/v1.3"
+
+
+def check_query_api_url(query_api_url: str):
+    if not query_api_url.startswith(("http://", "https://")):
+        raise ValueError(f"Registry URL '{query_api_url}' must start with http:// or https://")
+
+
+class RegistryConnection:
+    def __init__(self,
+                 query_api_url: str,
+                 parse_frame: Callable[[str], ingest_pipeline.ParsedFrame],
+                 apply_changes: Callable[[List[resource_store.StoreChange], str], List[Optional[str]]],
+                 resync_fn: Callable[["RegistryConnection", str], Awaitable[Dict[str, Any]]],
+                 pipeline_options: Optional[Dict[str, Any]] = None,
+                 backoff: Optional[resync.Backoff] = None,
+                 on_connection_lost: Optional[Callable[["RegistryConnection"], None]] = None,
+                 subscriptions: Optional[List[subscription_manager.SubscriptionSpec]] = None):
+        self.query_api_url = query_api_url.rstrip('/')
+        check_query_api_url(self.query_api_url)
+        self.registration_api_url = registration_api_url_for(self.query_api_url)
+        self.subscriptions = list(subscriptions) if subscriptions else None
+        self.pipeline = ingest_pipeline.GrainIngestPipeline(
+            parse_frame, lambda changes: apply_changes(changes, self.query_api_url),
+            on_overflow=lambda: self.resync_coordinator.request("ingest_overflow"),
+            observe_grain_latency=metrics.GRAIN_TO_APPLY_SECONDS.observe,
+            **(pipeline_options or {}))
+        self.resync_coordinator = resync.ResyncCoordinator(lambda reason: resync_fn(self, reason))
+        self.backoff = backoff or resync.Backoff()
+        self.on_connection_lost = on_connection_lost
+        self.subscription_manager = subscription_manager.SubscriptionManager(
+            self.query_api_url, self.subscriptions or [subscription_manager.ALL_RESOURCES], self._submit_frame,
+            on_open=self._on_subscription_open, on_lost=self._on_subscription_lost,
+            backoff_factory=lambda: resync.Backoff(self.backoff.initial, self.backoff.maximum, self.backoff.multiplier))
+        self._stopped = True
+        self.connected_since: Optional[float] = None
+        self.last_message_at: Optional[float] = None
+        self.disconnects = 0
+
+    @property
+    def resource_filters(self) -> Optional[Dict[str, Dict[str, str]]]:
+        """Per-type query filters to discover with, or None for every type unfiltered."""
+        if not self.subscriptions:
+            return None
+        return {spec.resource_type: spec.params for spec in self.subscriptions}
+
+    # --- Lifecycle ---
+
+    def bind_loop(self, loop):
+        self.resync_coordinator.bind_loop(loop)
+        self.subscription_manager.bind_loop(loop)
+
+    def start(self):
+        self.pipeline.start()
+        self._stopped = False
+        self.subscription_manager.start()
+
+    def stop(self):
+        self._stopped = True
+        logger.info(f"Closing subscriptions to {self.query_api_url}")
+        self.subscription_manager.stop()
+        self.connected_since = None
+        self.pipeline.stop()
+
+    @property
+    def connected(self) -> bool:
+        return self.subscription_manager.connected
+
+    @property
+    def consecutive_failures(self) -> int:
+        """Reconnect attempts since the subscription was last open."""
+        return self.subscription_manager.consecutive_failures
+
+    # --- SubscriptionManager callbacks (event loop) ---
+
+    async def _submit_frame(self, message: str):
+        self.last_message_at = time.time()
+        await self.pipeline.submit_async(message)
+
+    def _on_subscription_open(self, spec: subscription_manager.SubscriptionSpec, reconnected: bool):
+        if self.subscription_manager.connected:
+            self.connected_since = time.time()
+        if reconnected:
+            # 先订阅再对账: 对账期间到达的 grain 与对账结果按版本号合并，缓存在对账期间继续提供服务
+            # Only this subscription had a gap, but a resync walks every subscribed type anyway
+            self.resync_coordinator.request("websocket_reconnect")
+
+    def _on_subscription_lost(self, spec: subscription_manager.SubscriptionSpec):
+        self.connected_since = None
+        if self._stopped:
+            return
+        self.disconnects += 1
+        metrics.WEBSOCKET_RECONNECTS.labels(self.query_api_url).inc()
+        if self.on_connection_lost:
+            self.on_connection_lost(self)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "query_api_url": self.query_api_url,
+            "registration_api_url": self.registration_api_url,
+            "connected": self.connected,
+            "connected_since": self.connected_since,
+            "last_message_at": self.last_message_at,
+            "disconnects": self.disconnects,
+            "consecutive_failures": self.consecutive_failures,
+            "resync_running": self.resync_coordinator.running,
+            "ingest_queue_depth": self.pipeline.queue_depth,
+            "subscriptions": self.subscription_manager.status(),
+        }
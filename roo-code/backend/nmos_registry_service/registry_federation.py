@@ -0,0 +1,161 @@
+"""
+Federation of several IS-04 registries into one resource cache.
+
+Redundant registries report the same resources and isolated plant segments
+report disjoint ones; either way every registry gets its own
+``RegistryConnection`` and all of them write into the single shared store,
+so memory scales with the number of unique resources.
+
+Merging rules:
+
+* Updates use per-resource version precedence: whichever registry delivers
+  the newest version wins, and the store records that registry as the
+  resource's origin. An equal version from another registry is a no-op.
+* A deletion only takes effect when it comes from the resource's origin, or
+  when the origin registry is currently disconnected (it cannot speak for
+  its resources then). This keeps one redundant registry that has not yet
+  seen a resource from deleting it while another still reports it.
+
+One registry is the primary: the service registers its own node there, and
+it is the registry reported by ``/health``. When the primary stops
+answering (see ``fail_over``), the first connected registry in configuration
+order takes over.
+"""
+
+import asyncio
+import logging
+import threading
+from typing import Callable, Dict, List, Optional
+
+import registry_connection
+import resource_store
+
+logger = logging.getLogger(__name__)
+
+
+class RegistryFederation:
+    def __init__(self, store: resource_store.ResourceStore,
+                 connection_factory: Callable[[str], registry_connection.RegistryConnection]):
+        self.store = store
+        self.connection_factory = connection_factory
+        # Insertion order is the failover preference order
+        self._connections: Dict[str, registry_connection.RegistryConnection] = {}
+        self.primary_url: Optional[str] = None
+        self._apply_lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def bind_loop(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        for connection in self._connections.values():
+            connection.bind_loop(loop)
+
+    # --- Membership ---
+
+    @property
+    def urls(self) -> List[str]:
+        return list(self._connections)
+
+    def connections(self) -> List[registry_connection.RegistryConnection]:
+        return list(self._connections.values())
+
+    def get(self, query_api_url: str) -> Optional[registry_connection.RegistryConnection]:
+        return self._connections.get(query_api_url.rstrip('/'))
+
+    @property
+    def primary(self) -> Optional[registry_connection.RegistryConnection]:
+        return self._connections.get(self.primary_url) if self.primary_url else None
+
+    def add(self, query_api_url: str, primary: bool = False) -> registry_connection.RegistryConnection:
+        """Adds a registry (not yet started). Returns the existing connection if already present."""
+        query_api_url = query_api_url.rstrip('/')
+        connection = self._connections.get(query_api_url)
+        if connection is None:
+            connection = self.connection_factory(query_api_url)
+            if self._loop is not None:
+                connection.bind_loop(self._loop)
+            self._connections[query_api_url] = connection
+            logger.info(f"Registry {query_api_url} added to the federation ({len(self._connections)} registries).")
+        if primary or self.primary_url is None:
+            self.primary_url = query_api_url
+        return connection
+
+    def remove(self, query_api_url: str) -> int:
+        """
+        Stops and removes a registry and deletes the resources it supplied.
+        Other registries that also hold them re-add them on their next resync.
+        Returns the number of resources deleted.
+        """
+        query_api_url = query_api_url.rstrip('/')
+        connection = self._connections.pop(query_api_url, None)
+        if connection is None:
+            return 0
+        connection.stop()
+        owned = self.store.ids_with_origin(query_api_url)
+        deleted = self.apply_changes(
+            [resource_store.StoreChange(resource_store.OP_DELETE, resource_id) for _, resource_id in owned],
+            query_api_url)
+        if self.primary_url == query_api_url:
+            self.primary_url = next(iter(self._connections), None)
+        logger.info(f"Registry {query_api_url} removed; deleted {sum(1 for outcome in deleted if outcome)} resources it supplied.")
+        return sum(1 for outcome in deleted if outcome)
+
+    def stop_all(self):
+        """Stops every connection but keeps the membership (service shutdown)."""
+        for connection in self._connections.values():
+            connection.stop()
+
+    def remove_all(self):
+        for query_api_url in list(self._connections):
+            connection = self._connections.pop(query_api_url)
+            connection.stop()
+        self.primary_url = None
+
+    # --- Merging ---
+
+    def apply_changes(self, changes: List[resource_store.StoreChange], origin: str) -> List[Optional[str]]:
+        """Applies changes from ``origin`` under the merging rules. Returns per-change outcomes."""
+        with self._apply_lock:
+            admitted: List[resource_store.StoreChange] = []
+            positions: List[int] = []
+            for position, change in enumerate(changes):
+                if change.operation == resource_store.OP_DELETE:
+                    owner = self.store.origin_of(change.resource_id)
+                    if owner is not None and owner != origin:
+                        owner_connection = self._connections.get(owner)
+                        if owner_connection is not None and owner_connection.connected:
+                            logger.debug(f"Ignoring deletion of {change.resource_id} from {origin}: still supplied by {owner}")
+                            continue
+                admitted.append(change._replace(origin=origin))
+                positions.append(position)
+            outcomes: List[Optional[str]] = [None] * len(changes)
+            for position, outcome in zip(positions, self.store.apply(admitted) if admitted else []):
+                outcomes[position] = outcome
+            return outcomes
+
+    def deletable_ids(self, origin: str, resource_ids: List[str]) -> List[str]:
+        """
+        Of the cached ids a registry no longer lists, those it may delete: ones it
+        supplied, plus unowned ones when it is the only registry (with several,
+        an unowned resource may belong to another segment).
+        """
+        sole_registry = len(self._connections) <= 1
+        return [resource_id for resource_id in resource_ids
+                if self.store.origin_of(resource_id) == origin
+                or (sole_registry and self.store.origin_of(resource_id) is None)]
+
+    # --- Failover ---
+
+    def fail_over(self, reason: str) -> Optional[str]:
+        """
+        Makes the first connected registry other than the current primary the
+        primary. Returns its URL, or None if no other registry is connected.
+        """
+        failed = self.primary_url
+        candidate = next((url for url, connection in self._connections.items()
+                          if url != failed and connection.connected), None)
+        if candidate is None:
+            logger.warning(f"Primary registry {failed} is failing ({reason}) but no other registry is connected; keeping it.")
+            return None
+        self.primary_url = candidate
+        logger.warning(f"Primary registry failed over from {failed} to {candidate} ({reason}).")
+        return candidate
@@ -0,0 +1,222 @@
+"""
+Streaming export of the cached inventory.
+
+``/resources`` answers with one JSON document, so the whole body exists in
+memory before the first byte leaves and a client has to hold it all before
+it can parse anything. The export streams instead: records are generated one
+at a time from a single store snapshot (so the export is consistent even
+while ingest carries on), batched into chunks of ``CHUNK_BYTES`` and
+optionally compressed chunk by chunk.
+
+A stream is a sequence of records in the negotiated format:
+
+* ``application/x-ndjson`` - one JSON object per line (the default);
+* ``application/msgpack`` - concatenated MessagePack maps (``msgpack``);
+* ``application/cbor-seq`` - a CBOR sequence, RFC 8742 (``cbor2``).
+
+The first record is ``{"export": "nmos-registry", "generation", "epoch",
+"types"}``, then one ``{"type": <resource type>, "resource": {...}}`` per
+resource, and last ``{"end": true, "count": <resources>}`` so a client can
+tell a complete stream from a truncated one. Bodies can be compressed with
+``zstd`` (``zstandard``) or ``gzip``, chosen from ``Accept-Encoding``.
+
+The binary encoders and zstd are optional: when their package is missing
+they are simply not offered.
+"""
+
+import json
+import zlib
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import resource_query
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+NDJSON = "application/x-ndjson"
+MSGPACK = "application/msgpack"
+CBOR_SEQUENCE = "application/cbor-seq"
+
+# Short names accepted in the `format` query parameter, and other media types clients send for them
+FORMAT_NAMES = {"ndjson": NDJSON, "msgpack": MSGPACK, "cbor": CBOR_SEQUENCE}
+MEDIA_TYPE_ALIASES = {"application/x-msgpack": MSGPACK, "application/vnd.msgpack": MSGPACK,
+                      "application/cbor": CBOR_SEQUENCE, "application/jsonl": NDJSON}
+
+CHUNK_BYTES = 64 * 1024
+
+
+class NotAcceptable(ValueError):
+    """No format the client accepts can be produced."""
+
+
+def available_formats() -> List[str]:
+    formats = [NDJSON]
+    if msgpack is not None:
+        formats.append(MSGPACK)
+    if cbor2 is not None:
+        formats.append(CBOR_SEQUENCE)
+    return formats
+
+
+def available_encodings() -> List[str]:
+    return (["zstd"] if zstandard is not None else []) + ["gzip"]
+
+
+def _weighted(header: str) -> List[Tuple[str, float]]:
+    """``"a;q=0.5, b"`` -> ``[("b", 1.0), ("a", 0.5)]``, highest preference first (stable)."""
+    choices = []
+    for position, part in enumerate(header.split(",")):
+        name, _, parameters = part.strip().partition(";")
+        quality = 1.0
+        for parameter in parameters.split(";"):
+            key, _, value = parameter.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name:
+            choices.append((name.strip().lower(), quality, position))
+    choices.sort(key=lambda choice: (-choice[1], choice[2]))
+    return [(name, quality) for name, quality, _ in choices]
+
+
+def negotiate_format(accept: Optional[str], requested: Optional[str] = None) -> str:
+    """
+    Media type of the export: ``requested`` (a name from FORMAT_NAMES) if
+    given, else the most preferred available type in ``Accept``.
+    """
+    formats = available_formats()
+    if requested:
+        media_type = FORMAT_NAMES.get(requested.lower())
+        if media_type is None:
+            raise NotAcceptable(f"unknown export format '{requested}', expected one of {sorted(FORMAT_NAMES)}")
+        if media_type not in formats:
+            raise NotAcceptable(f"export format '{requested}' is not available on this server")
+        return media_type
+    if not accept:
+        return NDJSON
+    for name, quality in _weighted(accept):
+        if quality <= 0:
+            continue
+        if name in ("*/*", "application/*"):
+            return NDJSON
+        media_type = MEDIA_TYPE_ALIASES.get(name, name)
+        if media_type in formats:
+            return media_type
+    raise NotAcceptable(f"none of the accepted types can be produced; available: {formats}")
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Content coding for the body, or None for identity. zstd wins over gzip at equal preference."""
+    if not accept_encoding:
+        return None
+    offered = available_encodings()
+    acceptable = {name: quality for name, quality in _weighted(accept_encoding)}
+    wildcard = acceptable.get("*", 0.0)
+    best, best_quality = None, 0.0
+    for encoding in offered:
+        quality = acceptable.get(encoding, wildcard)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+# --- Records ---
+
+def _json_records(snapshot, resource_types: List[str], query: Optional[resource_query.ResourceQuery],
+                  header: Dict[str, Any]) -> Iterator[bytes]:
+    yield json.dumps(header, separators=(",", ":")).encode("utf-8") + b"\n"
+    count = 0
+    for resource_type in resource_types:
+        prefix = b'{"type":' + json.dumps(resource_type).encode("utf-8") + b',"resource":'
+        if query is None or query.empty:
+            # Compact stores hand out their stored JSON, so nothing is decoded or re-encoded
+            for _, blob in snapshot.json_items(resource_type):
+                count += 1
+                yield prefix + blob + b"}\n"
+        else:
+            for resource in query.iter_select(snapshot, resource_type):
+                count += 1
+                yield prefix + json.dumps(resource, separators=(",", ":")).encode("utf-8") + b"}\n"
+    yield b'{"end":true,"count":%d}\n' % count
+
+
+def _object_records(snapshot, resource_types: List[str], query: Optional[resource_query.ResourceQuery],
+                    header: Dict[str, Any], encode: Callable[[Any], bytes]) -> Iterator[bytes]:
+    yield encode(header)
+    count = 0
+    for resource_type in resource_types:
+        resources = snapshot.values(resource_type) if query is None or query.empty else query.iter_select(snapshot, resource_type)
+        for resource in resources:
+            count += 1
+            yield encode({"type": resource_type, "resource": resource})
+    yield encode({"end": True, "count": count})
+
+
+def export_records(snapshot, resource_types: Iterable[str], media_type: str, epoch: str,
+                   query: Optional[resource_query.ResourceQuery] = None) -> Iterator[bytes]:
+    """Encoded records of one export, one ``bytes`` per record."""
+    resource_types = [resource_type for resource_type in resource_types if resource_type in snapshot.resources]
+    header = {"export": "nmos-registry", "generation": snapshot.generation, "epoch": epoch, "types": resource_types}
+    if media_type == NDJSON:
+        return _json_records(snapshot, resource_types, query, header)
+    if media_type == MSGPACK:
+        packer = msgpack.Packer()
+        return _object_records(snapshot, resource_types, query, header, packer.pack)
+    if media_type == CBOR_SEQUENCE:
+        return _object_records(snapshot, resource_types, query, header, cbor2.dumps)
+    raise NotAcceptable(f"unsupported export format {media_type}")
+
+
+# --- Chunking and compression ---
+
+def chunked(records: Iterable[bytes], chunk_bytes: int = CHUNK_BYTES) -> Iterator[bytes]:
+    """Joins small records into chunks of about ``chunk_bytes``."""
+    parts: List[bytes] = []
+    size = 0
+    for record in records:
+        parts.append(record)
+        size += len(record)
+        if size >= chunk_bytes:
+            yield b"".join(parts)
+            parts, size = [], 0
+    if parts:
+        yield b"".join(parts)
+
+
+def compressed(chunks: Iterable[bytes], encoding: Optional[str], level: Optional[int] = None) -> Iterator[bytes]:
+    """Compresses a stream chunk by chunk; each yielded piece can be sent as it comes."""
+    if encoding is None:
+        yield from chunks
+        return
+    if encoding == "gzip":
+        compressor = zlib.compressobj(6 if level is None else level, zlib.DEFLATED, 31)
+        finish = compressor.flush
+    elif encoding == "zstd":
+        compressor = zstandard.ZstdCompressor(level=3 if level is None else level).compressobj()
+        finish = compressor.flush
+    else:
+        raise ValueError(f"unsupported content coding {encoding}")
+    for chunk in chunks:
+        piece = compressor.compress(chunk)
+        if piece:
+            yield piece
+    yield finish()
+
+
+def export_stream(snapshot, resource_types: Iterable[str], media_type: str, epoch: str,
+                  query: Optional[resource_query.ResourceQuery] = None,
+                  encoding: Optional[str] = None) -> Iterator[bytes]:
+    """The response body of an export: records, chunked, then compressed if ``encoding`` is set."""
+    return compressed(chunked(export_records(snapshot, resource_types, media_type, epoch, query)), encoding)
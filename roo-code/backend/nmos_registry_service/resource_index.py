@@ -0,0 +1,120 @@
+"""
+Secondary indexes over the cached NMOS resources.
+
+Maps ``(resource_type, field) -> value -> {resource_id}`` for the reference
+fields clients filter on, so questions such as "all receivers of device X" or
+"which receivers are subscribed to sender S" are answered in O(result)
+instead of scanning the whole inventory.
+
+An index is immutable once published with a store snapshot. Writers derive
+the next index through an ``IndexTransaction``, which copies only the
+postings maps it touches and replaces buckets instead of mutating them, so
+readers holding an older snapshot never see a half-applied change.
+"""
+
+from typing import Any, Dict, FrozenSet, Iterator, Optional, Set, Tuple
+
+# Query parameter name -> path into the resource body
+INDEXED_FIELDS: Dict[str, Tuple[str, ...]] = {
+    "device_id": ("device_id",),
+    "node_id": ("node_id",),
+    "flow_id": ("flow_id",),
+    "source_id": ("source_id",),
+    "subscription.sender_id": ("subscription", "sender_id"),
+}
+
+_EMPTY: FrozenSet[str] = frozenset()
+
+PostingsKey = Tuple[str, str]
+
+
+def extract_field(resource: Any, path: Tuple[str, ...]) -> Optional[str]:
+    """``resource`` is a resource dict or anything with a dict-like ``get`` (compact records)."""
+    value: Any = resource
+    for key in path:
+        if not isinstance(value, dict) and not hasattr(value, "get"):
+            return None
+        value = value.get(key)
+    return value if isinstance(value, str) else None
+
+
+class ResourceIndex:
+    def __init__(self, postings: Optional[Dict[PostingsKey, Dict[str, FrozenSet[str]]]] = None):
+        self._postings = postings if postings is not None else {}
+
+    def lookup(self, resource_type: str, field: str, value: str) -> FrozenSet[str]:
+        return self._postings.get((resource_type, field), {}).get(value, _EMPTY)
+
+    def lookup_prefix(self, resource_type: str, field: str, prefix: str) -> Set[str]:
+        """Ids whose ``field`` starts with ``prefix``; costs O(distinct values), not O(resources)."""
+        found: Set[str] = set()
+        for value, ids in self._postings.get((resource_type, field), {}).items():
+            if value.startswith(prefix):
+                found |= ids
+        return found
+
+    def lookup_all(self, resource_type: str, filters: Dict[str, str]) -> Set[str]:
+        """Intersects the postings of several filters, starting from the smallest."""
+        buckets = sorted((self.lookup(resource_type, field, value) for field, value in filters.items()), key=len)
+        if not buckets:
+            return set()
+        result = set(buckets[0])
+        for bucket in buckets[1:]:
+            if not result:
+                break
+            result &= bucket
+        return result
+
+    def items(self) -> Iterator[Tuple[PostingsKey, Dict[str, FrozenSet[str]]]]:
+        """``((resource_type, field), {value: ids})`` for every postings map."""
+        return iter(self._postings.items())
+
+    def begin(self) -> "IndexTransaction":
+        return IndexTransaction(self._postings)
+
+
+class IndexTransaction:
+    """
+    Collects index changes for one store batch. Touched buckets are edited as
+    plain sets and frozen on commit, so a batch costs O(changes) however many
+    resources share a bucket.
+    """
+
+    def __init__(self, postings: Dict[PostingsKey, Dict[str, FrozenSet[str]]]):
+        self._postings = postings
+        self._dirty: Dict[Tuple[PostingsKey, str], Set[str]] = {}
+
+    def _bucket(self, key: PostingsKey, value: str) -> Set[str]:
+        bucket = self._dirty.get((key, value))
+        if bucket is None:
+            bucket = set(self._postings.get(key, {}).get(value, _EMPTY))
+            self._dirty[(key, value)] = bucket
+        return bucket
+
+    def add(self, resource_type: str, resource_id: str, resource: Dict[str, Any]):
+        for field, path in INDEXED_FIELDS.items():
+            value = extract_field(resource, path)
+            if value is not None:
+                self._bucket((resource_type, field), value).add(resource_id)
+
+    def remove(self, resource_type: str, resource_id: str, resource: Dict[str, Any]):
+        """``resource`` is the body that was indexed, used to find the postings to drop."""
+        for field, path in INDEXED_FIELDS.items():
+            value = extract_field(resource, path)
+            if value is not None:
+                self._bucket((resource_type, field), value).discard(resource_id)
+
+    def commit(self) -> ResourceIndex:
+        if not self._dirty:
+            return ResourceIndex(self._postings)
+        postings = dict(self._postings)
+        copied: Set[PostingsKey] = set()
+        for (key, value), bucket in self._dirty.items():
+            if key not in copied:
+                postings[key] = dict(postings.get(key, {}))
+                copied.add(key)
+            if bucket:
+                postings[key][value] = frozenset(bucket)
+            else:
+                postings[key].pop(value, None)
+        return ResourceIndex(postings)
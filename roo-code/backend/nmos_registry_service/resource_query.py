@@ -0,0 +1,299 @@
+"""
+Field projection and filter expressions for the ``/resources`` endpoints.
+
+``fields=id,label,subscription.sender_id`` keeps only the listed (dotted)
+paths of each resource; paths a resource does not have are left out.
+
+``filter=`` takes clauses joined by ``and`` (or ``;``)::
+
+    device_id=3f1c...                     equality
+    label!="Camera 1"                     inequality (also true if the field is absent)
+    label^=Cam                            string prefix
+    format in (urn:x-nmos:format:video, urn:x-nmos:format:audio)
+    tags.location=studio-a                tag match: on a list, = means "contains"
+    subscription.sender_id=null           null / absent; true and false are literals too
+    destination_port=5004                 compared with a number field, a value is read as a number
+
+Values are bare words or double-quoted strings (``\\"`` escapes a quote).
+A filter is compiled once into per-clause predicates. Equality, ``in`` and
+prefix clauses on ``id`` or on an indexed reference field
+(``resource_index.INDEXED_FIELDS``) are answered from the store's
+secondary indexes, smallest candidate set first; only the remaining clauses
+are evaluated, and only against those candidates.
+"""
+
+import json
+import re
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+import resource_index
+
+_TOKEN = re.compile(r'\s*(?:(?P<string>"(?:[^"\\]|\\.)*")|(?P<op>!=|\^=|=|\(|\)|,|;|&&)|(?P<word>[^\s=!^(),;"]+))')
+_PATH = re.compile(r"^[A-Za-z_][A-Za-z0-9_\-]*(\.[A-Za-z_][A-Za-z0-9_\-]*)*$")
+# Path -> query field name of the secondary index over it
+_INDEXED_PATHS: Dict[Tuple[str, ...], str] = {path: field for field, path in resource_index.INDEXED_FIELDS.items()}
+_MISSING = object()
+
+
+class QueryError(ValueError):
+    """Raised for malformed ``fields`` or ``filter`` parameters."""
+
+
+def _parse_path(text: str) -> Tuple[str, ...]:
+    if not _PATH.match(text):
+        raise QueryError(f"invalid field path '{text}'")
+    return tuple(text.split("."))
+
+
+def _value_at(resource: Any, path: Tuple[str, ...]) -> Any:
+    value = resource
+    for key in path:
+        if not isinstance(value, dict):
+            return _MISSING
+        value = value.get(key, _MISSING)
+        if value is _MISSING:
+            return _MISSING
+    return value
+
+
+# --- Projection ---
+
+def parse_fields(fields: str) -> Dict[str, Any]:
+    """``"id,label,subscription.sender_id"`` -> ``{"id": None, "label": None, "subscription": {"sender_id": None}}``."""
+    tree: Dict[str, Any] = {}
+    for text in fields.split(","):
+        text = text.strip()
+        if not text:
+            continue
+        node = tree
+        path = _parse_path(text)
+        for key in path[:-1]:
+            child = node.get(key, {})
+            if child is None:
+                # The parent is already projected whole
+                break
+            node = node.setdefault(key, child)
+        else:
+            node[path[-1]] = None
+    if not tree:
+        raise QueryError("'fields' names no field")
+    return tree
+
+
+def project(resource: Dict[str, Any], tree: Dict[str, Any]) -> Dict[str, Any]:
+    projected = {}
+    for key, subtree in tree.items():
+        value = resource.get(key, _MISSING)
+        if value is _MISSING:
+            continue
+        if subtree is None:
+            projected[key] = value
+        elif isinstance(value, dict):
+            projected[key] = project(value, subtree)
+    return projected
+
+
+# --- Filter expressions ---
+
+class Clause(NamedTuple):
+    path: Tuple[str, ...]
+    op: str  # "=", "!=", "^=", "in"
+    values: Tuple[Any, ...]
+
+    def describe(self) -> str:
+        rendered = [json.dumps(value) for value in self.values]
+        if self.op == "in":
+            return f"{'.'.join(self.path)} in ({', '.join(rendered)})"
+        return f"{'.'.join(self.path)}{self.op}{rendered[0]}"
+
+
+def _tokens(expression: str) -> Iterator[Tuple[str, str]]:
+    position = 0
+    expression = expression.rstrip()
+    while position < len(expression):
+        match = _TOKEN.match(expression, position)
+        if match is None or match.end() == position:
+            raise QueryError(f"unexpected character at position {position}: '{expression[position:position + 10]}'")
+        position = match.end()
+        kind = match.lastgroup
+        yield kind, match.group(kind)
+
+
+def _literal(kind: str, text: str) -> Any:
+    if kind == "string":
+        return json.loads(text)
+    if text in ("null", "true", "false"):
+        return json.loads(text)
+    return text
+
+
+def parse_filter(expression: str) -> List[Clause]:
+    tokens = list(_tokens(expression))
+    clauses: List[Clause] = []
+    position = 0
+
+    def take() -> Tuple[str, str]:
+        nonlocal position
+        if position >= len(tokens):
+            raise QueryError("unexpected end of filter expression")
+        position += 1
+        return tokens[position - 1]
+
+    while True:
+        kind, text = take()
+        if kind != "word":
+            raise QueryError(f"expected a field path, found '{text}'")
+        path = _parse_path(text)
+        kind, op = take()
+        if kind == "word" and op == "in":
+            kind, text = take()
+            if text != "(":
+                raise QueryError(f"expected '(' after 'in', found '{text}'")
+            values = []
+            while True:
+                kind, text = take()
+                if kind not in ("word", "string"):
+                    raise QueryError(f"expected a value in the 'in' list, found '{text}'")
+                values.append(_literal(kind, text))
+                kind, text = take()
+                if text == ")":
+                    break
+                if text != ",":
+                    raise QueryError(f"expected ',' or ')' in the 'in' list, found '{text}'")
+            clauses.append(Clause(path, "in", tuple(values)))
+        elif kind == "op" and op in ("=", "!=", "^="):
+            kind, text = take()
+            if kind not in ("word", "string"):
+                raise QueryError(f"expected a value after '{op}', found '{text}'")
+            value = _literal(kind, text)
+            if op == "^=" and not isinstance(value, str):
+                raise QueryError(f"prefix match needs a string value, not {text}")
+            clauses.append(Clause(path, op, (value,)))
+        else:
+            raise QueryError(f"expected '=', '!=', '^=' or 'in' after '{'.'.join(path)}', found '{op}'")
+        if position == len(tokens):
+            return clauses
+        kind, text = take()
+        if not (text in (";", "&&") or (kind == "word" and text.lower() == "and")):
+            raise QueryError(f"expected 'and' between clauses, found '{text}'")
+
+
+def _equals(actual: Any, expected: Any) -> bool:
+    if actual is _MISSING:
+        return expected is None
+    if isinstance(actual, list):
+        # Tags and other list fields: equality means membership
+        return expected in actual
+    if isinstance(actual, (int, float)) and not isinstance(actual, bool) and isinstance(expected, str):
+        try:
+            return actual == float(expected)
+        except ValueError:
+            return False
+    # bool is an int subclass: keep true distinct from 1
+    return actual == expected and isinstance(actual, bool) == isinstance(expected, bool)
+
+
+def _starts_with(actual: Any, prefix: str) -> bool:
+    if isinstance(actual, str):
+        return actual.startswith(prefix)
+    if isinstance(actual, list):
+        return any(isinstance(item, str) and item.startswith(prefix) for item in actual)
+    return False
+
+
+def _predicate(clause: Clause) -> Callable[[Dict[str, Any]], bool]:
+    path = clause.path
+    if clause.op == "=":
+        expected = clause.values[0]
+        return lambda resource: _equals(_value_at(resource, path), expected)
+    if clause.op == "!=":
+        expected = clause.values[0]
+        return lambda resource: not _equals(_value_at(resource, path), expected)
+    if clause.op == "^=":
+        prefix = clause.values[0]
+        return lambda resource: _starts_with(_value_at(resource, path), prefix)
+    values = clause.values
+    return lambda resource: any(_equals(_value_at(resource, path), value) for value in values)
+
+
+class CompiledFilter:
+    """A parsed filter: index-answerable clauses plus predicates for the rest."""
+
+    def __init__(self, expression: str):
+        self.clauses = parse_filter(expression)
+        # Canonical form, e.g. for cache keys: "device_id=\"x\" and label^=\"Cam\""
+        self.canonical = " and ".join(clause.describe() for clause in self.clauses)
+        self._indexed: List[Clause] = []
+        self._predicates: List[Callable[[Dict[str, Any]], bool]] = []
+        for clause in self.clauses:
+            indexable = (clause.op in ("=", "in", "^=")
+                         and (clause.path == ("id",) or clause.path in _INDEXED_PATHS)
+                         and all(isinstance(value, str) for value in clause.values))
+            if indexable:
+                self._indexed.append(clause)
+            else:
+                self._predicates.append(_predicate(clause))
+
+    @property
+    def uses_index(self) -> bool:
+        return bool(self._indexed)
+
+    def _candidates(self, snapshot, resource_type: str, clause: Clause) -> Set[str]:
+        if clause.path == ("id",):
+            ids = snapshot.resources.get(resource_type, {})
+            if clause.op == "^=":
+                return {resource_id for resource_id in ids if resource_id.startswith(clause.values[0])}
+            return {value for value in clause.values if value in ids}
+        field = _INDEXED_PATHS[clause.path]
+        if clause.op == "^=":
+            return snapshot.index.lookup_prefix(resource_type, field, clause.values[0])
+        found: Set[str] = set()
+        for value in clause.values:
+            found |= snapshot.index.lookup(resource_type, field, value)
+        return found
+
+    def matching(self, snapshot, resource_type: str) -> Iterator[Dict[str, Any]]:
+        """Resources of ``resource_type`` in ``snapshot`` that satisfy every clause."""
+        if self._indexed:
+            candidates: Optional[Set[str]] = None
+            for clause in self._indexed:
+                found = self._candidates(snapshot, resource_type, clause)
+                candidates = found if candidates is None else candidates & found
+                if not candidates:
+                    return
+            resources: Iterator[Dict[str, Any]] = (
+                resource for resource in (snapshot.get(resource_type, resource_id) for resource_id in candidates)
+                if resource is not None)
+        else:
+            resources = snapshot.values(resource_type)
+        predicates = self._predicates
+        for resource in resources:
+            if all(predicate(resource) for predicate in predicates):
+                yield resource
+
+
+class ResourceQuery:
+    """``fields`` and ``filter`` of one request; either may be absent."""
+
+    def __init__(self, fields: Optional[str] = None, filter_expression: Optional[str] = None):
+        self.projection = parse_fields(fields) if fields else None
+        self.filter = CompiledFilter(filter_expression) if filter_expression and filter_expression.strip() else None
+        self.cache_key = "|".join((
+            ",".join(sorted(part.strip() for part in fields.split(",") if part.strip())) if fields else "",
+            self.filter.canonical if self.filter else "",
+        ))
+
+    @property
+    def empty(self) -> bool:
+        return self.projection is None and self.filter is None
+
+    def iter_select(self, snapshot, resource_type: str) -> Iterator[Dict[str, Any]]:
+        """The (projected) resources of one type that pass the filter, one at a time."""
+        resources = self.filter.matching(snapshot, resource_type) if self.filter else snapshot.values(resource_type)
+        if self.projection is None:
+            return resources
+        projection = self.projection
+        return (project(resource, projection) for resource in resources)
+
+    def select(self, snapshot, resource_type: str) -> List[Dict[str, Any]]:
+        return list(self.iter_select(snapshot, resource_type))
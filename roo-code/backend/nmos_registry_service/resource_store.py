@@ -0,0 +1,276 @@
+"""
+Thread-safe, copy-on-write store for the cached NMOS resources.
+
+The grain ingest thread writes while FastAPI coroutines read. Readers
+take ``store.snapshot`` - a single attribute read - and work on an immutable
+view: nothing reachable from a published snapshot is ever mutated again.
+Writers serialise on a lock, apply a whole batch of changes to copies of the
+per-type maps (and index postings) they touch, record the changes in the
+change log and then publish the new snapshot in one assignment. A batch is
+therefore seen either completely or not at all.
+
+In compact mode (``NMOS_COMPACT_STORE=1``) resources are held as
+``CompactResource`` records rather than parsed dicts; snapshot accessors
+hide the difference from readers.
+
+With ``search=True`` the snapshot also carries a ``SearchIndex`` (labels,
+descriptions, tags, ids), maintained in the same batch as the secondary
+indexes.
+
+When resources come from several registries the store also remembers, per
+resource, the registry (origin) that supplied the version it holds. Origins
+are bookkeeping for writers, not part of the snapshot: they are kept in one
+dict updated under the write lock, one reference per resource.
+"""
+
+import json
+import logging
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import change_log
+import compact_resource
+import resource_index
+import search_index
+
+logger = logging.getLogger(__name__)
+
+RESOURCE_TYPES = ["nodes", "devices", "senders", "receivers", "sources", "flows"]
+
+OP_UPDATE = "update"
+OP_DELETE = "delete"
+
+
+class StoreChange(NamedTuple):
+    """One requested mutation. Deletions only need ``resource_id``."""
+    operation: str
+    resource_id: str
+    resource: Optional[Dict[str, Any]] = None
+    # Registry the change came from; None for changes without a registry (the resource becomes unowned)
+    origin: Optional[str] = None
+
+
+def parse_version(version: Any) -> Optional[Tuple[int, int]]:
+    # NMOS IS-04 v1.3 specifies version as "seconds:nanoseconds"
+    if not isinstance(version, str):
+        return None
+    try:
+        seconds, nanoseconds = map(int, version.split(':'))
+    except ValueError:
+        return None
+    return seconds, nanoseconds
+
+
+def is_newer_version(new_resource: Dict[str, Any], old_resource: Dict[str, Any]) -> bool:
+    new_version_str = new_resource.get("version")
+    old_version_str = old_resource.get("version")
+    if not new_version_str or not old_version_str:
+        return True
+    new_version = parse_version(new_version_str)
+    old_version = parse_version(old_version_str)
+    if new_version is None or old_version is None:
+        logger.warning(f"资源 {new_resource.get('id')} 的版本号格式不正确 ('{new_version_str}' 或 '{old_version_str}')，将直接更新。")
+        return True
+    return new_version > old_version
+
+
+class StoreSnapshot:
+    """
+    Immutable view of the cache at one generation. ``resources`` holds the
+    stored records (dicts, or ``CompactResource`` in compact mode); use the
+    accessors below to get plain resource dicts regardless of mode.
+    """
+    __slots__ = ("generation", "resources", "index", "compact", "search")
+
+    def __init__(self, generation: int, resources: Dict[str, Dict[str, Any]],
+                 index: resource_index.ResourceIndex, compact: bool = False,
+                 search: Optional[search_index.SearchIndex] = None):
+        self.generation = generation
+        self.resources = resources
+        self.index = index
+        self.compact = compact
+        # None unless the store maintains a search index
+        self.search = search
+
+    def get(self, resource_type: str, resource_id: str) -> Optional[Dict[str, Any]]:
+        record = self.resources.get(resource_type, {}).get(resource_id)
+        if record is not None and self.compact:
+            return record.to_dict()
+        return record
+
+    def find(self, resource_id: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        for resource_type, resources_dict in self.resources.items():
+            record = resources_dict.get(resource_id)
+            if record is not None:
+                return resource_type, record.to_dict() if self.compact else record
+        return None
+
+    def values(self, resource_type: str) -> Iterator[Dict[str, Any]]:
+        records = self.resources.get(resource_type, {}).values()
+        if self.compact:
+            return (record.to_dict() for record in records)
+        return iter(records)
+
+    def json_array(self, resource_type: str) -> bytes:
+        """Serialises all resources of one type as a JSON array."""
+        records = self.resources.get(resource_type, {}).values()
+        if self.compact:
+            # Compact records already hold their JSON, so nothing is decoded or re-encoded
+            return b"[" + b",".join(record.blob for record in records) + b"]"
+        return json.dumps(list(records), separators=(",", ":")).encode("utf-8")
+
+    def json_items(self, resource_type: str) -> Iterator[Tuple[str, bytes]]:
+        """Yields ``(id, compact JSON)`` for each resource of one type."""
+        records = self.resources.get(resource_type, {}).items()
+        if self.compact:
+            return ((resource_id, record.blob) for resource_id, record in records)
+        return ((resource_id, json.dumps(record, separators=(",", ":")).encode("utf-8")) for resource_id, record in records)
+
+    def counts(self) -> Dict[str, int]:
+        return {resource_type: len(resources_dict) for resource_type, resources_dict in self.resources.items()}
+
+    def total(self) -> int:
+        return sum(len(resources_dict) for resources_dict in self.resources.values())
+
+
+def _empty_resources() -> Dict[str, Dict[str, Dict[str, Any]]]:
+    return {resource_type: {} for resource_type in RESOURCE_TYPES}
+
+
+class ResourceStore:
+    def __init__(self, resource_change_log: change_log.ChangeLog, compact: bool = False, search: bool = False):
+        self.change_log = resource_change_log
+        self.compact = compact
+        self.search = search
+        self._encode = compact_resource.CompactResource if compact else (lambda resource: resource)
+        self._write_lock = threading.Lock()
+        self._origins: Dict[str, str] = {}
+        self._snapshot = StoreSnapshot(resource_change_log.sequence, _empty_resources(),
+                                       resource_index.ResourceIndex(), compact,
+                                       search_index.SearchIndex() if search else None)
+
+    @property
+    def snapshot(self) -> StoreSnapshot:
+        return self._snapshot
+
+    def origin_of(self, resource_id: str) -> Optional[str]:
+        return self._origins.get(resource_id)
+
+    def origins(self) -> Dict[str, str]:
+        """Copy of the resource id -> origin map."""
+        with self._write_lock:
+            return dict(self._origins)
+
+    def ids_with_origin(self, origin: Optional[str]) -> List[Tuple[str, str]]:
+        """``(resource_type, resource_id)`` of every resource supplied by ``origin`` (None: unowned)."""
+        snapshot = self._snapshot
+        origins = self._origins
+        return [(resource_type, resource_id)
+                for resource_type, resources_dict in snapshot.resources.items()
+                for resource_id in resources_dict
+                if origins.get(resource_id) == origin]
+
+    def update(self, resource: Dict[str, Any]) -> Optional[str]:
+        return self.apply([StoreChange(OP_UPDATE, resource["id"], resource)])[0]
+
+    def delete(self, resource_id: str) -> Optional[str]:
+        return self.apply([StoreChange(OP_DELETE, resource_id)])[0]
+
+    def apply(self, changes: Iterable[StoreChange]) -> List[Optional[str]]:
+        """
+        Applies a batch atomically. Returns, per change, the operation that took
+        effect (create / update / delete) or None if it was skipped (stale version,
+        unknown type, deleting an unknown id).
+        """
+        with self._write_lock:
+            current = self._snapshot
+            resources = dict(current.resources)
+            copied_types = set()
+            index_txn = current.index.begin()
+            search_txn = current.search.begin() if current.search is not None else None
+            outcomes: List[Optional[str]] = []
+            applied: List[Tuple[str, str, str, Optional[Dict[str, Any]]]] = []
+
+            def writable(resource_type: str) -> Dict[str, Dict[str, Any]]:
+                if resource_type not in copied_types:
+                    resources[resource_type] = dict(resources[resource_type])
+                    copied_types.add(resource_type)
+                return resources[resource_type]
+
+            for change in changes:
+                if change.operation == OP_UPDATE:
+                    resource = change.resource
+                    resource_type = f"{resource.get('type')}s"
+                    if resource_type not in resources:
+                        logger.warning(f"未知的资源类型复数形式: '{resource_type}' (来自单数 '{resource.get('type')}')")
+                        outcomes.append(None)
+                        continue
+                    existing = resources[resource_type].get(change.resource_id)
+                    if existing is not None and not is_newer_version(resource, existing):
+                        logger.debug(f"接收到的资源 {resource_type}/{change.resource_id} 版本 ('{resource.get('version')}') 不比现有版本 ('{existing.get('version')}') 新，跳过更新。")
+                        outcomes.append(None)
+                        continue
+                    if existing is not None:
+                        index_txn.remove(resource_type, change.resource_id, existing)
+                    writable(resource_type)[change.resource_id] = self._encode(resource)
+                    index_txn.add(resource_type, change.resource_id, resource)
+                    if search_txn is not None:
+                        if existing is not None:
+                            search_txn.replace(resource_type, change.resource_id, existing, resource)
+                        else:
+                            search_txn.add(resource_type, change.resource_id, resource)
+                    if change.origin is not None:
+                        self._origins[change.resource_id] = change.origin
+                    else:
+                        self._origins.pop(change.resource_id, None)
+                    operation = change_log.OP_UPDATE if existing is not None else change_log.OP_CREATE
+                    applied.append((operation, resource_type, change.resource_id, resource))
+                    outcomes.append(operation)
+                else:
+                    resource_type = next((t for t, d in resources.items() if change.resource_id in d), None)
+                    if resource_type is None:
+                        logger.debug(f"尝试删除资源 {change.resource_id}, 但在缓存中未找到。可能已被删除或从未被添加。")
+                        outcomes.append(None)
+                        continue
+                    existing = writable(resource_type).pop(change.resource_id)
+                    index_txn.remove(resource_type, change.resource_id, existing)
+                    if search_txn is not None:
+                        search_txn.remove(resource_type, change.resource_id, existing)
+                    self._origins.pop(change.resource_id, None)
+                    applied.append((change_log.OP_DELETE, resource_type, change.resource_id, None))
+                    outcomes.append(change_log.OP_DELETE)
+
+            if applied:
+                applied_at = time.time()
+                for operation, resource_type, resource_id, resource in applied:
+                    self.change_log.record(operation, resource_type, resource_id, resource, applied_at)
+                self._snapshot = StoreSnapshot(self.change_log.sequence, resources, index_txn.commit(), self.compact,
+                                               search_txn.commit() if search_txn is not None else None)
+            return outcomes
+
+    def replace_all(self, resources_list: Iterable[Dict[str, Any]] = (),
+                    origins: Optional[Dict[str, str]] = None) -> StoreSnapshot:
+        """
+        Swaps in a whole new inventory (or an empty one). Change log clients
+        cannot follow a wholesale replacement and are told to resync.
+        """
+        resources = _empty_resources()
+        index_txn = resource_index.ResourceIndex().begin()
+        search_txn = search_index.SearchIndex().begin() if self.search else None
+        for resource in resources_list:
+            resource_type = f"{resource.get('type')}s"
+            if resource_type not in resources:
+                logger.warning(f"未知资源类型: '{resource.get('type')}' (ID: {resource.get('id')})")
+                continue
+            resources[resource_type][resource["id"]] = self._encode(resource)
+            index_txn.add(resource_type, resource["id"], resource)
+            if search_txn is not None:
+                search_txn.add(resource_type, resource["id"], resource)
+        with self._write_lock:
+            generation = self.change_log.reset()
+            self._snapshot = StoreSnapshot(generation, resources, index_txn.commit(), self.compact,
+                                           search_txn.commit() if search_txn is not None else None)
+            self._origins = {resource_id: origin for resource_id, origin in (origins or {}).items()
+                             if any(resource_id in resources_dict for resources_dict in resources.values())}
+            return self._snapshot
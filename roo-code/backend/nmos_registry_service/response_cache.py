@@ -0,0 +1,61 @@
+"""
+Generation-validated cache of serialized API response bodies.
+
+Serializing the whole inventory is by far the most expensive thing a poll of
+``/resources`` does, yet between two polls the cache usually has not changed.
+Bodies are therefore encoded once and kept together with the store generation
+they were built from; any mutation bumps the generation, which invalidates
+every cached body lazily on its next request. The generation also makes a
+cheap ETag, so an unchanged poll can be answered with ``304 Not Modified``.
+"""
+
+import threading
+from typing import Callable, Dict, NamedTuple
+
+
+class CachedBody(NamedTuple):
+    generation: int
+    etag: str
+    body: bytes
+
+
+class SerializedResponseCache:
+    """
+    ``max_entries`` bounds the number of keys; keys derived from client input
+    (projections, filter expressions) would otherwise grow it without limit.
+    The oldest key is dropped first.
+    """
+
+    def __init__(self, etag_prefix: str, max_entries: int = 256):
+        self.etag_prefix = etag_prefix
+        self.max_entries = max_entries
+        self._bodies: Dict[str, CachedBody] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def etag_for(self, generation: int) -> str:
+        return f'"{self.etag_prefix}-{generation}"'
+
+    def get(self, key: str, generation: int, build: Callable[[], bytes]) -> CachedBody:
+        """``build`` must serialize exactly the store state of ``generation``."""
+        cached = self._bodies.get(key)
+        if cached is not None and cached.generation == generation:
+            self.hits += 1
+            return cached
+        self.misses += 1
+        entry = CachedBody(generation, self.etag_for(generation), build())
+        with self._lock:
+            existing = self._bodies.get(key)
+            if existing is None and len(self._bodies) >= self.max_entries:
+                del self._bodies[next(iter(self._bodies))]
+            if existing is None or existing.generation <= generation:
+                self._bodies[key] = entry
+        return entry
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
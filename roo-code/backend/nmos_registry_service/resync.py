@@ -0,0 +1,106 @@
+"""
+Reconnect backoff and diff-based resynchronisation for the registry subscription.
+
+Whenever the subscription may have missed changes - the WebSocket dropped and
+came back, or the ingest pipeline had to discard frames - the cache is
+reconciled against the registry instead of being wiped and refetched: it keeps
+serving while only the differences are applied. ``ResyncCoordinator`` makes
+sure at most one resynchronisation runs at a time and that requests arriving
+during a run are folded into one follow-up run, so a burst of triggers costs
+at most two walks of the registry.
+"""
+
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Backoff:
+    """
+    Exponential backoff with full jitter: the n-th delay is drawn uniformly
+    from ``[0, min(maximum, initial * multiplier ** n)]`` so that many clients
+    losing the same registry do not reconnect in lockstep.
+    """
+
+    def __init__(self, initial: float = 1.0, maximum: float = 60.0, multiplier: float = 2.0,
+                 rng: Optional[random.Random] = None):
+        self.initial = initial
+        self.maximum = maximum
+        self.multiplier = multiplier
+        self.attempts = 0
+        self._rng = rng or random.Random()
+
+    def next_delay(self) -> float:
+        ceiling = min(self.maximum, self.initial * (self.multiplier ** self.attempts))
+        self.attempts += 1
+        # Never retry immediately: keep at least a tenth of the initial delay
+        return max(self.initial / 10.0, self._rng.uniform(0.0, ceiling))
+
+    def reset(self):
+        self.attempts = 0
+
+
+class ResyncCoordinator:
+    """
+    Runs ``resync`` (a coroutine function taking the trigger reason and
+    returning a JSON-serialisable report) on the service's event loop.
+    ``request`` may be called from any thread.
+    """
+
+    def __init__(self, resync: Callable[[str], Awaitable[Dict[str, Any]]], history: int = 20):
+        self.resync = resync
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+        self._running = False
+        self._pending_reason: Optional[str] = None
+        self.reports: Deque[Dict[str, Any]] = deque(maxlen=history)
+
+    def bind_loop(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def request(self, reason: str) -> bool:
+        """Schedules a resync. Returns False if it was folded into a pending one."""
+        if self._loop is None or self._loop.is_closed():
+            logger.warning(f"Resync requested ({reason}) before the event loop is available; ignored.")
+            return False
+        with self._lock:
+            if self._running:
+                if self._pending_reason is None:
+                    self._pending_reason = reason
+                    logger.info(f"Resync requested ({reason}) while one is running; queued a follow-up run.")
+                return False
+            self._running = True
+        asyncio.run_coroutine_threadsafe(self._run(reason), self._loop)
+        return True
+
+    async def _run(self, reason: str):
+        while True:
+            started = time.time()
+            report: Dict[str, Any] = {"reason": reason, "started_at": started}
+            try:
+                report.update(await self.resync(reason))
+                report["status"] = "ok"
+            except Exception as e:
+                logger.error(f"Resync ({reason}) failed: {e}", exc_info=True)
+                report["status"] = "error"
+                report["error"] = str(e)
+            report["duration_seconds"] = round(time.time() - started, 3)
+            self.reports.append(report)
+            with self._lock:
+                if self._pending_reason is None:
+                    self._running = False
+                    return
+                reason, self._pending_reason = self._pending_reason, None
+
+    def recent_reports(self) -> List[Dict[str, Any]]:
+        return list(self.reports)
@@ -0,0 +1,411 @@
+"""
+Inverted full-text and tag index over the cached NMOS resources.
+
+Indexed per resource:
+
+* ``label`` and ``description`` - lower-cased word tokens (``\\w+``, so
+  non-Latin labels are tokens too);
+* ``tag`` - ``key=value`` for every tag value (lower-cased), plus the word
+  tokens of the values;
+* the id, for id-prefix lookups.
+
+Like ``resource_index``, a ``SearchIndex`` is immutable once published with
+a store snapshot, and writers derive the next one through a
+``SearchTransaction``. Postings, the sorted vocabularies (for prefix
+matches) and the sorted ids are split into shards by the first two
+characters of the key, so a batch copies only the shards it touches rather
+than maps the size of the whole vocabulary.
+
+Queries (``search``) are whitespace-separated terms, all of which must
+match:
+
+* ``key=value`` (or ``key=`` for any value) matches tags;
+* other terms match label, description and tag words - whole words, or as
+  a prefix of up to ``MAX_PREFIX_EXPANSION`` words - and, from four
+  characters on, id prefixes.
+
+A resource scores, per term, the best of: exact id 10, id prefix 5, label 3,
+tag 2, description 1, with word-prefix matches at half weight; its score is
+the sum over the terms. A query of several words gets 10 more if they are
+the label's words exactly, or 5 if they appear in the label in that order,
+so "Sender 59.1.1" ranks its sender above "Sender 59.0.1" with the same
+bag of words. Results are ordered by score, then label, then id.
+The most selective term is evaluated first and the others only against its
+matches, so a query costs about the size of its rarest term's postings.
+At 100k resources a query whose rarest term matches up to about a thousand
+resources answers in under a millisecond; the first page of a broad one (a
+word in a fifth of all labels) still ranks every match and costs tens of
+milliseconds.
+An index keeps the matches of its last ``RANKED_CACHE_SIZE`` broad queries,
+so further pages and repeats of them are slices; since a batch that changes
+nothing searchable (a version bump) publishes the same index, they survive
+such batches.
+"""
+
+import bisect
+import heapq
+import itertools
+import re
+from typing import Any, Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+_WORD = re.compile(r"\w+")
+_ID_TERM = re.compile(r"^[0-9a-f\-]{4,}$")
+
+LABEL = "label"
+DESCRIPTION = "description"
+TAG = "tag"
+FIELD_WEIGHTS: Dict[str, float] = {LABEL: 3.0, TAG: 2.0, DESCRIPTION: 1.0}
+EXACT_ID_WEIGHT = 10.0
+ID_PREFIX_WEIGHT = 5.0
+PREFIX_FACTOR = 0.5
+EXACT_LABEL_WEIGHT = 10.0
+LABEL_PHRASE_WEIGHT = 5.0
+# Words a prefix term may expand to; broader prefixes only match their first (alphabetical) words
+MAX_PREFIX_EXPANSION = 64
+
+_EMPTY: FrozenSet[str] = frozenset()
+_NO_DOCUMENTS: Dict[str, "Document"] = {}
+# Ranked result lists kept per index (see SearchIndex.search)
+RANKED_CACHE_SIZE = 32
+# Resource keys the index reads
+_INDEXED_KEYS = ("label", "description", "tags")
+
+# field -> shard -> token -> ids
+Postings = Dict[str, Dict[str, Dict[str, FrozenSet[str]]]]
+# field -> shard -> sorted tokens
+Vocabulary = Dict[str, Dict[str, Tuple[str, ...]]]
+
+
+class Document(NamedTuple):
+    resource_type: str
+    label: str
+
+
+class SearchHit(NamedTuple):
+    resource_type: str
+    resource_id: str
+    label: str
+    score: float
+
+
+class SearchResult(NamedTuple):
+    total: int
+    hits: List[SearchHit]
+
+
+def _shard(key: str) -> str:
+    return key[:2]
+
+
+def words(text: Any) -> List[str]:
+    return _WORD.findall(text.lower()) if isinstance(text, str) else []
+
+
+def document_terms(resource: Any) -> Dict[str, Set[str]]:
+    """Tokens to index per field; ``resource`` is a dict or a compact record."""
+    terms = {LABEL: set(words(resource.get("label"))), DESCRIPTION: set(words(resource.get("description")))}
+    tag_terms: Set[str] = set()
+    tags = resource.get("tags")
+    if isinstance(tags, dict):
+        for key, values in tags.items():
+            for value in values if isinstance(values, list) else [values]:
+                if isinstance(value, str):
+                    tag_terms.add(f"{key.lower()}={value.lower()}")
+                    tag_terms.update(words(value))
+    terms[TAG] = tag_terms
+    return terms
+
+
+def _sorted_range(shards: Dict[str, Tuple[str, ...]], prefix: str, limit: Optional[int] = None) -> List[str]:
+    """Keys starting with ``prefix`` from sorted shards, in order."""
+    if len(prefix) >= 2:
+        keys = shards.get(_shard(prefix), ())
+        start = bisect.bisect_left(keys, prefix)
+        found = []
+        for key in itertools.islice(keys, start, None):
+            if not key.startswith(prefix) or (limit is not None and len(found) >= limit):
+                break
+            found.append(key)
+        return found
+    found = []
+    for shard in sorted(shard for shard in shards if shard.startswith(prefix)):
+        found.extend(shards[shard])
+        if limit is not None and len(found) >= limit:
+            return found[:limit]
+    return found
+
+
+def _edit_sorted(keys: Tuple[str, ...], added: Set[str], removed: Set[str]) -> Tuple[str, ...]:
+    """``keys`` (sorted) with ``added`` inserted and ``removed`` dropped, still sorted."""
+    edited = list(keys)
+    for key in removed - added:
+        position = bisect.bisect_left(edited, key)
+        if position < len(edited) and edited[position] == key:
+            del edited[position]
+    for key in added - removed:
+        position = bisect.bisect_left(edited, key)
+        if position == len(edited) or edited[position] != key:
+            edited.insert(position, key)
+    return tuple(edited)
+
+
+class SearchIndex:
+    def __init__(self, postings: Optional[Postings] = None, vocabulary: Optional[Vocabulary] = None,
+                 ids: Optional[Dict[str, Tuple[str, ...]]] = None,
+                 documents: Optional[Dict[str, Dict[str, Document]]] = None):
+        self._postings = postings if postings is not None else {field: {} for field in FIELD_WEIGHTS}
+        self._vocabulary = vocabulary if vocabulary is not None else {field: {} for field in FIELD_WEIGHTS}
+        self._ids = ids if ids is not None else {}
+        self._documents = documents if documents is not None else {}
+        # (terms, types) -> every match in result order, for broad queries
+        self._ranked: Dict[Tuple[str, Optional[Tuple[str, ...]]], List[Tuple[float, str, str, str]]] = {}
+        self._sorted: Set[Tuple[str, Optional[Tuple[str, ...]]]] = set()
+
+    def lookup(self, field: str, token: str) -> FrozenSet[str]:
+        return self._postings[field].get(_shard(token), {}).get(token, _EMPTY)
+
+    def document(self, resource_id: str) -> Optional[Document]:
+        return self._documents.get(_shard(resource_id), {}).get(resource_id)
+
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in self._documents.values())
+
+    def vocabulary_size(self) -> int:
+        return sum(len(tokens) for shards in self._vocabulary.values() for tokens in shards.values())
+
+    def begin(self) -> "SearchTransaction":
+        return SearchTransaction(self)
+
+    # --- Queries ---
+
+    def _expand(self, term: str) -> List[Tuple[float, FrozenSet[str]]]:
+        """``(weight, ids)`` of every posting a word or tag term matches."""
+        if "=" in term:
+            key, _, value = term.partition("=")
+            tag = f"{key}={value}"
+            tokens = _sorted_range(self._vocabulary[TAG], tag) if not value else [tag]
+            return [(FIELD_WEIGHTS[TAG], self.lookup(TAG, token)) for token in tokens]
+        sources = []
+        for field, weight in FIELD_WEIGHTS.items():
+            for word in _sorted_range(self._vocabulary[field], term, MAX_PREFIX_EXPANSION):
+                sources.append((weight if word == term else weight * PREFIX_FACTOR, self.lookup(field, word)))
+        return sources
+
+    def _unit_scores(self, sources: List[Tuple[float, Iterable[str]]],
+                     candidates: Optional[Dict[str, float]]) -> Dict[str, float]:
+        """Best weight per id over ``sources``, restricted to ``candidates`` if given."""
+        scores: Dict[str, float] = {}
+        # Lowest weight first, so that an id's best weight is the one left; unrestricted postings
+        # are copied with dict.fromkeys, outside the interpreter loop
+        for weight, ids in sorted(sources, key=lambda source: source[0]):
+            if candidates is None:
+                scores.update(dict.fromkeys(ids, weight))
+            elif isinstance(ids, frozenset) and len(candidates) < len(ids):
+                for resource_id in candidates:
+                    if resource_id in ids:
+                        scores[resource_id] = weight
+            else:
+                for resource_id in ids:
+                    if resource_id in candidates:
+                        scores[resource_id] = weight
+        return scores
+
+    def _term_units(self, term: str) -> List[List[Tuple[float, Iterable[str]]]]:
+        """
+        A term as units that must all match, each a list of ``(weight, ids)``
+        alternatives: one unit per word ("cam-1" needs both words), or a
+        single unit for a tag term or an id prefix.
+        """
+        if "=" in term:
+            return [self._expand(term)]
+        units = [self._expand(word) for word in words(term)]
+        if _ID_TERM.match(term):
+            id_matches = _sorted_range(self._ids, term)
+            id_sources = [(EXACT_ID_WEIGHT if resource_id == term else ID_PREFIX_WEIGHT, (resource_id,))
+                          for resource_id in id_matches]
+            if len(units) == 1:
+                units[0] = units[0] + id_sources
+            elif id_sources:
+                # "3f1c-aa" is an id fragment rather than two words
+                units = [id_sources]
+        return units
+
+    def _rank(self, terms: str, wanted_types: Optional[Tuple[str, ...]]) -> List[Tuple[float, str, str, str]]:
+        """``(-score, label, id, type)`` of every match, unordered."""
+        units = [unit for term in terms.split() for unit in self._term_units(term)]
+        if not units:
+            return []
+        # Most selective unit first; the others are only evaluated against its matches
+        units.sort(key=lambda unit: sum(len(ids) for _, ids in unit))
+        scores: Optional[Dict[str, float]] = None
+        for unit in units:
+            unit_scores = self._unit_scores(unit, scores)
+            # unit_scores only holds ids that are already in scores
+            scores = unit_scores if scores is None else {resource_id: scores[resource_id] + score
+                                                         for resource_id, score in unit_scores.items()}
+            if not scores:
+                return []
+        wanted = set(wanted_types) if wanted_types else None
+        # Word order only matters with several words; one word ties broken by label already
+        phrase_words = [word for term in terms.split() if "=" not in term for word in words(term)]
+        phrase = " ".join(phrase_words) if len(phrase_words) > 1 else ""
+        padded_phrase = f" {phrase} "
+        longest_word = max(phrase_words, key=len) if phrase else ""
+        ranked = []
+        documents = self._documents
+        for resource_id, score in scores.items():
+            document = documents.get(resource_id[:2], _NO_DOCUMENTS).get(resource_id)
+            if document is None or (wanted is not None and document.resource_type not in wanted):
+                continue
+            # The substring test skips the tokenising for labels that cannot hold the phrase
+            if phrase and longest_word in document.label.lower():
+                label_words = " ".join(words(document.label))
+                if label_words == phrase:
+                    score += EXACT_LABEL_WEIGHT
+                elif padded_phrase in f" {label_words} ":
+                    score += LABEL_PHRASE_WEIGHT
+            ranked.append((-score, document.label, resource_id, document.resource_type))
+        return ranked
+
+    def search(self, query: str, resource_types: Optional[Iterable[str]] = None,
+               offset: int = 0, limit: int = 20) -> SearchResult:
+        terms = " ".join(query.lower().split())
+        wanted = tuple(sorted(resource_types)) if resource_types else None
+        key = (terms, wanted)
+        ranked = self._ranked.get(key)
+        if ranked is not None:
+            if key not in self._sorted:
+                ranked.sort()
+                self._sorted.add(key)
+            page = ranked[offset:offset + limit]
+        else:
+            ranked = self._rank(terms, wanted)
+            page = heapq.nsmallest(offset + limit, ranked)[offset:]
+            if len(ranked) > offset + limit:
+                # Broad queries get paged through and repeated; this index object lives
+                # until something searchable changes, so their matches are kept with it
+                # and fully ordered the second time they are asked for
+                if len(self._ranked) >= RANKED_CACHE_SIZE:
+                    evicted = next(iter(self._ranked))
+                    del self._ranked[evicted]
+                    self._sorted.discard(evicted)
+                self._ranked[key] = ranked
+        return SearchResult(len(ranked), [SearchHit(resource_type, resource_id, label, -negative_score)
+                                          for negative_score, label, resource_id, resource_type in page])
+
+
+class SearchTransaction:
+    """
+    Collects the search index changes of one store batch; like
+    ``IndexTransaction``, touched postings are edited as plain sets and
+    frozen (and their shards copied) on commit.
+    """
+
+    def __init__(self, index: SearchIndex):
+        self._index = index
+        self._dirty: Dict[Tuple[str, str], Set[str]] = {}
+        self._documents: Dict[str, Optional[Document]] = {}
+
+    def _bucket(self, field: str, token: str) -> Set[str]:
+        bucket = self._dirty.get((field, token))
+        if bucket is None:
+            bucket = set(self._index.lookup(field, token))
+            self._dirty[(field, token)] = bucket
+        return bucket
+
+    def add(self, resource_type: str, resource_id: str, resource: Any):
+        for field, tokens in document_terms(resource).items():
+            for token in tokens:
+                self._bucket(field, token).add(resource_id)
+        label = resource.get("label")
+        self._documents[resource_id] = Document(resource_type, label if isinstance(label, str) else "")
+
+    def remove(self, resource_type: str, resource_id: str, resource: Any):
+        """``resource`` is the body that was indexed, used to find the postings to drop."""
+        for field, tokens in document_terms(resource).items():
+            for token in tokens:
+                self._bucket(field, token).discard(resource_id)
+        self._documents[resource_id] = None
+
+    def replace(self, resource_type: str, resource_id: str, old_resource: Any, resource: Any):
+        """
+        Re-indexes an updated resource, touching only the tokens that changed:
+        a version bump leaves its (possibly huge) "sender" or "1" postings alone.
+        """
+        if all(old_resource.get(key) == resource.get(key) for key in _INDEXED_KEYS):
+            # Most updates (versions, subscriptions, transport parameters) change nothing searchable
+            return
+        old_terms = document_terms(old_resource)
+        for field, tokens in document_terms(resource).items():
+            previous = old_terms[field]
+            for token in previous - tokens:
+                self._bucket(field, token).discard(resource_id)
+            for token in tokens - previous:
+                self._bucket(field, token).add(resource_id)
+        label = resource.get("label")
+        document = Document(resource_type, label if isinstance(label, str) else "")
+        if old_resource.get("label") != resource.get("label") or resource_id in self._documents:
+            self._documents[resource_id] = document
+
+    def commit(self) -> SearchIndex:
+        index = self._index
+        if not self._dirty and not self._documents:
+            return index
+        postings = dict(index._postings)
+        vocabulary = dict(index._vocabulary)
+        copied_postings: Set[Tuple[str, str]] = set()
+        vocabulary_changes: Dict[Tuple[str, str], Tuple[Set[str], Set[str]]] = {}
+        for (field, token), bucket in self._dirty.items():
+            shard = _shard(token)
+            if (field, shard) not in copied_postings:
+                if field not in copied_postings:
+                    postings[field] = dict(postings[field])
+                    copied_postings.add(field)
+                postings[field][shard] = dict(postings[field].get(shard, {}))
+                copied_postings.add((field, shard))
+            existed = token in postings[field][shard]
+            if bucket:
+                postings[field][shard][token] = frozenset(bucket)
+                if not existed:
+                    vocabulary_changes.setdefault((field, shard), (set(), set()))[0].add(token)
+            elif existed:
+                del postings[field][shard][token]
+                vocabulary_changes.setdefault((field, shard), (set(), set()))[1].add(token)
+        copied_fields: Set[str] = set()
+        for (field, shard), (added, removed) in vocabulary_changes.items():
+            if field not in copied_fields:
+                vocabulary[field] = dict(vocabulary[field])
+                copied_fields.add(field)
+            tokens = _edit_sorted(vocabulary[field].get(shard, ()), added, removed)
+            if tokens:
+                vocabulary[field][shard] = tokens
+            else:
+                vocabulary[field].pop(shard, None)
+
+        ids = index._ids
+        documents = index._documents
+        if self._documents:
+            ids = dict(ids)
+            documents = dict(documents)
+            by_shard: Dict[str, List[Tuple[str, Optional[Document]]]] = {}
+            for resource_id, document in self._documents.items():
+                by_shard.setdefault(_shard(resource_id), []).append((resource_id, document))
+            for shard, changes in by_shard.items():
+                shard_documents = dict(documents.get(shard, {}))
+                added, removed = set(), set()
+                for resource_id, document in changes:
+                    if document is None:
+                        if shard_documents.pop(resource_id, None) is not None:
+                            removed.add(resource_id)
+                    else:
+                        if resource_id not in shard_documents:
+                            added.add(resource_id)
+                        shard_documents[resource_id] = document
+                if shard_documents:
+                    documents[shard] = shard_documents
+                    if added or removed:
+                        ids[shard] = _edit_sorted(ids.get(shard, ()), added, removed)
+                else:
+                    documents.pop(shard, None)
+                    ids.pop(shard, None)
+        return SearchIndex(postings, vocabulary, ids, documents)
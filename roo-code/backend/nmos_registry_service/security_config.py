@@ -115,12 +115,40 @@ if not USERS:
     }
     save_users(USERS)
 
+# 多 worker 模式下密码修改由采集进程写入 USERS_FILE; 只读 worker 据文件修改时间重新加载
+_users_file_mtime = os.path.getmtime(USERS_FILE) if os.path.exists(USERS_FILE) else None
+
+def reload_users_if_changed() -> bool:
+    global USERS, _users_file_mtime
+    try:
+        mtime = os.path.getmtime(USERS_FILE)
+    except OSError:
+        return False
+    if mtime == _users_file_mtime:
+        return False
+    users_data = load_users()
+    if not users_data:
+        return False
+    USERS = users_data
+    _users_file_mtime = mtime
+    return True
+
+# 用户查找: 接受 USERS 的键 (如 "admin_user") 或用户记录中的 username (如 "admin")
+def find_user_key(username):
+    if username in USERS:
+        return username
+    for user_key, user_data in USERS.items():
+        if user_data.get("username") == username:
+            return user_key
+    return None
+
 # 权限检查函数
 def check_permission(username, permission):
     """
     检查用户是否具有特定权限
     """
-    if username not in USERS:
+    username = find_user_key(username)
+    if username is None:
         return False
     
     user_role = USERS[username]["role"]
@@ -131,7 +159,8 @@ def check_permission(username, permission):
 
 # 密码验证函数
 def verify_password(username, provided_password: str) -> bool:
-    if username not in USERS:
+    username = find_user_key(username)
+    if username is None:
         return False
     stored_hash = USERS[username].get("password_hash")
     if not stored_hash:
@@ -140,7 +169,8 @@ def verify_password(username, provided_password: str) -> bool:
 
 # 更新用户密码函数
 def update_user_password(username, new_password: str) -> bool:
-    if username not in USERS:
+    username = find_user_key(username)
+    if username is None:
         return False
     USERS[username]["password_hash"] = hash_password(new_password)
     save_users(USERS)
@@ -0,0 +1,445 @@
+"""
+Shared-memory publication of the resource store for multi-worker deployments.
+
+The registry service keeps its cache in process memory, so a single process
+has to serve every poll. In multi-worker mode one *ingest* process owns the
+registry subscriptions and the store, and ``SharedStorePublisher`` publishes
+the store into a directory on a memory-backed filesystem (``/dev/shm`` by
+default) for any number of read-only *reader* API workers:
+
+* each publication is an immutable **segment** file holding the already
+  serialized per-type JSON arrays, a per-type id -> byte range table and the
+  secondary index postings. Readers ``mmap`` it, so every worker shares the
+  same physical pages and ``/resources`` is answered by slicing bytes, with
+  no decoding or re-encoding;
+* a small fixed-size **control** file holds the generation counter and the
+  number of the current segment, guarded by a sequence lock (odd while the
+  publisher is writing). Readers check it on every request - one unpack of
+  a mapped page - and map the next segment when it changes.
+
+Segments are written to a temporary name and renamed, and the publisher only
+unlinks segments a few publications old; a reader that still maps one keeps
+a valid mapping after the unlink. Publication is throttled to one per
+``interval`` and skipped while the store generation is unchanged, like the
+on-disk snapshot writer.
+"""
+
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from collections.abc import Mapping
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import resource_index
+import resource_store
+
+logger = logging.getLogger(__name__)
+
+ROLE_STANDALONE = "standalone"
+ROLE_INGEST = "ingest"
+ROLE_READER = "reader"
+ROLES = (ROLE_STANDALONE, ROLE_INGEST, ROLE_READER)
+
+CONTROL_FILE = "control"
+CONTROL_MAGIC = b"NMOSSHM1"
+# magic, sequence lock, store generation, segment number, published at (unix time)
+_CONTROL = struct.Struct("<8sQQQd")
+CONTROL_SIZE = mmap.PAGESIZE
+
+SEGMENT_MAGIC = b"NMOSSEG1"
+_SEGMENT_PREFIX = struct.Struct("<8sI")
+# Segments kept on disk behind the current one, for readers that are still switching
+KEEP_SEGMENTS = 3
+
+
+def default_directory() -> str:
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, "nmos-registry")
+
+
+def segment_path(directory: str, number: int) -> str:
+    return os.path.join(directory, f"segment-{number:012d}")
+
+
+class _TypeSection(NamedTuple):
+    # The per-type map of the store snapshot this was encoded from; unchanged maps are reused as is
+    source: Any
+    array: bytes
+    # {id: [offset, length]} relative to the start of ``array``, as JSON
+    ids: bytes
+
+
+def _encode_type(snapshot: resource_store.StoreSnapshot, resource_type: str) -> _TypeSection:
+    parts: List[bytes] = []
+    ids: Dict[str, Tuple[int, int]] = {}
+    offset = 1
+    for resource_id, blob in snapshot.json_items(resource_type):
+        if parts:
+            offset += 1
+        ids[resource_id] = (offset, len(blob))
+        parts.append(blob)
+        offset += len(blob)
+    return _TypeSection(snapshot.resources[resource_type], b"[" + b",".join(parts) + b"]",
+                        json.dumps(ids, separators=(",", ":")).encode("utf-8"))
+
+
+class _PostingsSection(NamedTuple):
+    source: Any
+    # {value: [ids]} of one (resource type, field), as JSON
+    postings: bytes
+
+
+def write_segment(path: str, snapshot: resource_store.StoreSnapshot, epoch: str, status: Dict[str, Any],
+                  sections: Optional[Dict[Any, Any]] = None) -> int:
+    """
+    Writes ``snapshot`` as a segment file. Returns the segment size in bytes.
+    ``sections`` carries encodings between calls: the store copies only the
+    per-type maps and postings maps a batch touched, so those that are the same
+    objects as last time are not encoded again.
+    """
+    sections = sections if sections is not None else {}
+    chunks: List[bytes] = []
+    offset = 0
+    types: Dict[str, Dict[str, Any]] = {}
+
+    def append(chunk: bytes) -> Tuple[int, int]:
+        nonlocal offset
+        chunks.append(chunk)
+        start = offset
+        offset += len(chunk)
+        return start, len(chunk)
+
+    for resource_type in snapshot.resources:
+        section = sections.get(resource_type)
+        if section is None or section.source is not snapshot.resources[resource_type]:
+            section = sections[resource_type] = _encode_type(snapshot, resource_type)
+        types[resource_type] = {"array": append(section.array), "ids": append(section.ids)}
+    index: Dict[str, Dict[str, Tuple[int, int]]] = {}
+    for key, buckets in snapshot.index.items():
+        section = sections.get(key)
+        if section is None or section.source is not buckets:
+            postings = {value: list(ids) for value, ids in buckets.items()}
+            section = sections[key] = _PostingsSection(buckets, json.dumps(postings, separators=(",", ":")).encode("utf-8"))
+        resource_type, field = key
+        index.setdefault(resource_type, {})[field] = append(section.postings)
+    header = json.dumps({
+        "generation": snapshot.generation,
+        "epoch": epoch,
+        "published_at": time.time(),
+        "counts": snapshot.counts(),
+        "types": types,
+        "index": index,
+        "status": status,
+    }, separators=(",", ":")).encode("utf-8")
+    # Section offsets above are relative to the end of the header
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as out:
+        out.write(_SEGMENT_PREFIX.pack(SEGMENT_MAGIC, len(header)))
+        out.write(header)
+        for chunk in chunks:
+            out.write(chunk)
+        size = out.tell()
+    os.replace(tmp_path, path)
+    return size
+
+
+class SharedStorePublisher:
+    """
+    Background thread (ingest process) that publishes the store whenever its
+    generation changed, at most once per ``interval`` seconds. ``status_fn``
+    returns the registry state that reader workers report on ``/health``.
+    """
+
+    def __init__(self, store: resource_store.ResourceStore, directory: str, interval: float,
+                 status_fn: Callable[[], Dict[str, Any]] = dict):
+        self.store = store
+        self.directory = directory
+        self.interval = interval
+        self.status_fn = status_fn
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._control: Optional[mmap.mmap] = None
+        self._segment_number = 0
+        self._sections: Dict[Any, Any] = {}
+        self._last_status: Optional[Dict[str, Any]] = None
+        self.last_published_generation: Optional[int] = None
+        self.last_publish_seconds: Optional[float] = None
+        self.last_segment_bytes = 0
+        self.publications = 0
+        self.last_error: Optional[str] = None
+
+    def _open_control(self) -> mmap.mmap:
+        os.makedirs(self.directory, exist_ok=True)
+        # Reader workers keep the control file mapped, so it is reused in place rather than replaced
+        fd = os.open(os.path.join(self.directory, CONTROL_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < CONTROL_SIZE:
+                os.ftruncate(fd, CONTROL_SIZE)
+            control = mmap.mmap(fd, CONTROL_SIZE)
+        finally:
+            os.close(fd)
+        magic, sequence, _, segment_number, _ = _CONTROL.unpack_from(control, 0)
+        if magic == CONTROL_MAGIC:
+            # Continue the numbering of a previous ingest process so readers see a new segment
+            self._segment_number = segment_number
+            sequence += sequence & 1
+        else:
+            sequence = 0
+        _CONTROL.pack_into(control, 0, CONTROL_MAGIC, sequence, 0, self._segment_number, 0.0)
+        return control
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="shared-store-publisher", daemon=True)
+        self._thread.start()
+        logger.info(f"Publishing the resource store to {self.directory} every {self.interval:.2f}s")
+
+    def stop(self, timeout: float = 10.0):
+        self._stop_event.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=timeout)
+        self._thread = None
+
+    def publish_if_changed(self) -> bool:
+        with self._lock:
+            snapshot = self.store.snapshot
+            status = self.status_fn()
+            # Registry state changes (a registry disconnecting) are published even without store changes
+            if snapshot.generation == self.last_published_generation and status == self._last_status:
+                return False
+            started = time.monotonic()
+            try:
+                if self._control is None:
+                    self._control = self._open_control()
+                number = self._segment_number + 1
+                size = write_segment(segment_path(self.directory, number), snapshot,
+                                     self.store.change_log.epoch, status, self._sections)
+            except OSError as e:
+                self.last_error = str(e)
+                logger.error(f"Failed to publish the resource store to {self.directory}: {e}")
+                return False
+            control = self._control
+            sequence = _CONTROL.unpack_from(control, 0)[1]
+            _CONTROL.pack_into(control, 0, CONTROL_MAGIC, sequence + 1, snapshot.generation, number, time.time())
+            _CONTROL.pack_into(control, 0, CONTROL_MAGIC, sequence + 2, snapshot.generation, number, time.time())
+            self._segment_number = number
+            self._remove_old_segments(number - KEEP_SEGMENTS)
+            self.last_publish_seconds = time.monotonic() - started
+            self.last_published_generation = snapshot.generation
+            self._last_status = status
+            self.last_segment_bytes = size
+            self.publications += 1
+            self.last_error = None
+            logger.debug(f"Published store generation {snapshot.generation} as segment {number} "
+                         f"({size} bytes) in {self.last_publish_seconds:.3f}s")
+            return True
+
+    def _remove_old_segments(self, below: int):
+        for name in os.listdir(self.directory):
+            if not name.startswith("segment-") or name.endswith(".tmp"):
+                continue
+            try:
+                if int(name[len("segment-"):]) <= below:
+                    os.unlink(os.path.join(self.directory, name))
+            except (ValueError, OSError):
+                continue
+
+    def _run(self):
+        while True:
+            self.publish_if_changed()
+            if self._stop_event.wait(self.interval):
+                break
+        # Final publication so readers do not lag behind a clean shutdown
+        self.publish_if_changed()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"directory": self.directory, "segment": self._segment_number,
+                "generation": self.last_published_generation, "publications": self.publications,
+                "last_publish_seconds": self.last_publish_seconds, "segment_bytes": self.last_segment_bytes,
+                "last_error": self.last_error}
+
+
+class _IdTables(Mapping):
+    """resource type -> {id: (offset, length) within the type's array}, each table decoded on first use."""
+
+    def __init__(self, segment: "SharedSnapshot"):
+        self._segment = segment
+        self._tables: Dict[str, Dict[str, List[int]]] = {}
+
+    def __getitem__(self, resource_type: str) -> Dict[str, List[int]]:
+        table = self._tables.get(resource_type)
+        if table is None:
+            section = self._segment.types[resource_type]["ids"]
+            table = json.loads(self._segment.section(section))
+            self._tables[resource_type] = table
+        return table
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._segment.types)
+
+    def __len__(self) -> int:
+        return len(self._segment.types)
+
+
+class SharedSnapshot:
+    """
+    Read-only view of one published segment with the accessors of
+    ``resource_store.StoreSnapshot``, so API handlers serve either alike.
+    """
+
+    compact = False
+
+    def __init__(self, buffer: Optional[mmap.mmap], header: Dict[str, Any], base: int):
+        self._buffer = buffer
+        self._base = base
+        self.header = header
+        self.generation: int = header.get("generation", 0)
+        self.epoch: str = header.get("epoch", "")
+        self.status: Dict[str, Any] = header.get("status", {})
+        self.types: Dict[str, Dict[str, List[int]]] = header.get("types", {})
+        self.resources = _IdTables(self)
+        self._index: Optional[resource_index.ResourceIndex] = None
+
+    @classmethod
+    def empty(cls) -> "SharedSnapshot":
+        """Stands in until the ingest process has published anything."""
+        return cls(None, {"types": {resource_type: {} for resource_type in resource_store.RESOURCE_TYPES},
+                          "counts": {resource_type: 0 for resource_type in resource_store.RESOURCE_TYPES}}, 0)
+
+    @property
+    def published(self) -> bool:
+        return self._buffer is not None
+
+    def section(self, section: List[int]) -> bytes:
+        offset, length = section
+        start = self._base + offset
+        return self._buffer[start:start + length]
+
+    @property
+    def index(self) -> resource_index.ResourceIndex:
+        if self._index is None:
+            sections = self.header.get("index", {}) if self.published else {}
+            self._index = resource_index.ResourceIndex({
+                (resource_type, field): {value: frozenset(ids) for value, ids in json.loads(self.section(section)).items()}
+                for resource_type, fields in sections.items()
+                for field, section in fields.items()
+            })
+        return self._index
+
+    def _resource_section(self, resource_type: str, entry: List[int]) -> bytes:
+        start = self._base + self.types[resource_type]["array"][0] + entry[0]
+        return self._buffer[start:start + entry[1]]
+
+    def get(self, resource_type: str, resource_id: str) -> Optional[Dict[str, Any]]:
+        if resource_type not in self.types or not self.published:
+            return None
+        entry = self.resources[resource_type].get(resource_id)
+        return json.loads(self._resource_section(resource_type, entry)) if entry is not None else None
+
+    def find(self, resource_id: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        for resource_type in self.types:
+            resource = self.get(resource_type, resource_id)
+            if resource is not None:
+                return resource_type, resource
+        return None
+
+    def values(self, resource_type: str) -> Iterator[Dict[str, Any]]:
+        return iter(json.loads(self.json_array(resource_type)))
+
+    def json_array(self, resource_type: str) -> bytes:
+        if resource_type not in self.types or not self.published:
+            return b"[]"
+        return self.section(self.types[resource_type]["array"])
+
+    def json_items(self, resource_type: str) -> Iterator[Tuple[str, bytes]]:
+        if resource_type not in self.types or not self.published:
+            return iter(())
+        return ((resource_id, self._resource_section(resource_type, entry))
+                for resource_id, entry in self.resources[resource_type].items())
+
+    def counts(self) -> Dict[str, int]:
+        return dict(self.header.get("counts", {}))
+
+    def total(self) -> int:
+        return sum(self.header.get("counts", {}).values())
+
+
+class SharedStoreReader:
+    """
+    Follows the segments published into ``directory`` (reader workers).
+    ``snapshot()`` is cheap when nothing changed: one read of the control page.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._control: Optional[mmap.mmap] = None
+        self._segment_number = 0
+        self._snapshot = SharedSnapshot.empty()
+        self._lock = threading.Lock()
+        self.switches = 0
+
+    def _read_control(self) -> Optional[Tuple[int, int, float]]:
+        if self._control is None:
+            try:
+                fd = os.open(os.path.join(self.directory, CONTROL_FILE), os.O_RDONLY)
+            except FileNotFoundError:
+                return None
+            try:
+                if os.fstat(fd).st_size < CONTROL_SIZE:
+                    return None
+                self._control = mmap.mmap(fd, CONTROL_SIZE, access=mmap.ACCESS_READ)
+            finally:
+                os.close(fd)
+        for _ in range(1000):
+            magic, before, generation, segment_number, published_at = _CONTROL.unpack_from(self._control, 0)
+            if magic != CONTROL_MAGIC:
+                return None
+            if before & 1:
+                continue
+            if _CONTROL.unpack_from(self._control, 0)[1] == before:
+                return generation, segment_number, published_at
+        return None
+
+    def _map_segment(self, number: int) -> Optional[SharedSnapshot]:
+        try:
+            with open(segment_path(self.directory, number), "rb") as f:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            # Already replaced by a newer segment (or empty); the next control read finds that one
+            return None
+        magic, header_length = _SEGMENT_PREFIX.unpack_from(buffer, 0)
+        if magic != SEGMENT_MAGIC:
+            logger.error(f"Ignoring segment {number} in {self.directory}: bad magic {magic!r}")
+            return None
+        base = _SEGMENT_PREFIX.size + header_length
+        header = json.loads(buffer[_SEGMENT_PREFIX.size:base])
+        return SharedSnapshot(buffer, header, base)
+
+    def snapshot(self) -> SharedSnapshot:
+        control = self._read_control()
+        if control is None or control[1] == self._segment_number:
+            return self._snapshot
+        with self._lock:
+            _, segment_number, _ = control
+            if segment_number != self._segment_number:
+                mapped = self._map_segment(segment_number)
+                if mapped is not None:
+                    # The previous mapping is released once no request holds its snapshot any more
+                    self._snapshot = mapped
+                    self._segment_number = segment_number
+                    self.switches += 1
+        return self._snapshot
+
+    def stats(self) -> Dict[str, Any]:
+        snapshot = self._snapshot
+        published_at = snapshot.header.get("published_at")
+        return {"directory": self.directory, "segment": self._segment_number, "generation": snapshot.generation,
+                "age_seconds": time.time() - published_at if published_at else None, "switches": self.switches}
@@ -0,0 +1,179 @@
+"""
+On-disk snapshot of the registry cache for warm restarts.
+
+Without it a restarted service starts from an empty cache and ``/resources``
+is useless until a full discovery of the plant has finished. The snapshot is
+a gzip-compressed NDJSON file: a header line describing the file followed by
+one line per resource, ``{"o": <origin index>, "r": <resource>}``, where the
+origin index points into the header's list of registries the resources came
+from (format version 1 files hold bare resources). It is written periodically from an immutable store
+snapshot, so writing never blocks ingest, and replaced atomically (write to a
+temporary file, fsync, rename) so a crash mid-write leaves the previous file
+intact. On startup the file is loaded into the store and then reconciled
+against the live registry (see ``discovery.Reconciler``).
+"""
+
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+import resource_store
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT = "nmos-registry-snapshot"
+SNAPSHOT_FORMAT_VERSION = 2
+READABLE_FORMAT_VERSIONS = (1, 2)
+
+
+class LoadedSnapshot(NamedTuple):
+    header: Dict[str, Any]
+    resources: List[Dict[str, Any]]
+    # resource id -> registry that supplied it
+    origins: Dict[str, str]
+
+    @property
+    def registry_urls(self) -> List[str]:
+        if "registry_urls" in self.header:
+            return list(self.header["registry_urls"])
+        return [self.header["registry_url"]] if self.header.get("registry_url") else []
+
+
+def write_snapshot(path: str, snapshot: resource_store.StoreSnapshot, registry_urls: List[str],
+                   origin_of: Callable[[str], Optional[str]] = lambda resource_id: None) -> int:
+    """Writes ``snapshot`` to ``path`` atomically. Returns the number of resources written."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    header = {
+        "format": SNAPSHOT_FORMAT,
+        "format_version": SNAPSHOT_FORMAT_VERSION,
+        "written_at": datetime.now(timezone.utc).isoformat(),
+        "registry_urls": list(registry_urls),
+        "origins": list(registry_urls),
+        "generation": snapshot.generation,
+        "counts": snapshot.counts(),
+    }
+    origin_prefixes: Dict[Optional[str], bytes] = {None: b'{"o":null,"r":'}
+    for position, url in enumerate(registry_urls):
+        origin_prefixes[url] = b'{"o":%d,"r":' % position
+    tmp_path = f"{path}.tmp"
+    written = 0
+    with open(tmp_path, "wb") as raw:
+        # Level 1: the file is rewritten often and read once, so speed beats ratio
+        with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=1) as out:
+            out.write(json.dumps(header, separators=(",", ":")).encode("utf-8") + b"\n")
+            for resource_type in snapshot.resources:
+                for resource_id, blob in snapshot.json_items(resource_type):
+                    # Origins of registries no longer configured are dropped (written as unowned)
+                    prefix = origin_prefixes.get(origin_of(resource_id), origin_prefixes[None])
+                    out.write(prefix + blob + b"}\n")
+                    written += 1
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(tmp_path, path)
+    return written
+
+
+def read_snapshot(path: str) -> Optional[LoadedSnapshot]:
+    """Reads a snapshot file. Returns None if it is missing, of another format or unreadable."""
+    if not os.path.exists(path):
+        return None
+    try:
+        with gzip.open(path, "rb") as source:
+            header = json.loads(source.readline())
+            if not isinstance(header, dict) or header.get("format") != SNAPSHOT_FORMAT:
+                logger.warning(f"Ignoring snapshot {path}: not a registry snapshot file")
+                return None
+            format_version = header.get("format_version")
+            if format_version not in READABLE_FORMAT_VERSIONS:
+                logger.warning(f"Ignoring snapshot {path}: format version {format_version}, "
+                               f"expected one of {READABLE_FORMAT_VERSIONS}")
+                return None
+            resources: List[Dict[str, Any]] = []
+            origins: Dict[str, str] = {}
+            if format_version == 1:
+                resources = [json.loads(line) for line in source if line.strip()]
+            else:
+                origin_urls = header.get("origins", [])
+                for line in source:
+                    if not line.strip():
+                        continue
+                    entry = json.loads(line)
+                    resource = entry["r"]
+                    resources.append(resource)
+                    if entry.get("o") is not None:
+                        origins[resource["id"]] = origin_urls[entry["o"]]
+    except (OSError, EOFError, ValueError, KeyError, IndexError, TypeError) as e:
+        # Truncated gzip streams raise EOFError, corrupt ones OSError, bad lines ValueError
+        logger.error(f"Failed to read snapshot {path}: {e}")
+        return None
+    return LoadedSnapshot(header, resources, origins)
+
+
+class SnapshotWriter:
+    """
+    Background thread that writes the store to disk every ``interval`` seconds
+    when it has changed since the last write.
+    """
+
+    def __init__(self, store: resource_store.ResourceStore, path: str, interval: float,
+                 registry_urls_fn: Callable[[], List[str]]):
+        self.store = store
+        self.path = path
+        self.interval = interval
+        self.registry_urls_fn = registry_urls_fn
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.last_written_generation: Optional[int] = None
+        self.last_written_at: Optional[float] = None
+        self.last_write_seconds: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="snapshot-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, final_write: bool = True, timeout: float = 30.0):
+        self._stop_event.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=timeout)
+        self._thread = None
+        if final_write:
+            self.write_if_changed()
+
+    def write_if_changed(self) -> bool:
+        """Writes the current store snapshot unless that generation is already on disk."""
+        with self._lock:
+            snapshot = self.store.snapshot
+            registry_urls = self.registry_urls_fn()
+            # An unconfigured service must not overwrite the snapshot it may still be restarted from
+            if not registry_urls or snapshot.generation == self.last_written_generation:
+                return False
+            started = time.monotonic()
+            try:
+                written = write_snapshot(self.path, snapshot, registry_urls, self.store.origin_of)
+            except OSError as e:
+                self.last_error = str(e)
+                logger.error(f"Failed to write registry snapshot to {self.path}: {e}")
+                return False
+            self.last_write_seconds = time.monotonic() - started
+            self.last_written_generation = snapshot.generation
+            self.last_written_at = time.time()
+            self.last_error = None
+            logger.info(f"Wrote registry snapshot of {written} resources (generation {snapshot.generation}) "
+                        f"to {self.path} in {self.last_write_seconds:.3f}s")
+            return True
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self.write_if_changed()
+
@@ -0,0 +1,221 @@
+"""
+Server-side filtered IS-04 Query API subscriptions.
+
+``SubscriptionManager`` creates each Query API subscription with ``POST
+/subscriptions`` (its ``resource_path`` and basic query ``params``) and
+follows the returned ``ws_href``. Without a configuration it runs the single
+unfiltered ``ALL_RESOURCES`` subscription to ``/``, which delivers every
+change of every type. With one it runs one subscription per configured
+resource type instead; the registry then only sends grains for resources
+matching the filter, so an edge instance receives and caches only the slice
+it serves.
+All subscriptions of a manager run as tasks on the service's event loop; a
+dropped subscription is re-created with its own jittered backoff.
+
+The configuration (``NMOS_SUBSCRIPTIONS_CONFIG``: a JSON file path or inline
+JSON) lists the types to subscribe to and their filters::
+
+    {
+      "max_update_rate_ms": 100,
+      "subscriptions": {
+        "senders":   {"tags.location": "studio-a"},
+        "receivers": {"node_id": "3b8be755-08ff-452b-b217-c9151eb21193"},
+        "flows":     {}
+      }
+    }
+
+Types that are not listed are neither subscribed to nor discovered.
+"""
+
+import asyncio
+import concurrent.futures
+import json
+import logging
+import os
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+import httpx
+import websockets
+
+import resource_store
+import resync
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_UPDATE_RATE_MS = 100
+
+
+class SubscriptionSpec(NamedTuple):
+    resource_type: str
+    # IS-04 basic query parameters, e.g. {"tags.location": "studio-a"}
+    params: Dict[str, str]
+    max_update_rate_ms: int = DEFAULT_MAX_UPDATE_RATE_MS
+
+    @property
+    def resource_path(self) -> str:
+        return f"/{self.resource_type}"
+
+
+# Every change of every type: the subscription to `/` used when no types are configured
+ALL_RESOURCES = SubscriptionSpec("", {})
+
+
+def load_subscription_specs(source: str) -> List[SubscriptionSpec]:
+    """Parses the subscription configuration from a JSON file path or inline JSON text."""
+    if source.lstrip().startswith("{"):
+        config = json.loads(source)
+    else:
+        with open(os.path.expanduser(source), "r", encoding="utf-8") as f:
+            config = json.load(f)
+    if not isinstance(config, dict) or not isinstance(config.get("subscriptions"), dict):
+        raise ValueError("Subscription config must be an object with a 'subscriptions' object")
+    default_rate = int(config.get("max_update_rate_ms", DEFAULT_MAX_UPDATE_RATE_MS))
+    specs = []
+    for resource_type, params in config["subscriptions"].items():
+        if resource_type not in resource_store.RESOURCE_TYPES:
+            raise ValueError(f"Unknown resource type '{resource_type}' in subscription config")
+        if not isinstance(params, dict):
+            raise ValueError(f"Filters for '{resource_type}' must be an object of query parameters")
+        params = dict(params)
+        rate = int(params.pop("max_update_rate_ms", default_rate))
+        specs.append(SubscriptionSpec(resource_type, {key: str(value) for key, value in params.items()}, rate))
+    if not specs:
+        raise ValueError("Subscription config does not list any resource type")
+    return specs
+
+
+class _SubscriptionState:
+    __slots__ = ("spec", "backoff", "connected", "subscription_id", "ws_href", "frames", "opened", "last_error")
+
+    def __init__(self, spec: SubscriptionSpec, backoff: resync.Backoff):
+        self.spec = spec
+        self.backoff = backoff
+        self.connected = False
+        self.subscription_id: Optional[str] = None
+        self.ws_href: Optional[str] = None
+        self.frames = 0
+        self.opened = 0
+        self.last_error: Optional[str] = None
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "params": self.spec.params,
+            "connected": self.connected,
+            "subscription_id": self.subscription_id,
+            "ws_href": self.ws_href,
+            "frames": self.frames,
+            "consecutive_failures": self.backoff.attempts,
+            "last_error": self.last_error,
+        }
+
+
+class SubscriptionManager:
+    """
+    Runs the subscriptions in ``specs`` against one Query API.
+
+    ``submit_frame`` is awaited with every received grain frame.
+    ``on_open(spec, reconnected)`` is called when a subscription's socket
+    opens, ``on_lost(spec)`` when it drops unexpectedly. ``start`` and
+    ``stop`` may be called from any thread once ``bind_loop`` has been called.
+    """
+
+    def __init__(self,
+                 query_api_url: str,
+                 specs: List[SubscriptionSpec],
+                 submit_frame: Callable[[str], Awaitable[Any]],
+                 on_open: Optional[Callable[[SubscriptionSpec, bool], None]] = None,
+                 on_lost: Optional[Callable[[SubscriptionSpec], None]] = None,
+                 backoff_factory: Callable[[], resync.Backoff] = resync.Backoff,
+                 request_timeout: float = 10.0):
+        self.query_api_url = query_api_url.rstrip('/')
+        self.specs = list(specs)
+        self.submit_frame = submit_frame
+        self.on_open = on_open
+        self.on_lost = on_lost
+        self.request_timeout = request_timeout
+        self._states = {spec.resource_type or spec.resource_path: _SubscriptionState(spec, backoff_factory())
+                        for spec in self.specs}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._runner: Optional[concurrent.futures.Future] = None
+
+    def bind_loop(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+
+    @property
+    def connected(self) -> bool:
+        return all(state.connected for state in self._states.values())
+
+    @property
+    def consecutive_failures(self) -> int:
+        return max((state.backoff.attempts for state in self._states.values()), default=0)
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        return {resource_type: state.as_dict() for resource_type, state in self._states.items()}
+
+    def start(self):
+        if self._runner is not None and not self._runner.done():
+            return
+        if self._loop is None or self._loop.is_closed():
+            raise RuntimeError("SubscriptionManager.start() called before an event loop was bound")
+        self._runner = asyncio.run_coroutine_threadsafe(self._run_all(), self._loop)
+
+    def stop(self):
+        """Cancels the subscription tasks; their sockets close on the event loop shortly after."""
+        runner, self._runner = self._runner, None
+        if runner is None:
+            return
+        runner.cancel()
+        for state in self._states.values():
+            state.connected = False
+
+    async def _run_all(self):
+        async with httpx.AsyncClient(timeout=self.request_timeout) as client:
+            await asyncio.gather(*(self._run(client, state) for state in self._states.values()))
+
+    async def _create_subscription(self, client: httpx.AsyncClient, state: _SubscriptionState) -> str:
+        body = {
+            "max_update_rate_ms": state.spec.max_update_rate_ms,
+            "resource_path": state.spec.resource_path,
+            "params": state.spec.params,
+            "persist": False,
+            "secure": self.query_api_url.startswith("https://"),
+        }
+        response = await client.post(f"{self.query_api_url}/subscriptions", json=body)
+        response.raise_for_status()
+        subscription = response.json()
+        state.subscription_id = subscription.get("id")
+        state.ws_href = subscription["ws_href"]
+        return state.ws_href
+
+    async def _run(self, client: httpx.AsyncClient, state: _SubscriptionState):
+        spec = state.spec
+        reconnected = False
+        while True:
+            try:
+                ws_href = await self._create_subscription(client, state)
+                logger.info(f"Subscribing to {spec.resource_path} (filters {spec.params}) at {ws_href}")
+                async with websockets.connect(ws_href, ping_interval=20, ping_timeout=20, max_size=None) as ws:
+                    state.connected = True
+                    state.opened += 1
+                    state.last_error = None
+                    state.backoff.reset()
+                    if self.on_open:
+                        self.on_open(spec, reconnected)
+                    async for message in ws:
+                        state.frames += 1
+                        await self.submit_frame(message)
+                logger.info(f"Subscription {spec.resource_path} on {self.query_api_url} closed by the registry.")
+            except asyncio.CancelledError:
+                state.connected = False
+                raise
+            except (httpx.HTTPError, websockets.exceptions.WebSocketException, OSError, KeyError, ValueError) as e:
+                state.last_error = str(e)
+                logger.error(f"Subscription {spec.resource_path} on {self.query_api_url} failed: {e}")
+            state.connected = False
+            reconnected = True
+            if self.on_lost:
+                self.on_lost(spec)
+            delay = state.backoff.next_delay()
+            logger.info(f"Re-creating subscription {spec.resource_path} on {self.query_api_url} in {delay:.1f}s "
+                        f"(attempt {state.backoff.attempts}).")
+            await asyncio.sleep(delay)
@@ -0,0 +1,366 @@
+"""
+Media topology graph of the cached resources, maintained incrementally.
+
+Vertices are the cached resources (``{"id", "type", "label"}``, with the
+singular resource type). Every edge comes from a reference a resource
+holds; the referring resource owns it:
+
+* ``belongs_to_node``   node -> device          (``device.node_id``)
+* ``belongs_to_device`` device -> sender, receiver, source, flow (``device_id``)
+* ``sends_flow``        sender -> flow          (``sender.flow_id``)
+* ``flow_of_source``    flow -> source          (``flow.source_id``)
+* ``active_connection`` sender -> receiver      (``receiver.subscription.sender_id`` while active)
+
+Edges are keyed ``"<owner id>:<edge type>"``, so a resource has at most one
+edge of each type. An edge is only visible while both ends are cached:
+grains arrive in any order, and a sender may be seen before its device.
+Edges whose other end is missing are kept and appear once that end does.
+
+A background thread tails the resource change log and applies each change
+in O(edges it touches): a resource's own references, plus its incident
+edges when it appears or disappears. A version bump that leaves label and
+references alone changes nothing. The graph changes are recorded in a
+``ChangeLog`` of their own, so clients follow the topology the same way
+``/resources/changes`` follows the cache: ``create`` / ``update`` /
+``delete`` of ``vertices`` or ``edges``, with a resync whenever the graph
+had to be rebuilt from a store snapshot (cache replaced, or the tail fell
+off the store's change ring).
+
+Views can be scoped to the subtree of one node or device: the vertices
+reachable from it along containment edges (not connections), every edge
+touching them, and the far ends of those edges marked ``external``.
+"""
+
+import logging
+import threading
+import time
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+import change_log
+import resource_index
+import resource_store
+
+logger = logging.getLogger(__name__)
+
+VERTICES = "vertices"
+EDGES = "edges"
+
+BELONGS_TO_NODE = "belongs_to_node"
+BELONGS_TO_DEVICE = "belongs_to_device"
+SENDS_FLOW = "sends_flow"
+FLOW_OF_SOURCE = "flow_of_source"
+ACTIVE_CONNECTION = "active_connection"
+
+# Types a view can be scoped to
+SCOPE_TYPES = ("node", "device")
+
+
+class EdgeRule(NamedTuple):
+    path: Tuple[str, ...]
+    edge_type: str
+    # True if the referenced resource is the parent (edge source), False if the referring one is
+    reference_is_parent: bool
+    # The edge only exists while this field of the referring resource is truthy
+    while_set: Optional[Tuple[str, ...]] = None
+
+
+EDGE_RULES: Dict[str, List[EdgeRule]] = {
+    "devices": [EdgeRule(("node_id",), BELONGS_TO_NODE, True)],
+    "senders": [EdgeRule(("device_id",), BELONGS_TO_DEVICE, True),
+                EdgeRule(("flow_id",), SENDS_FLOW, False)],
+    "receivers": [EdgeRule(("device_id",), BELONGS_TO_DEVICE, True),
+                  EdgeRule(("subscription", "sender_id"), ACTIVE_CONNECTION, True, ("subscription", "active"))],
+    "flows": [EdgeRule(("device_id",), BELONGS_TO_DEVICE, True),
+              EdgeRule(("source_id",), FLOW_OF_SOURCE, False)],
+    "sources": [EdgeRule(("device_id",), BELONGS_TO_DEVICE, True)],
+}
+
+
+class TopologyView(NamedTuple):
+    epoch: str
+    sequence: int
+    # Store generation the graph reflects
+    generation: int
+    vertices: List[Dict[str, Any]]
+    edges: List[Dict[str, Any]]
+    # Far ends of edges that leave a scoped view (empty when unscoped)
+    external: List[Dict[str, Any]]
+
+
+class TopologyChanges(NamedTuple):
+    epoch: str
+    result: change_log.ChangesSince
+    # Current bodies of out-of-scope vertices the returned edges point at (scoped requests only)
+    external: List[Dict[str, Any]]
+
+
+class UnknownScope(LookupError):
+    """The scope root is not a cached node or device."""
+
+
+def _vertex(resource_type: str, resource: Dict[str, Any]) -> Dict[str, Any]:
+    return {"id": resource["id"], "type": resource_type[:-1], "label": resource.get("label", "")}
+
+
+def _owned_edges(resource_type: str, resource_id: str, resource: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    edges = {}
+    for rule in EDGE_RULES.get(resource_type, ()):
+        reference = resource_index.extract_field(resource, rule.path)
+        if reference is None:
+            continue
+        if rule.while_set is not None:
+            flag: Any = resource
+            for key in rule.while_set:
+                flag = flag.get(key) if isinstance(flag, dict) else None
+            if not flag:
+                continue
+        source, target = (reference, resource_id) if rule.reference_is_parent else (resource_id, reference)
+        key = f"{resource_id}:{rule.edge_type}"
+        edges[key] = {"id": key, "source": source, "target": target, "type": rule.edge_type}
+    return edges
+
+
+class TopologyGraph:
+    """
+    Topology of ``store``, brought up to date every ``interval`` seconds by a
+    background thread and by ``sync()`` before each read.
+    """
+
+    def __init__(self, store: resource_store.ResourceStore, interval: float = 0.25,
+                 capacity: int = 10000, batch_limit: int = 5000):
+        self.store = store
+        self.interval = interval
+        self.batch_limit = batch_limit
+        self.changes = change_log.ChangeLog(capacity=capacity)
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._vertices: Dict[str, Dict[str, Any]] = {}
+        self._edges: Dict[str, Dict[str, Any]] = {}
+        # Vertex id -> keys of the edges with an end there (whether or not that vertex is cached)
+        self._incident: Dict[str, Set[str]] = {}
+        # Position in the store's change log; None until the first build
+        self._store_sequence: Optional[int] = None
+        self.rebuilds = 0
+        self.store_changes_applied = 0
+        self.last_rebuild_seconds: Optional[float] = None
+
+    # --- Maintenance ---
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="topology-graph", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        self._stop_event.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=timeout)
+        self._thread = None
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.sync()
+            except Exception as e:
+                logger.error(f"Updating the topology graph failed: {e}", exc_info=True)
+
+    def sync(self) -> int:
+        """Applies the store changes since the last call. Returns the topology sequence."""
+        with self._lock:
+            store_log = self.store.change_log
+            for _ in range(3):
+                if self._store_sequence is None:
+                    self._rebuild()
+                result = store_log.changes_since(self._store_sequence, limit=self.batch_limit)
+                while not result.resync_required and result.changes:
+                    self._apply_entries(result.changes)
+                    if not result.has_more:
+                        break
+                    result = store_log.changes_since(self._store_sequence, limit=self.batch_limit)
+                if not result.resync_required:
+                    break
+                # Cache replaced, or the store's ring overtook us: start again from a snapshot
+                self._store_sequence = None
+            return self.changes.sequence
+
+    def _rebuild(self):
+        started = time.monotonic()
+        snapshot = self.store.snapshot
+        self._vertices, self._edges, self._incident = {}, {}, {}
+        for resource_type in snapshot.resources:
+            for resource in snapshot.values(resource_type):
+                self._apply(resource_type, resource["id"], resource, None)
+        self._store_sequence = snapshot.generation
+        # Clients following the topology deltas cannot cross a rebuild
+        self.changes.reset()
+        self.rebuilds += 1
+        self.last_rebuild_seconds = time.monotonic() - started
+        logger.info(f"Topology graph rebuilt at generation {snapshot.generation}: "
+                    f"{len(self._vertices)} vertices, {len(self._edges)} edges in {self.last_rebuild_seconds:.3f}s")
+
+    def _apply_entries(self, entries: Iterable[change_log.ChangeEntry]):
+        graph_changes: List[Tuple[str, str, str, Optional[Dict[str, Any]]]] = []
+        recorded_at = None
+        for entry in entries:
+            resource = entry.resource if entry.operation != change_log.OP_DELETE else None
+            self._apply(entry.resource_type, entry.resource_id, resource, graph_changes)
+            self._store_sequence = entry.sequence
+            recorded_at = entry.recorded_at
+            self.store_changes_applied += 1
+        for operation, kind, key, body in graph_changes:
+            self.changes.record(operation, kind, key, body, recorded_at)
+
+    def _visible(self, edge: Dict[str, Any]) -> bool:
+        return edge["source"] in self._vertices and edge["target"] in self._vertices
+
+    def _link(self, key: str, edge: Dict[str, Any]):
+        self._edges[key] = edge
+        self._incident.setdefault(edge["source"], set()).add(key)
+        self._incident.setdefault(edge["target"], set()).add(key)
+
+    def _unlink(self, key: str):
+        edge = self._edges.pop(key)
+        for end in (edge["source"], edge["target"]):
+            keys = self._incident.get(end)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._incident[end]
+
+    def _apply(self, resource_type: str, resource_id: str, resource: Optional[Dict[str, Any]],
+               graph_changes: Optional[List[Tuple[str, str, str, Optional[Dict[str, Any]]]]]):
+        """
+        Brings the vertex of one resource (None: deleted) and the edges it owns
+        up to date. Visible graph changes are appended to ``graph_changes``
+        unless it is None (rebuilds).
+        """
+        old_vertex = self._vertices.get(resource_id)
+        new_vertex = _vertex(resource_type, resource) if resource is not None else None
+        if old_vertex is None and new_vertex is None:
+            return
+        old_owned = [key for key in (f"{resource_id}:{rule.edge_type}"
+                                     for rule in EDGE_RULES.get(f"{old_vertex['type']}s", ()))
+                     if key in self._edges] if old_vertex is not None else []
+        new_owned = _owned_edges(resource_type, resource_id, resource) if resource is not None else {}
+
+        affected: Set[str] = set(old_owned) | set(new_owned)
+        if (old_vertex is None) != (new_vertex is None):
+            # Appearing or disappearing changes the visibility of every edge ending here
+            affected |= self._incident.get(resource_id, set())
+        before = ({key: self._edges[key] for key in affected if key in self._edges and self._visible(self._edges[key])}
+                  if graph_changes is not None else None)
+
+        for key in old_owned:
+            self._unlink(key)
+        if new_vertex is None:
+            del self._vertices[resource_id]
+        else:
+            self._vertices[resource_id] = new_vertex if new_vertex != old_vertex else old_vertex
+        for key, edge in new_owned.items():
+            self._link(key, edge)
+
+        if graph_changes is None:
+            return
+        after = {key: self._edges[key] for key in affected if key in self._edges and self._visible(self._edges[key])}
+        for key in before:
+            if key not in after:
+                graph_changes.append((change_log.OP_DELETE, EDGES, key, None))
+        if old_vertex is None:
+            graph_changes.append((change_log.OP_CREATE, VERTICES, resource_id, new_vertex))
+        elif new_vertex is None:
+            graph_changes.append((change_log.OP_DELETE, VERTICES, resource_id, None))
+        elif new_vertex != old_vertex:
+            graph_changes.append((change_log.OP_UPDATE, VERTICES, resource_id, new_vertex))
+        for key, edge in after.items():
+            previous = before.get(key)
+            if previous is None:
+                graph_changes.append((change_log.OP_CREATE, EDGES, key, edge))
+            elif previous != edge:
+                graph_changes.append((change_log.OP_UPDATE, EDGES, key, edge))
+
+    # --- Reads ---
+
+    def _scope(self, root_id: str, root_type: str) -> Tuple[Set[str], Dict[str, Dict[str, Any]], Set[str]]:
+        """Subtree of ``root_id``: its vertex ids, the visible edges touching them and the ids of their far ends."""
+        root = self._vertices.get(root_id)
+        if root is None or root["type"] != root_type:
+            raise UnknownScope(f"no cached {root_type} '{root_id}'")
+        scope = {root_id}
+        pending = [root_id]
+        while pending:
+            vertex_id = pending.pop()
+            for key in self._incident.get(vertex_id, ()):
+                edge = self._edges[key]
+                child = edge["target"]
+                if (edge["source"] == vertex_id and edge["type"] != ACTIVE_CONNECTION
+                        and child not in scope and child in self._vertices):
+                    scope.add(child)
+                    pending.append(child)
+        edges = {}
+        for vertex_id in scope:
+            for key in self._incident.get(vertex_id, ()):
+                edge = self._edges[key]
+                if self._visible(edge):
+                    edges[key] = edge
+        external = {end for edge in edges.values() for end in (edge["source"], edge["target"]) if end not in scope}
+        return scope, edges, external
+
+    def view(self, root_id: Optional[str] = None, root_type: Optional[str] = None) -> TopologyView:
+        """The whole graph, or the subtree of one node or device (raises UnknownScope)."""
+        with self._lock:
+            if root_id is None:
+                return TopologyView(self.changes.epoch, self.changes.sequence, self._store_sequence,
+                                    list(self._vertices.values()),
+                                    [edge for edge in self._edges.values() if self._visible(edge)], [])
+            scope, edges, external = self._scope(root_id, root_type)
+            return TopologyView(self.changes.epoch, self.changes.sequence, self._store_sequence,
+                                [self._vertices[vertex_id] for vertex_id in scope], list(edges.values()),
+                                [{**self._vertices[vertex_id], "external": True} for vertex_id in external])
+
+    def changes_since(self, since: int, epoch: Optional[str] = None, limit: Optional[int] = None,
+                      root_id: Optional[str] = None, root_type: Optional[str] = None) -> TopologyChanges:
+        """
+        Graph changes after ``since``. When scoped, creates and updates are
+        kept if they touch the subtree (as it is now); deletions are always
+        kept, since what they removed can no longer be placed.
+        """
+        result = self.changes.changes_since(since, epoch=epoch, limit=limit)
+        if root_id is None or result.resync_required:
+            return TopologyChanges(self.changes.epoch, result, [])
+        with self._lock:
+            scope, _, external = self._scope(root_id, root_type)
+            near = scope | external
+            kept = []
+            far_ends: Set[str] = set()
+            for entry in result.changes:
+                if entry.operation == change_log.OP_DELETE:
+                    kept.append(entry)
+                elif entry.resource_type == VERTICES:
+                    if entry.resource_id in near:
+                        kept.append(entry)
+                else:
+                    ends = (entry.resource["source"], entry.resource["target"])
+                    if ends[0] in scope or ends[1] in scope:
+                        kept.append(entry)
+                        far_ends.update(end for end in ends if end not in scope)
+            far_vertices = [{**self._vertices[vertex_id], "external": True}
+                            for vertex_id in far_ends if vertex_id in self._vertices]
+        return TopologyChanges(self.changes.epoch, result._replace(changes=kept), far_vertices)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            visible = sum(1 for edge in self._edges.values() if self._visible(edge))
+            return {
+                "vertices": len(self._vertices),
+                "edges": visible,
+                "dangling_edges": len(self._edges) - visible,
+                "sequence": self.changes.sequence,
+                "generation": self._store_sequence,
+                "lag": self.store.change_log.sequence - (self._store_sequence or 0),
+                "rebuilds": self.rebuilds,
+                "store_changes_applied": self.store_changes_applied,
+                "last_rebuild_seconds": self.last_rebuild_seconds,
+            }
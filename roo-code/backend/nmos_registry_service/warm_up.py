@@ -0,0 +1,108 @@
+"""
+Start-up warm-up tracking for the NMOS Registry Service.
+
+The service answers HTTP as soon as its event loop runs; filling the cache
+(loading the snapshot, discovery or reconciliation against the registries,
+starting the subscriptions) happens afterwards in a background task that
+applies discovered pages to the store as they arrive, so the inventory is
+queryable while it grows. ``WarmUp`` records the phases of that task, which
+is what separates readiness (warm-up finished) from liveness (the process
+answers), and measures the time from process start to ready.
+
+Phases that fail are recorded with their error; warm-up still completes and
+the service becomes ready with what it has, since a registry that is down at
+start-up is caught up with later by the resync machinery and restarting the
+service would not bring it back any sooner.
+"""
+
+import logging
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+STATE_STARTING = "starting"
+STATE_WARMING = "warming"
+STATE_READY = "ready"
+
+
+@dataclass
+class WarmUpPhase:
+    """One step of the warm-up."""
+    name: str
+    started_at: float
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+
+    @property
+    def duration(self) -> float:
+        end = self.finished_at if self.finished_at is not None else time.monotonic()
+        return end - self.started_at
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "status": "error" if self.error else ("done" if self.finished_at is not None else "running"),
+            "duration_seconds": round(self.duration, 3),
+            "error": self.error,
+        }
+
+
+class WarmUp:
+    """Phases and readiness of one start-up. ``started_at`` is the process start (``time.monotonic()``)."""
+
+    def __init__(self, started_at: Optional[float] = None):
+        self.started_at = started_at if started_at is not None else time.monotonic()
+        self.state = STATE_STARTING
+        self.phases: List[WarmUpPhase] = []
+        self.ready_at: Optional[float] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == STATE_READY
+
+    @property
+    def time_to_ready(self) -> Optional[float]:
+        return None if self.ready_at is None else self.ready_at - self.started_at
+
+    @property
+    def current_phase(self) -> Optional[str]:
+        running = [phase.name for phase in self.phases if phase.finished_at is None]
+        return running[-1] if running else None
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[WarmUpPhase]:
+        """Times one phase; an exception is recorded on the phase and re-raised."""
+        if self.state == STATE_STARTING:
+            self.state = STATE_WARMING
+        phase = WarmUpPhase(name, time.monotonic())
+        self.phases.append(phase)
+        try:
+            yield phase
+        except Exception as e:
+            phase.error = str(e) or type(e).__name__
+            raise
+        finally:
+            phase.finished_at = time.monotonic()
+            logger.info(f"Warm-up phase '{name}' {'failed' if phase.error else 'finished'} in {phase.duration:.3f}s")
+
+    def mark_ready(self) -> float:
+        """Ends the warm-up; returns the time to ready in seconds."""
+        if self.ready_at is None:
+            self.ready_at = time.monotonic()
+            self.state = STATE_READY
+            failed = [phase.name for phase in self.phases if phase.error]
+            logger.info(f"Ready {self.time_to_ready:.3f}s after start"
+                        + (f" (failed phases: {failed})" if failed else ""))
+        return self.time_to_ready
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "ready": self.ready,
+            "current_phase": self.current_phase,
+            "uptime_seconds": round(time.monotonic() - self.started_at, 3),
+            "time_to_ready_seconds": None if self.time_to_ready is None else round(self.time_to_ready, 3),
+            "phases": {phase.name: phase.as_dict() for phase in self.phases},
+        }
@@ -77,7 +77,8 @@ const audioMappingApiClient = axios.create({
 // 为简化，我们假设 /resources 返回所有内容。
 
 // 获取所有 NMOS 资源 (nodes, devices, senders, receivers, etc.)
-export const fetchAllNmosResources = async () => {
+// fields: 只返回需要的字段, 如 'id,label,device_id,subscription'; filter: 后端过滤表达式, 如 'device_id=X and label^=Cam'
+export const fetchAllNmosResources = async ({ fields, filter } = {}) => {
   const resourceTypes = ['nodes', 'devices', 'sources', 'flows', 'senders', 'receivers'];
   // 动态选择API版本路径，初始尝试使用v1.3
   // 注意：这里的逻辑需要调整，因为后端 /discover 端点不直接代理 NMOS Query API 的 /x-nmos/query/vX.Y/resources/{type} 路径
@@ -88,7 +89,7 @@ export const fetchAllNmosResources = async () => {
   // 假设前端需要的是缓存的资源列表，调用 /resources。
 
   try {
-    const response = await registryApiClient.get('/resources');
+    const response = await registryApiClient.get('/resources', { params: { fields, filter } });
     const results = response.data; // response.data 应该是 ResourcesResponse 模型对应的对象
     console.log('Fetched NMOS resources from backend /resources:', results);
 
@@ -132,6 +133,17 @@ export const fetchAllNmosResources = async () => {
   }
 };
 
+// 获取单一类型的资源 (GET /resources/{type})，同样支持 fields 投影和 filter 表达式
+export const fetchNmosResourcesOfType = async (resourceType, { fields, filter } = {}) => {
+  try {
+    const response = await registryApiClient.get(`/resources/${resourceType}`, { params: { fields, filter } });
+    return response.data;
+  } catch (error) {
+    console.error(`获取 ${resourceType} 资源失败:`, error.response ? error.response.data : error.message);
+    throw error;
+  }
+};
+
 // 如果需要单独获取 Nodes, Devices 等，可以从 fetchAllNmosResources 的结果中筛选，
 // 或者要求后端 nmos_registry_service 提供更具体的端点。
 // 以下函数假设从 fetchAllNmosResources 筛选，或者将来后端会提供这些端点。
@@ -338,20 +350,11 @@ export const fetchEventRules = async () => {
   }
 };
 
-// 模拟获取拓扑数据的API (在 NetworkTopology.js 中使用 /api/topology)
-// 这个端点当前没有在任何后端服务中明确定义。
-// 它可能需要从 registry_service 获取所有资源，然后由前端或一个新的后端服务来构建拓扑。
-// 为了保持一致，我们假设它将由 registry_service 提供，或者是一个需要将来实现的专用拓扑服务。
-// 如果由 registry_service 提供，它可能只是 /resources 的别名或经过处理的版本。
+// 获取构建拓扑所需的全部原始资源 (GET /resources)，由调用方自行把 NMOS 资源转换为节点和链接。
+// 注册服务已提供拼接好的拓扑图，新代码请使用下面的 fetchTopology。
 export const fetchTopologyData = async () => {
   try {
-    // 假设拓扑数据最终来自注册服务的所有资源
-    const response = await registryApiClient.get('/resources'); // 或一个专门的 /topology 端点
-    // 在这里，可能需要对 response.data 进行转换以匹配 NetworkTopology 组件期望的格式
-    // NetworkTopology 组件期望 { nodes: [], links: [] }
-    // 而 /resources 返回 { nodes: [...nmos_nodes], devices: [...], senders: [...], ... }
-    // 需要一个转换函数将 NMOS 资源转换为 D3 的节点和链接。
-    // 为简单起见，我们只返回原始数据，转换逻辑应在调用方或此函数内部。
+    const response = await registryApiClient.get('/resources');
     return response.data;
   } catch (error) {
     console.error('获取网络拓扑数据失败:', error.response ? error.response.data : error.message);
@@ -359,6 +362,32 @@ export const fetchTopologyData = async () => {
   }
 };
 
+// 获取注册服务增量维护的拓扑图 (GET /topology): { epoch, sequence, vertices, edges, external }
+// 边类型: belongs_to_node, belongs_to_device, sends_flow, flow_of_source, active_connection
+// nodeId / deviceId: 只获取该节点或设备的子树 (子树外的连接端点在 external 中)
+export const fetchTopology = async ({ nodeId, deviceId } = {}) => {
+  try {
+    const response = await registryApiClient.get('/topology', { params: { node_id: nodeId, device_id: deviceId } });
+    return response.data;
+  } catch (error) {
+    console.error('获取网络拓扑数据失败:', error.response ? error.response.data : error.message);
+    throw error;
+  }
+};
+
+// 拓扑图增量变更 (GET /topology/changes); resync_required 为 true 时需重新调用 fetchTopology
+export const fetchTopologyChanges = async ({ since, epoch, nodeId, deviceId } = {}) => {
+  try {
+    const response = await registryApiClient.get('/topology/changes', {
+      params: { since, epoch, node_id: nodeId, device_id: deviceId },
+    });
+    return response.data;
+  } catch (error) {
+    console.error('获取拓扑变更失败:', error.response ? error.response.data : error.message);
+    throw error;
+  }
+};
+
 
 // 默认导出一个通用的 apiClient 实例可能不再合适，
 // 因为我们现在有针对特定服务的实例。
@@ -9,6 +9,9 @@ import RefreshIcon from '@mui/icons-material/Refresh';
 import { fetchAllNmosResources, performConnection } from '../api';
 import store from '../store';
 
+// 连接表格只用到收发器的这些字段，让后端只返回它们
+const CONNECTION_TABLE_FIELDS = 'id,label,device_id,subscription';
+
 // 发送器选择对话框组件
 const SenderSelectionDialog = ({ open, onClose, receiverId, currentSenderId, availableSenders, onSenderSelect }) => (
   <Dialog open={open} onClose={onClose} maxWidth="md" fullWidth>
@@ -80,7 +83,7 @@ export default function Connections() {
   const fetchData = async () => {
     dispatch({ type: 'FETCH_CONNECTIONS_REQUEST' });
     try {
-      const nmosData = await fetchAllNmosResources();
+      const nmosData = await fetchAllNmosResources({ fields: CONNECTION_TABLE_FIELDS });
       let derivedConnections = [];
       if (nmosData && nmosData.receivers && Array.isArray(nmosData.receivers)) {
         for (const receiver of nmosData.receivers) {
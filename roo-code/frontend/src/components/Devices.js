@@ -3,7 +3,10 @@ import { Typography, Box, Table, TableBody, TableCell, TableContainer, TableHead
 import { useSelector, useDispatch } from 'react-redux';
 import { ArrowUpward, ArrowDownward } from '@mui/icons-material';
 // 导入 api.js 中的函数
-import { fetchNodes, fetchDevices, fetchSenders, fetchReceivers, fetchAllNmosResources } from '../api';
+import { fetchNodes, fetchDevices, fetchSenders, fetchReceivers, fetchAllNmosResources, fetchNmosResourcesOfType } from '../api';
+
+// 设备表格只显示这些字段，让后端只返回它们
+const DEVICE_TABLE_FIELDS = 'id,label,type,node_id';
 
 export default function Devices() {
   const dispatch = useDispatch();
@@ -27,15 +30,15 @@ export default function Devices() {
     const fetchData = async () => {
       dispatch({ type: 'FETCH_DEVICES_REQUEST' });
       try {
-        // Fetch all resources in one go, then dispatch
-        const allNmosData = await fetchAllNmosResources(); 
+        // Fetch only the devices, projected to the table columns, then dispatch
+        const devices = await fetchNmosResourcesOfType('devices', { fields: DEVICE_TABLE_FIELDS });
         // The payload for FETCH_DEVICES_SUCCESS should ideally be just the list of devices.
         // If it needs nodes, senders, receivers, the reducer and state structure must accommodate this.
         // For simplicity, if devicesReducer.js expects { nodes, devices, senders, receivers }:
         // dispatch({ type: 'FETCH_DEVICES_SUCCESS', payload: allNmosData });
         
         // Or, if FETCH_DEVICES_SUCCESS only expects a list of devices:
-        dispatch({ type: 'FETCH_DEVICES_SUCCESS', payload: allNmosData.devices || [] });
+        dispatch({ type: 'FETCH_DEVICES_SUCCESS', payload: devices || [] });
         
         // If you need nodes, senders, receivers in other parts of Redux store, dispatch separate actions:
         // dispatch({ type: 'FETCH_NODES_SUCCESS', payload: allNmosData.nodes || [] });
@@ -5,7 +5,7 @@ import { fetchAllNmosResources, performConnection } from '../api';
 import * as d3 from 'd3';
 <<<<<<< HEAD
 =======
-import { fetchAllNmosResources, performConnection } from '../api'; // 确保这是从 api.js 正确导入的
+import { fetchTopology, performConnection } from '../api'; // 确保这是从 api.js 正确导入的
 import { 
     Box, 
     Typography, 
@@ -231,6 +231,26 @@ export default function NetworkTopology() {
     return { nodes, links: validLinks };
 };
 
+// 注册服务 /topology 返回的拓扑图 (已在后端完成关联) 转换为 D3 的 nodes / links
+const transformTopologyToD3 = (topology) => {
+    const nodes = [...topology.vertices, ...topology.external].map(vertex => ({
+        id: vertex.id,
+        label: vertex.label || vertex.id,
+        group: vertex.type === 'node' ? 'nmos_node' : vertex.type,
+        type: vertex.type,
+        external: !!vertex.external,
+        selected: false,
+        canBeSelected: vertex.type === 'sender' || vertex.type === 'receiver',
+    }));
+    const links = topology.edges.map(edge => ({
+        source: edge.source,
+        target: edge.target,
+        type: edge.type,
+        ...(edge.type === 'active_connection' ? { value: 5 } : {}),
+    }));
+    return { nodes, links };
+};
+
 
 function NetworkTopology() {
     const svgRef = useRef(null);
@@ -329,8 +349,8 @@ function NetworkTopology() {
 
         const fetchDataAndDraw = async () => {
             try {
-                const nmosData = await fetchAllNmosResources();
-                let { nodes: transformedNodes, links: transformedLinks } = transformNmosDataToD3(nmosData);
+                const topology = await fetchTopology();
+                let { nodes: transformedNodes, links: transformedLinks } = transformTopologyToD3(topology);
 
                 // Apply filter
                 if (debouncedFilter) {